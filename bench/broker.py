@@ -0,0 +1,111 @@
+"""
+Loopback stand-in MQTT broker for benchmarks.
+
+Implements just enough of MQTT 3.1.1 for picosense: CONNECT, PUBLISH with
+QoS 0/1, PINGREQ and DISCONNECT. Received messages are handed to an
+optional callback together with their arrival time, and the broker can be
+told to stall (stop reading and acknowledging) to simulate a slow or hung
+broker.
+"""
+
+import asyncio
+import struct
+import time
+
+
+class Broker:
+    def __init__(self, on_message=None, ack_delay_ms=0):
+        self.on_message = on_message
+        self.ack_delay_ms = ack_delay_ms
+        self.messages = 0
+        self.bytes = 0
+        self.connects = 0
+        self.stalled = False
+        self.port = 0
+        self._server = None
+        self._writers = []
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await asyncio.start_server(self._handle, host, port)
+        if not port:
+            # CPython exposes the listening sockets, MicroPython needs a port
+            port = self._server.sockets[0].getsockname()[1]
+        self.port = port
+        return port
+
+    def close(self):
+        for writer in self._writers:
+            writer.close()
+        self._writers = []
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def stall(self, duration_ms):
+        self.stalled = True
+        await asyncio.sleep_ms(duration_ms)
+        self.stalled = False
+
+    async def _wait_unstalled(self):
+        while self.stalled:
+            await asyncio.sleep_ms(5)
+
+    async def _read_packet(self, reader):
+        header = (await reader.readexactly(1))[0]
+        length = 0
+        shift = 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        body = await reader.readexactly(length) if length else b""
+        return header, body
+
+    async def _ack(self, writer, pid):
+        if self.ack_delay_ms:
+            await asyncio.sleep_ms(self.ack_delay_ms)
+        await self._wait_unstalled()
+        try:
+            writer.write(b"\x40\x02" + pid)
+            await writer.drain()
+        except OSError:
+            # The client went away before it could be acknowledged
+            pass
+
+    async def _handle(self, reader, writer):
+        self._writers.append(writer)
+        try:
+            while True:
+                await self._wait_unstalled()
+                header, body = await self._read_packet(reader)
+                kind = header & 0xF0
+                if kind == 0x10:
+                    self.connects += 1
+                    writer.write(b"\x20\x02\x00\x00")
+                elif kind == 0x30:
+                    topic_len = struct.unpack("!H", body[:2])[0]
+                    topic = body[2 : 2 + topic_len].decode()
+                    offset = 2 + topic_len
+                    pid = None
+                    if header & 0x06:
+                        pid = body[offset : offset + 2]
+                        offset += 2
+                    self.messages += 1
+                    self.bytes += len(body)
+                    if self.on_message is not None:
+                        self.on_message(topic, body[offset:], time.ticks_us())
+                    if pid is not None:
+                        asyncio.create_task(self._ack(writer, pid))
+                elif kind == 0xC0:
+                    writer.write(b"\xd0\x00")
+                elif kind == 0xE0:
+                    break
+                await writer.drain()
+        except (EOFError, OSError):
+            pass
+        finally:
+            if writer in self._writers:
+                self._writers.remove(writer)
+            writer.close()
@@ -0,0 +1,39 @@
+"""
+Fill in the MicroPython APIs picosense uses when running under CPython.
+
+Nothing is changed when running on the MicroPython unix port.
+"""
+
+import asyncio
+import sys
+import time
+
+if not hasattr(time, "ticks_ms"):
+    _PERIOD = 1 << 30
+
+    def _ticks(ns_per_tick):
+        return (time.monotonic_ns() // ns_per_tick) & (_PERIOD - 1)
+
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & (_PERIOD - 1)
+
+    def ticks_diff(a, b):
+        return ((a - b + _PERIOD // 2) & (_PERIOD - 1)) - _PERIOD // 2
+
+    time.ticks_ms = lambda: _ticks(1000000)
+    time.ticks_us = lambda: _ticks(1000)
+    time.ticks_add = ticks_add
+    time.ticks_diff = ticks_diff
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+
+if not hasattr(asyncio, "sleep_ms"):
+    asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+
+if not hasattr(sys, "print_exception"):
+    import traceback
+
+    sys.print_exception = lambda e, file=None: traceback.print_exception(
+        type(e), e, e.__traceback__, file=file
+    )
+
+sys.modules.setdefault("uasyncio", asyncio)
@@ -0,0 +1,104 @@
+from typing import Callable, Dict, List, Optional
+
+# errno values raised by machine.I2C
+ENODEV = 19
+EIO = 5
+
+
+class FakeI2CDevice:
+    """
+    Register map of a simulated I2C device.
+
+    Attributes:
+        registers (bytearray): 256 byte register memory.
+        writes (list): (register, data) tuples of all writes. The register is
+            None for plain writes, e.g. commands of command based devices.
+        on_write (callable): Optional hook called with (device, register, data)
+            after a write, used to simulate device behaviour.
+        response (bytes): Returned by plain reads.
+        fail (bool): Raise EIO on every access while set.
+    """
+
+    def __init__(
+        self,
+        registers: Optional[Dict[int, int]] = None,
+        on_write: Optional[Callable] = None,
+    ):
+        self.registers = bytearray(256)
+        for reg, value in (registers or {}).items():
+            self.registers[reg] = value
+        self.writes: List[tuple] = []
+        self.on_write = on_write
+        self.response = b""
+        self.fail = False
+
+    def set(self, reg: int, data) -> None:
+        """Set consecutive registers starting at reg."""
+        self.registers[reg : reg + len(data)] = bytes(data)
+
+    def read(self, reg: int, nbytes: int) -> bytes:
+        self._check()
+        return bytes(self.registers[reg : reg + nbytes])
+
+    def write(self, reg: Optional[int], data) -> None:
+        self._check()
+        data = bytes(data)
+        if reg is not None:
+            self.registers[reg : reg + len(data)] = data
+        self.writes.append((reg, data))
+        if self.on_write is not None:
+            self.on_write(self, reg, data)
+
+    def read_raw(self, nbytes: int) -> bytes:
+        self._check()
+        return bytes(self.response[:nbytes])
+
+    def _check(self):
+        if self.fail:
+            raise OSError(EIO)
+
+
+class FakeI2C:
+    """
+    Stand-in for machine.I2C backed by FakeI2CDevice register maps.
+
+    Supports the plain and memory read/write subset of the machine.I2C API so that
+    sensor wrappers and the bus arbiter can be exercised on Linux.
+    """
+
+    def __init__(self):
+        self.devices: Dict[int, FakeI2CDevice] = {}
+
+    def add_device(self, addr: int, device: FakeI2CDevice) -> FakeI2CDevice:
+        self.devices[addr] = device
+        return device
+
+    def scan(self) -> List[int]:
+        return sorted(self.devices)
+
+    def readfrom_mem(
+        self, addr: int, memaddr: int, nbytes: int, addrsize=8
+    ) -> bytes:
+        return self._device(addr).read(memaddr, nbytes)
+
+    def readfrom_mem_into(self, addr: int, memaddr: int, buf, addrsize=8) -> None:
+        buf[:] = self._device(addr).read(memaddr, len(buf))
+
+    def writeto_mem(self, addr: int, memaddr: int, buf, addrsize=8) -> None:
+        self._device(addr).write(memaddr, buf)
+
+    def readfrom(self, addr: int, nbytes: int, stop: bool = True) -> bytes:
+        return self._device(addr).read_raw(nbytes)
+
+    def readfrom_into(self, addr: int, buf, stop: bool = True) -> None:
+        buf[:] = self._device(addr).read_raw(len(buf))
+
+    def writeto(self, addr: int, buf, stop: bool = True) -> int:
+        self._device(addr).write(None, buf)
+        return 1
+
+    def _device(self, addr: int) -> FakeI2CDevice:
+        device = self.devices.get(addr)
+        if device is None:
+            raise OSError(ENODEV)
+        return device
@@ -0,0 +1,276 @@
+"""
+Host-side throughput and latency benchmark for the picosense pipeline.
+
+Runs SensorReader -> callbacks -> MQTTMessagingProvider -> Queue ->
+publisher loop -> loopback stand-in broker with synthetic sensors, on CPython
+or the MicroPython unix port:
+
+    python bench/run.py [scenario ...] [key=value ...]
+    micropython bench/run.py steady duration=30
+
+Every reading carries a sequence number as its values so that the broker can
+match it back to the time it was taken. Reported per scenario:
+
+    msgs/s        Messages received by the broker per second
+    readings/s    Readings delivered per second
+    p50/p90/p99   Reading to broker latency in ms
+    lost          Readings that never reached the broker
+    alloc         Bytes (MicroPython) or net blocks (CPython) allocated per
+                  reading in the read and callback path
+    queue hwm     Highest publish queue depth seen
+"""
+
+import sys
+
+# Make the stubs and the repository importable when run as a script
+_here = sys.argv[0].rsplit("/", 1)[0] if "/" in sys.argv[0] else "."
+sys.path.insert(0, _here + "/stubs")
+sys.path.insert(0, _here + "/..")
+sys.path.insert(0, _here)
+
+import compat  # noqa: E402,F401
+
+import asyncio  # noqa: E402
+import gc  # noqa: E402
+import json  # noqa: E402
+import logging  # noqa: E402
+import time  # noqa: E402
+
+from broker import Broker  # noqa: E402
+
+from picosense.messaging.mqtt import MQTTMessagingProvider  # noqa: E402
+from picosense.sensors.reader import Reading, SensorReader  # noqa: E402
+
+SCENARIOS = {
+    # Two sensors at a moderate rate, one message per measurement
+    "steady": {},
+    # Same load published as one message per reading
+    "batched": {"mode": "reading"},
+    # Readings collected over one second per message
+    "windowed": {"mode": "reading", "batch_window": 1},
+    # High sample rate to find the throughput ceiling
+    "burst": {"sensors": 4, "rate": 50},
+    # Broker stops responding for 2 s every 5 s
+    "stalls": {"stall_every": 5, "stall_duration": 2},
+    # Slow PUBACKs, e.g. a broker across a congested uplink
+    "slow_acks": {"ack_delay_ms": 50},
+}
+
+DEFAULTS = {
+    "sensors": 2,
+    "metrics": 3,
+    "rate": 5,
+    "duration": 10,
+    "mode": "measurement",
+    "batch_window": 0,
+    "queue_maxsize": 500,
+    "stall_every": 0,
+    "stall_duration": 0,
+    "ack_delay_ms": 0,
+}
+
+
+def _alloc_counter():
+    if hasattr(gc, "mem_alloc"):
+        return gc.mem_alloc
+    return sys.getallocatedblocks
+
+
+class SyntheticSensor:
+    """Sensor wrapper that reuses one reading and sets all values to a sequence."""
+
+    def __init__(self, index, metrics, tracker, counter):
+        self.tracker = tracker
+        self.counter = counter
+        self.alloc_start = 0
+        self._reading = Reading.from_layout(
+            tuple(("metric_%d" % i, "u") for i in range(metrics)),
+            "sensor_%d" % index,
+        )
+
+    async def read(self):
+        self.alloc_start = self.counter()
+        seq = self.tracker.next_seq()
+        self._reading.timestamp = time.time()
+        for m in self._reading.measurements:
+            m.value = seq
+        return self._reading
+
+
+class Tracker:
+    """Matches readings to their arrival at the broker."""
+
+    def __init__(self):
+        self.seq = 0
+        self.sent = {}
+        self.received = {}
+        self.alloc = 0
+        self.alloc_samples = 0
+
+    def next_seq(self):
+        self.seq += 1
+        self.sent[self.seq] = time.ticks_us()
+        return self.seq
+
+    def on_message(self, topic, payload, ticks):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        if "readings" in data:
+            seqs = [int(row[1]) for row in data["readings"]]
+        elif "value" in data:
+            seqs = [int(data["value"])]
+        else:
+            return
+        for seq in seqs:
+            if seq not in self.received:
+                self.received[seq] = ticks
+
+    def latencies_ms(self):
+        out = []
+        for seq, ticks in self.received.items():
+            sent = self.sent.get(seq)
+            if sent is not None:
+                out.append(time.ticks_diff(ticks, sent) / 1000)
+        out.sort()
+        return out
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run_scenario(name, params):
+    tracker = Tracker()
+    broker = Broker(on_message=tracker.on_message, ack_delay_ms=params["ack_delay_ms"])
+    port = await broker.start()
+
+    provider = MQTTMessagingProvider(
+        "bench",
+        "lab",
+        "127.0.0.1",
+        port,
+        queue_maxsize=params["queue_maxsize"],
+        publish_mode=params["mode"],
+        batch_window=params["batch_window"],
+    )
+    provider.start()
+
+    counter = _alloc_counter()
+
+    def measured_callback(sensor):
+        async def callback(reading):
+            await provider.publish_measurements_from_reading_async(reading)
+            tracker.alloc += counter() - sensor.alloc_start
+            tracker.alloc_samples += 1
+
+        return callback
+
+    readers = []
+    interval = 1 / params["rate"]
+    for i in range(params["sensors"]):
+        sensor = SyntheticSensor(i, params["metrics"], tracker, counter)
+        reader = SensorReader(
+            "sensor_%d" % i,
+            read_func=sensor.read,
+            interval=interval,
+            phase=interval * i / params["sensors"],
+        )
+        reader.add_callback(measured_callback(sensor))
+        readers.append(reader)
+
+    async def inject_stalls():
+        if not params["stall_every"]:
+            return
+        while True:
+            await asyncio.sleep(params["stall_every"])
+            await broker.stall(int(params["stall_duration"] * 1000))
+
+    tasks = [asyncio.create_task(r.run()) for r in readers]
+    helpers = [
+        asyncio.create_task(inject_stalls()),
+    ]
+
+    start = time.ticks_ms()
+    await asyncio.sleep(params["duration"])
+    for reader in readers:
+        reader.stop()
+    for task in helpers:
+        task.cancel()
+    broker.stalled = False
+
+    # Give the publisher time to drain what is still queued
+    for _ in range(100):
+        if not provider._publish_queue.qsize() and len(tracker.received) >= len(
+            tracker.sent
+        ):
+            break
+        await asyncio.sleep_ms(50)
+    elapsed = time.ticks_diff(time.ticks_ms(), start) / 1000
+
+    for task in tasks:
+        task.cancel()
+    provider.stop()
+    await provider.disconnect()
+    broker.close()
+
+    latencies = tracker.latencies_ms()
+    return {
+        "scenario": name,
+        "msgs/s": broker.messages / elapsed,
+        "readings/s": len(tracker.received) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+        "lost": len(tracker.sent) - len(tracker.received),
+        "alloc": tracker.alloc / max(1, tracker.alloc_samples),
+        "queue hwm": provider.queue_stats()["high_water"],
+    }
+
+
+def parse_args(argv):
+    names = []
+    overrides = {}
+    for arg in argv:
+        if "=" in arg:
+            key, value = arg.split("=", 1)
+            if key not in DEFAULTS:
+                raise SystemExit("Unknown parameter %s" % key)
+            overrides[key] = value if key == "mode" else float(value)
+        elif arg in SCENARIOS:
+            names.append(arg)
+        else:
+            raise SystemExit("Unknown scenario %s" % arg)
+    return names or list(SCENARIOS), overrides
+
+
+def print_row(values):
+    print("  ".join(("%10s" % v) for v in values))
+
+
+async def main():
+    names, overrides = parse_args(sys.argv[1:])
+    columns = ["scenario", "msgs/s", "readings/s", "p50", "p90", "p99", "lost"]
+    columns += ["alloc", "queue hwm"]
+    print_row(columns)
+    for name in names:
+        params = dict(DEFAULTS)
+        params.update(SCENARIOS[name])
+        params.update(overrides)
+        for key in ("sensors", "metrics", "queue_maxsize"):
+            params[key] = int(params[key])
+        result = await run_scenario(name, params)
+        print_row(
+            [
+                result[c] if isinstance(result[c], (str, int)) else "%.1f" % result[c]
+                for c in columns
+            ]
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(main())
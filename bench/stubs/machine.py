@@ -0,0 +1,38 @@
+"""Minimal machine module for running picosense off the device."""
+
+import time
+
+from fake_i2c import FakeI2C
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+
+    def __init__(self, pin_id, mode=-1, value=None):
+        self.pin_id = pin_id
+        self._value = value or 0
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+
+class I2C(FakeI2C):
+    def __init__(self, bus_id=0, sda=None, scl=None, freq=400000):
+        super().__init__()
+
+
+def lightsleep(ms=0):
+    time.sleep(ms / 1000)
+
+
+def reset():
+    raise SystemExit("machine.reset()")
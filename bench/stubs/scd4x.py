@@ -0,0 +1,18 @@
+"""Stand-in for the SCD4X driver with data always ready."""
+
+
+class SCD4X:
+    temperature = 21.0
+    relative_humidity = 40.0
+    CO2 = 450
+
+    def __init__(self, i2c, address=0x62):
+        self.i2c = i2c
+        self.address = address
+
+    @property
+    def data_ready(self):
+        return True
+
+    def start_periodic_measurement(self):
+        pass
@@ -13,12 +13,6 @@ dependencies = [
         "homepage": "https://github.com/micropython/micropython-lib/tree/master/python-stdlib/logging",
         "url": "github:josverl/micropython-stubs/mip/typing_extensions.mpy",
     },
-    {
-        "name": "ntptime",
-        "authors": ["micropython-lib"],
-        "homepage": "https://github.com/micropython/micropython-lib/tree/master/micropython/net/ntptime",
-        "url": "ntptime",
-    },
     {
         "name": "logging",
         "authors": ["micropython-lib"],
@@ -31,24 +25,12 @@ dependencies = [
         "homepage": "https://github.com/micropython/micropython-lib/tree/master/python-stdlib/time",
         "url": "time",
     },
-    {
-        "name": "umqtt",
-        "authors": ["micropython-lib"],
-        "homepage": "https://github.com/micropython/micropython-lib/tree/master/micropython/umqtt.simple",
-        "url": "umqtt.simple",
-    },
     {
         "name": "bh1750",
         "authors": ["flrrth"],
         "homepage": "https://github.com/flrrth/pico-bh1750",
         "url": "https://raw.githubusercontent.com/flrrth/pico-bh1750/04493a20ccef2babe4cb457dd2f1e2fdecc50433/bh1750/bh1750.py",
     },
-    {
-        "name": "bme688",
-        "authors": ["Limor Fried", "CRCibernetica"],
-        "homepage": "https://github.com/CRCibernetica/bme688-i2c-micropython",
-        "url": "https://raw.githubusercontent.com/CRCibernetica/bme688-i2c-micropython/07a7b9fb775ef4466fe3e65e03f95dfd740be676/bme688.py",
-    },
     {
         "name": "scd4x",
         "authors": ["Scott Shawcroft", "peter-l5"],
@@ -0,0 +1,127 @@
+import asyncio
+import random
+import time
+from typing import List, Optional
+
+from picosense.system.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class BrokerEndpoint:
+    """
+    A broker address together with its recent connection health.
+
+    Attributes:
+        host (str): Host name or address of the broker.
+        port (int): Port of the broker.
+        failures (int): Consecutive failed connection attempts.
+        latency_ms (int): Smoothed connect latency, 0 until the first success.
+    """
+
+    def __init__(self, host: str, port: int = 1883):
+        self.host = host
+        self.port = port
+        self.failures = 0
+        self.latency_ms = 0
+
+    def __repr__(self) -> str:
+        return "%s:%s" % (self.host, self.port)
+
+
+class BrokerPool:
+    """
+    Ordered list of brokers with health scoring.
+
+    Brokers are listed in order of preference, the first one is the primary.
+    candidates() returns healthy brokers before slow ones and slow ones before
+    failing ones, each group in order of preference. That fails over to the
+    next broker when the current one stops accepting connections and fails
+    back once a more preferred broker is healthy again.
+
+    Attributes:
+        brokers (list): BrokerEndpoint objects in order of preference.
+        slow_ms (int): Connect latency above which a broker counts as slow.
+    """
+
+    def __init__(self, brokers: List[BrokerEndpoint], slow_ms: int = 2000):
+        if not brokers:
+            raise ValueError("At least one broker is required")
+        self.brokers = brokers
+        self.slow_ms = slow_ms
+        self.current: Optional[BrokerEndpoint] = None
+
+    def health(self, broker: BrokerEndpoint) -> int:
+        """Return 0 for healthy, 1 for slow and 2 for failing brokers."""
+        if broker.failures:
+            return 2
+        if broker.latency_ms > self.slow_ms:
+            return 1
+        return 0
+
+    def candidates(self) -> List[BrokerEndpoint]:
+        """Return the brokers in the order connections should be attempted."""
+        order = list(range(len(self.brokers)))
+        order.sort(key=lambda i: (self.health(self.brokers[i]), i))
+        return [self.brokers[i] for i in order]
+
+    def preferred(self) -> List[BrokerEndpoint]:
+        """Return the brokers listed before the current one, healthy or not."""
+        if self.current is None:
+            return []
+        return self.brokers[: self.brokers.index(self.current)]
+
+    def record_success(self, broker: BrokerEndpoint, latency_ms: int) -> None:
+        broker.failures = 0
+        if broker.latency_ms:
+            # Exponentially weighted so one slow connect does not demote it
+            broker.latency_ms = (broker.latency_ms * 3 + latency_ms) // 4
+        else:
+            broker.latency_ms = latency_ms
+
+    def record_failure(self, broker: BrokerEndpoint) -> None:
+        broker.failures += 1
+
+    async def probe(self, broker: BrokerEndpoint, timeout: float) -> bool:
+        """Check that a TCP connection to the broker can be opened."""
+        start = time.ticks_ms()
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(broker.host, broker.port), timeout
+            )
+            writer.close()
+            await writer.wait_closed()
+        except Exception as e:
+            logger.debug("Probe of broker %s failed: %s", broker, e)
+            self.record_failure(broker)
+            return False
+        self.record_success(broker, time.ticks_diff(time.ticks_ms(), start))
+        return True
+
+
+class Backoff:
+    """
+    Capped exponential backoff with jitter.
+
+    Each delay is drawn from the upper half of the current exponential step,
+    so that devices that lost the same broker at the same time spread out
+    their reconnects while never retrying immediately.
+
+    Attributes:
+        base (float): First delay in seconds.
+        cap (float): Maximum delay in seconds.
+        attempt (int): Number of delays handed out since the last reset.
+    """
+
+    def __init__(self, base: float = 1, cap: float = 60):
+        self.base = base
+        self.cap = cap
+        self.attempt = 0
+
+    def next(self) -> float:
+        step = min(self.cap, self.base * (2 ** min(self.attempt, 16)))
+        self.attempt += 1
+        return step / 2 + random.random() * step / 2
+
+    def reset(self) -> None:
+        self.attempt = 0
@@ -0,0 +1,438 @@
+import asyncio
+import struct
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from picosense.system.log import get_logger
+
+logger = get_logger(__name__)
+
+# MQTT 3.1.1 control packet types (upper nibble of the fixed header)
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+
+class MQTTException(Exception):
+    """Raised when the broker rejects a connection or sends an invalid packet."""
+
+    pass
+
+
+def _encode_length(length: int) -> bytearray:
+    """Encode the remaining length field of a fixed header."""
+    out = bytearray()
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return out
+
+
+def _encode_string(value: Any) -> bytes:
+    if isinstance(value, str):
+        value = value.encode()
+    return struct.pack("!H", len(value)) + value
+
+
+class AsyncMQTTClient:
+    """
+    Minimal MQTT 3.1.1 client built on asyncio streams.
+
+    Unlike umqtt.simple, none of the calls block the event loop: the socket is
+    only ever touched through the stream reader/writer and acknowledgements are
+    dispatched by a background reader task. Several QoS 1 publishes may be in
+    flight at the same time, each waiting on its own packet ID.
+
+    Attributes:
+        client_id (str): The client identifier sent in CONNECT.
+        server (str): The broker host name or address.
+        port (int): The broker port.
+        keepalive (int): The keepalive interval in seconds sent to the broker.
+        max_inflight (int): Maximum number of unacknowledged QoS 1 publishes.
+    """
+
+    def __init__(
+        self,
+        client_id: str,
+        server: str,
+        port: int = 1883,
+        keepalive: int = 0,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        max_inflight: int = 8,
+    ):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.keepalive = keepalive
+        self.user = user
+        self.password = password
+        self.max_inflight = max(1, max_inflight)
+
+        self._will: Optional[tuple] = None
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._write_lock = asyncio.Lock()
+        self._connected = False
+        self._pid = 0
+        # Packet ID -> [Event, acknowledged, (topic, msg, retain), sent ticks_ms]
+        self._inflight: Dict[int, List[Any]] = {}
+        self._window = asyncio.Event()
+        # ticks_ms of the last packet written and read
+        self.last_tx = time.ticks_ms()
+        self.last_rx = self.last_tx
+        # ticks_ms of the unanswered PINGREQ, None if there is none
+        self._ping_sent: Optional[int] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def set_last_will(self, topic: str, msg: Any, retain: bool = False, qos: int = 0):
+        """Set the message the broker publishes if the connection is lost."""
+        if not 0 <= qos <= 2:
+            raise ValueError("Invalid will QoS")
+        if not topic:
+            raise ValueError("Will topic must not be empty")
+        self._will = (topic, msg, retain, qos)
+
+    async def connect(
+        self, clean_session: bool = True, timeout: Optional[float] = None
+    ):
+        """
+        Open the connection and perform the CONNECT/CONNACK handshake.
+
+        Parameters:
+            clean_session (bool): Ask the broker to discard any previous session.
+            timeout (float): Seconds to wait for the socket and CONNACK.
+
+        Raises:
+            OSError: If the broker cannot be reached or does not answer in time.
+            MQTTException: If the broker refuses the connection.
+        """
+        await self._close()
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.server, self.port), timeout
+            )
+            await self._send(self._connect_packet(clean_session))
+            header = await asyncio.wait_for(self._reader.readexactly(4), timeout)
+        except asyncio.TimeoutError:
+            await self._close()
+            raise OSError("Timed out connecting to broker")
+        except EOFError:
+            await self._close()
+            raise OSError("Connection closed by broker")
+
+        if header[0] != CONNACK or header[1] != 2:
+            await self._close()
+            raise MQTTException("Unexpected CONNACK: %s" % bytes(header))
+        if header[3] != 0:
+            await self._close()
+            raise MQTTException("Connection refused with return code %d" % header[3])
+
+        self._connected = True
+        self.last_rx = time.ticks_ms()
+        self._ping_sent = None
+        self._reader_task = asyncio.create_task(self._read_loop())
+        if self._inflight:
+            try:
+                await self._retransmit()
+            except OSError:
+                await self._close()
+                raise
+        return header[2] & 1
+
+    async def disconnect(self):
+        """Send DISCONNECT and close the connection."""
+        if self._connected:
+            try:
+                await self._send(bytes((DISCONNECT, 0)))
+            except OSError:
+                pass
+        await self._close()
+
+    async def publish(
+        self,
+        topic: str,
+        msg: Any,
+        retain: bool = False,
+        qos: int = 0,
+        timeout: Optional[float] = None,
+    ):
+        """
+        Publish a message, waiting for the PUBACK if qos is 1.
+
+        Raises:
+            OSError: If the connection is lost or the PUBACK does not arrive
+                within the timeout.
+        """
+        pid = (await self.publish_many([(topic, msg, retain, qos)]))[0]
+        if pid is None:
+            return
+        try:
+            await self.wait_ack(pid, timeout)
+        finally:
+            self.forget(pid)
+
+    async def publish_many(self, messages: List[Tuple[str, Any, bool, int]]):
+        """
+        Write (topic, msg, retain, qos) messages back to back with one drain.
+
+        QoS 1 messages stay in flight until their PUBACK arrives or forget()
+        drops them. If the connection is lost first they are retransmitted
+        with the DUP flag after the next connect(), so wait_ack() can be
+        called again once reconnected.
+
+        Returns:
+            list: The packet ID of every message, None for QoS 0 messages.
+
+        Raises:
+            OSError: If not connected, in which case nothing was sent.
+            ValueError: If there are more QoS 1 messages than max_inflight.
+        """
+        count = 0
+        for message in messages:
+            if message[3] not in (0, 1):
+                raise ValueError("Only QoS 0 and 1 are supported")
+            count += message[3]
+        if count > self.max_inflight:
+            raise ValueError("More QoS 1 messages than max_inflight")
+        if not self._connected:
+            raise OSError("Not connected")
+
+        while len(self._inflight) + count > self.max_inflight:
+            self._window.clear()
+            await self._window.wait()
+            if not self._connected:
+                raise OSError("Not connected")
+
+        pids = []
+        try:
+            # Stream.write() only appends to a buffer that drain() empties, so
+            # no other task may write until the whole batch is drained
+            async with self._write_lock:
+                writer = self._writer
+                if writer is None:
+                    raise OSError("Not connected")
+                for topic, msg, retain, qos in messages:
+                    pid = None
+                    if qos:
+                        pid = self._next_pid()
+                        self._inflight[pid] = [
+                            asyncio.Event(),
+                            False,
+                            (topic, msg, retain),
+                            time.ticks_ms(),
+                        ]
+                    writer.write(
+                        self._publish_packet(topic, msg, retain, qos, pid or 0)
+                    )
+                    pids.append(pid)
+                self.last_tx = time.ticks_ms()
+                await writer.drain()
+        except OSError as e:
+            if not pids:
+                raise
+            # The in-flight messages are retransmitted after reconnecting
+            logger.warning("Connection to broker lost: %s", e)
+            await self._close()
+        return pids
+
+    async def wait_ack(self, pid: int, timeout: Optional[float] = None):
+        """
+        Wait for the PUBACK of a message sent by publish_many().
+
+        Raises:
+            OSError: If the connection is lost or the PUBACK does not arrive
+                within the timeout. The message stays in flight.
+        """
+        ack = self._inflight.get(pid)
+        if ack is None:
+            # Already acknowledged
+            return
+        try:
+            await asyncio.wait_for(ack[0].wait(), timeout)
+        except asyncio.TimeoutError:
+            raise OSError("Timed out waiting for PUBACK")
+        if not ack[1]:
+            raise OSError("Connection lost before PUBACK")
+
+    def forget(self, pid: int):
+        """Stop tracking a message, it will not be retransmitted."""
+        if self._inflight.pop(pid, None) is not None:
+            self._window.set()
+
+    async def ping(self):
+        """Send a PINGREQ to the broker, the PINGRESP is tracked by the reader."""
+        if not self._connected:
+            raise OSError("Not connected")
+        if self._ping_sent is None:
+            self._ping_sent = time.ticks_ms()
+        await self._send(bytes((PINGREQ, 0)))
+
+    @property
+    def ping_outstanding(self) -> bool:
+        return self._ping_sent is not None
+
+    def unanswered_ms(self) -> int:
+        """
+        Return how long the oldest PINGREQ or QoS 1 publish has gone unanswered.
+
+        A broker that stops answering while the socket stays writable is the
+        typical sign of a half-open connection.
+        """
+        now = time.ticks_ms()
+        oldest = 0
+        if self._ping_sent is not None:
+            oldest = time.ticks_diff(now, self._ping_sent)
+        for ack in self._inflight.values():
+            age = time.ticks_diff(now, ack[3])
+            if age > oldest:
+                oldest = age
+        return oldest
+
+    def _next_pid(self) -> int:
+        while True:
+            self._pid = self._pid % 0xFFFF + 1
+            if self._pid not in self._inflight:
+                return self._pid
+
+    def _connect_packet(self, clean_session: bool) -> bytearray:
+        flags = 0x02 if clean_session else 0
+        payload = bytearray(_encode_string(self.client_id))
+        if self._will:
+            topic, msg, retain, qos = self._will
+            flags |= 0x04 | (qos & 0x03) << 3 | (0x20 if retain else 0)
+            payload += _encode_string(topic)
+            payload += _encode_string(msg)
+        if self.user:
+            flags |= 0x80
+            payload += _encode_string(self.user)
+            if self.password:
+                flags |= 0x40
+                payload += _encode_string(self.password)
+
+        variable = b"\x00\x04MQTT\x04" + struct.pack("!BH", flags, self.keepalive)
+        packet = bytearray((CONNECT,))
+        packet += _encode_length(len(variable) + len(payload))
+        packet += variable
+        packet += payload
+        return packet
+
+    def _publish_packet(
+        self, topic: str, msg: Any, retain: bool, qos: int, pid: int, dup: bool = False
+    ) -> bytearray:
+        if isinstance(msg, str):
+            msg = msg.encode()
+        topic_field = _encode_string(topic)
+        length = len(topic_field) + len(msg) + (2 if qos else 0)
+        packet = bytearray(
+            (PUBLISH | (0x08 if dup else 0) | qos << 1 | (1 if retain else 0),)
+        )
+        packet += _encode_length(length)
+        packet += topic_field
+        if qos:
+            packet += struct.pack("!H", pid)
+        packet += msg
+        return packet
+
+    async def _send(self, packet):
+        async with self._write_lock:
+            writer = self._writer
+            if writer is None:
+                raise OSError("Not connected")
+            writer.write(packet)
+            self.last_tx = time.ticks_ms()
+            await writer.drain()
+
+    async def _retransmit(self):
+        # Unacknowledged QoS 1 messages must be sent again with DUP set
+        logger.info("Retransmitting %d unacknowledged messages", len(self._inflight))
+        now = time.ticks_ms()
+        async with self._write_lock:
+            writer = self._writer
+            if writer is None:
+                raise OSError("Not connected")
+            for pid, ack in self._inflight.items():
+                ack[0] = asyncio.Event()
+                ack[3] = now
+                topic, msg, retain = ack[2]
+                writer.write(self._publish_packet(topic, msg, retain, 1, pid, True))
+            self.last_tx = now
+            await writer.drain()
+
+    async def _read_packet(self):
+        reader = self._reader
+        header = (await reader.readexactly(1))[0]
+        length = 0
+        shift = 0
+        while True:
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        body = await reader.readexactly(length) if length else b""
+        return header, body
+
+    async def _read_loop(self):
+        try:
+            while True:
+                header, body = await self._read_packet()
+                self.last_rx = time.ticks_ms()
+                kind = header & 0xF0
+                if kind == PUBACK:
+                    ack = self._inflight.pop(struct.unpack("!H", body)[0], None)
+                    if ack is not None:
+                        ack[1] = True
+                        ack[0].set()
+                        self._window.set()
+                elif kind == PUBLISH and header & 0x06:
+                    # We never subscribe, but acknowledge anything the broker
+                    # delivers from a previous session so it stops resending.
+                    topic_len = struct.unpack("!H", body[:2])[0]
+                    pid = body[2 + topic_len : 4 + topic_len]
+                    await self._send(bytes((PUBACK, 2)) + pid)
+                elif kind == PINGRESP:
+                    self._ping_sent = None
+                elif kind != PUBLISH:
+                    logger.warning("Ignoring unexpected packet type 0x%02x", kind)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self._connected:
+                logger.warning("Connection to broker lost: %s", e)
+        self._connected = False
+        self._fail_inflight()
+
+    def _fail_inflight(self):
+        for ack in self._inflight.values():
+            ack[0].set()
+        self._window.set()
+
+    async def _close(self):
+        self._connected = False
+        task = self._reader_task
+        self._reader_task = None
+        if task is not None:
+            task.cancel()
+        writer = self._writer
+        self._reader = None
+        self._writer = None
+        if writer is not None:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+        self._fail_inflight()
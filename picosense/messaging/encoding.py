@@ -0,0 +1,239 @@
+import json
+import os
+import struct
+from typing import Any, Dict, List, Optional, Tuple
+
+ENCODING_JSON = "json"
+ENCODING_STRUCT = "struct"
+
+# Version byte at the start of every struct encoded payload
+STRUCT_VERSION = 1
+
+# Single measurement: version, timestamp, metric ID, value
+_MEASUREMENT = "<BIBf"
+_MEASUREMENT_SIZE = struct.calcsize(_MEASUREMENT)
+# Batch header: version, metric count, row count, followed by the metric IDs
+# and then one timestamp and one value per metric for every row
+_BATCH_HEADER = "<BBB"
+_BATCH_HEADER_SIZE = struct.calcsize(_BATCH_HEADER)
+_TIMESTAMP = "<I"
+_VALUE = "<f"
+
+# Well known metrics keep the same ID across devices and reboots. Other
+# metrics are assigned IDs from FIRST_DYNAMIC_ID in order of appearance and
+# kept across reboots if the schema is persisted.
+WELL_KNOWN_METRICS = {
+    "temperature": 1,
+    "relative_humidity": 2,
+    "co2_concentration": 3,
+    "illuminance": 4,
+    "pressure": 5,
+    "gas_resistance": 6,
+}
+FIRST_DYNAMIC_ID = 128
+
+# File name of the persisted schema
+SCHEMA_FILE = "schema.json"
+
+
+class Schema:
+    """
+    Table mapping metric names and units to the IDs used on the wire.
+
+    The table is published as a retained message so that consumers can decode
+    struct encoded payloads. Whenever a metric gets a new ID the changed flag
+    is set and the table has to be published again.
+
+    Payloads stored in the outbox are decoded against the schema published
+    after they are delivered, possibly after a reboot. With a path the table
+    is saved whenever it changes and loaded again on start, so that dynamic
+    IDs keep their meaning.
+
+    Attributes:
+        path (str): File the table is persisted to, None to keep it in RAM.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        # Metric ID -> (name, unit)
+        self.metrics: Dict[int, Tuple[str, str]] = {}
+        self._ids: Dict[str, int] = {}
+        self._next_id = FIRST_DYNAMIC_ID
+        self.changed = True
+        self.path = path
+        if path is not None:
+            self._load()
+
+    def metric_id(self, name: str, unit: str) -> int:
+        """Return the ID of a metric, assigning one if it is new."""
+        metric_id = self._ids.get(name)
+        if metric_id is not None:
+            return metric_id
+        metric_id = WELL_KNOWN_METRICS.get(name)
+        if metric_id is None:
+            if self._next_id > 0xFF:
+                raise ValueError("No metric IDs left for %s" % name)
+            metric_id = self._next_id
+            self._next_id += 1
+        self._ids[name] = metric_id
+        self.metrics[metric_id] = (name, unit)
+        self.changed = True
+        if self.path is not None:
+            self._save()
+        return metric_id
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "encoding": ENCODING_STRUCT,
+                "version": STRUCT_VERSION,
+                "metrics": [[i, n, u] for i, (n, u) in self.metrics.items()],
+            }
+        )
+
+    @classmethod
+    def from_json(cls, payload: Any) -> "Schema":
+        schema = cls()
+        schema._restore(payload)
+        return schema
+
+    def _restore(self, payload: Any) -> None:
+        for metric_id, name, unit in json.loads(payload)["metrics"]:
+            self._ids[name] = metric_id
+            self.metrics[metric_id] = (name, unit)
+            if metric_id >= self._next_id:
+                self._next_id = metric_id + 1
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                self._restore(f.read())
+        except (OSError, ValueError, KeyError):
+            # No schema saved yet, or it was corrupted by a power loss
+            return
+
+    def _save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.to_json())
+        os.rename(tmp, self.path)
+
+
+class JSONEncoder:
+    """Encode measurements and reading batches as JSON strings."""
+
+    name = ENCODING_JSON
+
+    def measurement(self, name: str, unit: str, value: float, timestamp: int) -> str:
+        return json.dumps(
+            {
+                "name": name,
+                "value": value,
+                "unit": unit,
+                "timestamp": timestamp,
+            }
+        )
+
+    def batch(self, names: List[str], units: List[str], rows: List[list]) -> str:
+        return json.dumps({"names": names, "units": units, "readings": rows})
+
+
+class StructEncoder:
+    """
+    Encode measurements and reading batches as little endian struct records.
+
+    Values are packed straight into a bytearray; metric names and units are
+    replaced with the one byte IDs from the schema.
+    """
+
+    name = ENCODING_STRUCT
+
+    def __init__(self, schema: Schema):
+        self.schema = schema
+
+    def measurement(
+        self, name: str, unit: str, value: float, timestamp: int
+    ) -> bytearray:
+        buf = bytearray(_MEASUREMENT_SIZE)
+        struct.pack_into(
+            _MEASUREMENT,
+            buf,
+            0,
+            STRUCT_VERSION,
+            timestamp,
+            self.schema.metric_id(name, unit),
+            value,
+        )
+        return buf
+
+    def batch(self, names: List[str], units: List[str], rows: List[list]) -> bytearray:
+        count = len(names)
+        if count > 0xFF or len(rows) > 0xFF:
+            raise ValueError("Batch too large for struct encoding")
+        buf = bytearray(_BATCH_HEADER_SIZE + count + len(rows) * (4 + 4 * count))
+        struct.pack_into(_BATCH_HEADER, buf, 0, STRUCT_VERSION, count, len(rows))
+        offset = _BATCH_HEADER_SIZE
+        for i in range(count):
+            buf[offset] = self.schema.metric_id(names[i], units[i])
+            offset += 1
+        for row in rows:
+            struct.pack_into(_TIMESTAMP, buf, offset, row[0])
+            offset += 4
+            for i in range(1, count + 1):
+                struct.pack_into(_VALUE, buf, offset, row[i])
+                offset += 4
+        return buf
+
+
+def get_encoder(name: str, schema: Schema) -> Any:
+    """Return the encoder for an encoding name."""
+    if name == ENCODING_STRUCT:
+        return StructEncoder(schema)
+    if name == ENCODING_JSON:
+        return JSONEncoder()
+    raise ValueError("Unknown encoding %s" % name)
+
+
+def decode_measurement(payload: bytes, schema: Schema) -> Dict[str, Any]:
+    """
+    Decode a struct encoded measurement into the dict sent by the JSON encoder.
+
+    Intended for consumers on the host side of the broker.
+    """
+    version, timestamp, metric_id, value = struct.unpack(
+        _MEASUREMENT, payload[:_MEASUREMENT_SIZE]
+    )
+    _check_version(version)
+    name, unit = schema.metrics[metric_id]
+    return {"name": name, "value": value, "unit": unit, "timestamp": timestamp}
+
+
+def decode_batch(payload: bytes, schema: Schema) -> Dict[str, Any]:
+    """
+    Decode a struct encoded reading batch into the dict sent by the JSON encoder.
+
+    Intended for consumers on the host side of the broker.
+    """
+    version, count, row_count = struct.unpack(
+        _BATCH_HEADER, payload[:_BATCH_HEADER_SIZE]
+    )
+    _check_version(version)
+    offset = _BATCH_HEADER_SIZE
+    ids = payload[offset : offset + count]
+    offset += count
+    row_format = "<I" + "f" * count
+    row_size = struct.calcsize(row_format)
+    rows = []
+    for _ in range(row_count):
+        row = struct.unpack(row_format, payload[offset : offset + row_size])
+        rows.append(list(row))
+        offset += row_size
+    return {
+        "names": [schema.metrics[i][0] for i in ids],
+        "units": [schema.metrics[i][1] for i in ids],
+        "readings": rows,
+    }
+
+
+def _check_version(version: int) -> None:
+    if version != STRUCT_VERSION:
+        raise ValueError("Unsupported struct encoding version %d" % version)
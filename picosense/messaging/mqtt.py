@@ -1,21 +1,44 @@
 import asyncio
 import json
 import logging
-from typing import Any
+import time
+from typing import Any, List, Optional, Tuple
 
 from typing_extensions import Literal
-from umqtt.simple import MQTTClient
 
-from picosense.queue import Queue
-from picosense.sensors.reader import Measurement, Reading
+from picosense.messaging.brokers import Backoff, BrokerEndpoint, BrokerPool
+from picosense.messaging.client import AsyncMQTTClient, MQTTException
+from picosense.messaging.encoding import (
+    ENCODING_JSON,
+    ENCODING_STRUCT,
+    SCHEMA_FILE,
+    Schema,
+    get_encoder,
+)
+from picosense.outbox import Outbox
+from picosense.queue import (
+    OVERFLOW_DROP_OLDEST,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    Queue,
+)
+from picosense.sensors.reader import Measurement, Reading, same_layout
+from picosense.system.log import get_logger
+from picosense.system.metrics import Histogram
 
 MQTT_ROOT_TOPIC = "picosense"
 MQTT_SYSTEM_SUBTOPIC = "system"
 MQTT_STATUS_SUBTOPIC = f"{MQTT_SYSTEM_SUBTOPIC}/status"
 MQTT_LOG_SUBTOPIC = f"{MQTT_SYSTEM_SUBTOPIC}/logs"
+MQTT_SCHEMA_SUBTOPIC = f"{MQTT_SYSTEM_SUBTOPIC}/schema"
+MQTT_METRICS_SUBTOPIC = f"{MQTT_SYSTEM_SUBTOPIC}/metrics"
 MQTT_MEASUREMENTS_SUBTOPIC = "measurements"
+MQTT_READINGS_SUBTOPIC = "readings"
 
-logger = logging.getLogger(__name__)
+PUBLISH_MODE_MEASUREMENT = "measurement"
+PUBLISH_MODE_READING = "reading"
+
+logger = get_logger(__name__)
 
 
 class MQTTMessagingProvider:
@@ -29,13 +52,39 @@ class MQTTMessagingProvider:
         root_topic: str = MQTT_ROOT_TOPIC,
         clean_session: bool = False,
         queue_maxsize: int = 50,
+        queue_overflow: str = OVERFLOW_DROP_OLDEST,
         max_retries: int = 3,
         connect_timeout: int = 10,
+        publish_timeout: int = 10,
+        max_inflight: int = 8,
+        publish_batch: int = 8,
+        response_timeout: float = 10,
+        watchdog_interval_ms: int = 1000,
+        publish_mode: str = PUBLISH_MODE_MEASUREMENT,
+        batch_window: float = 0,
+        batch_size: int = 10,
+        encoding: str = ENCODING_JSON,
+        outbox: Optional[Outbox] = None,
+        outbox_batch: int = 20,
+        spool_interval: int = 10,
+        fallback_brokers: Optional[List[Tuple[str, int]]] = None,
+        backoff_cap: float = 60,
+        failback_interval: int = 300,
     ):
         self.device_id = device_id
         self.location = location
-        self.broker_host = broker_host
-        self.broker_port = broker_port
+        # The broker given by host and port is the primary, fallbacks are
+        # tried in order when it is unhealthy
+        self._brokers = BrokerPool(
+            [BrokerEndpoint(broker_host, broker_port)]
+            + [BrokerEndpoint(host, port) for host, port in fallback_brokers or ()]
+        )
+        self._backoff = Backoff(cap=backoff_cap)
+        self._reconnect_lock = asyncio.Lock()
+        # Time the broker has to answer a ping or QoS 1 publish
+        self.response_timeout = response_timeout
+        self.watchdog_interval_ms = watchdog_interval_ms
+        self.failback_interval = failback_interval
         if keepalive < 10:
             logger.warning("Keepalive must be >= 10. Setting to 10.")
             self.keepalive = 10
@@ -45,15 +94,60 @@ class MQTTMessagingProvider:
         self.base_topic = f"{root_topic}/{location}/{device_id}"
         self.clean_session = clean_session
         self.max_retries = max_retries
+        # Queued messages written back to back before waiting for PUBACKs
+        self.publish_batch = max(1, min(publish_batch, max_inflight))
         self.connect_timeout = connect_timeout
+        self.publish_timeout = publish_timeout
+        if publish_mode not in (PUBLISH_MODE_MEASUREMENT, PUBLISH_MODE_READING):
+            logger.warning(
+                "Unknown publish mode %s. Using %s.",
+                publish_mode,
+                PUBLISH_MODE_MEASUREMENT,
+            )
+            publish_mode = PUBLISH_MODE_MEASUREMENT
+        self.publish_mode = publish_mode
+        self.batch_window = batch_window
+        self.batch_size = max(1, batch_size)
+        # Persisted next to the outbox so that stored payloads keep their IDs
+        self._schema = Schema(
+            path=f"{outbox.path}/{SCHEMA_FILE}" if outbox is not None else None
+        )
+        try:
+            self._encoder = get_encoder(encoding, self._schema)
+        except ValueError:
+            logger.warning("Unknown encoding %s. Using %s.", encoding, ENCODING_JSON)
+            self._encoder = get_encoder(ENCODING_JSON, self._schema)
+        if self._encoder.name == ENCODING_STRUCT:
+            # Row count is stored in a single byte
+            self.batch_size = min(self.batch_size, 0xFF)
 
-        self._publish_queue = Queue(queue_maxsize)
+        self._publish_queue = Queue(queue_maxsize, queue_overflow)
+        self.queue_maxsize = queue_maxsize
+        self._batch_size = self.batch_size
+        self._tasks = []
+        # Cleared while paused, e.g. by the power manager with the radio off
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+        # Set by resume() to cut a reconnect backoff short
+        self._wake = asyncio.Event()
+        # Set while the publisher holds items taken from the queue
+        self._publishing = False
+        # Time from sending a message until it is acknowledged
+        self._publish_ms = Histogram()
+        self._connects = 0
+        # Messages are moved here while the broker is unreachable
+        self._outbox = outbox
+        self.outbox_batch = max(1, outbox_batch)
+        self.spool_interval = spool_interval
+        # Pending batched readings per sensor: (names, units, rows)
+        self._batches = {}
 
-        self._client = MQTTClient(
+        self._client = AsyncMQTTClient(
             client_id=self.device_id,
-            server=self.broker_host,
-            port=self.broker_port,
+            server=broker_host,
+            port=broker_port,
             keepalive=self.keepalive,
+            max_inflight=max_inflight,
         )
 
         self._client.set_last_will(
@@ -64,37 +158,152 @@ class MQTTMessagingProvider:
         )
 
     def start(self):
-        self.connect()
-        asyncio.create_task(self._publisher_loop())
-        asyncio.create_task(self._ping())
+        # The publisher loop establishes the connection itself so that start()
+        # never blocks; anything published until then waits in the queue.
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._publisher_loop()),
+            asyncio.create_task(self._watchdog()),
+        ]
+        if len(self._brokers.brokers) > 1 and self.failback_interval:
+            self._tasks.append(asyncio.create_task(self._failback_loop()))
+
+    def stop(self):
+        """Stop the tasks started by start()."""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    @property
+    def is_connected(self) -> bool:
+        return self._client.is_connected
 
-    def connect(self):
+    async def wait_connected(self, poll_interval_ms: int = 50):
+        """Wait until the publisher started by start() is connected."""
+        while not self._client.is_connected:
+            await asyncio.sleep_ms(poll_interval_ms)
+
+    @property
+    def paused(self) -> bool:
+        return not self._resumed.is_set()
+
+    async def pause(self):
+        """
+        Disconnect and stop reconnecting until resume() is called.
+
+        Messages published in the meantime are queued. A clean disconnect
+        does not trigger the last will, so the device does not show up as
+        offline while it is only saving power.
+        """
+        self._resumed.clear()
+        if self._client.is_connected:
+            try:
+                await self.disconnect()
+            except Exception as e:
+                logger.debug("Disconnect while pausing failed: %s", e)
+
+    def resume(self):
+        """
+        Allow the tasks started by start() to reconnect and publish again.
+
+        The network was most likely just brought up, so the next connect
+        attempt is made right away instead of after the remaining backoff.
+        """
+        self._backoff.reset()
+        self._resumed.set()
+        self._wake.set()
+
+    async def flush(self, poll_interval_ms: int = 50):
+        """Wait until the queue and the outbox are empty and all is acked."""
+        while (
+            self._publish_queue.qsize()
+            or self._publishing
+            or (self._outbox is not None and self._outbox.pending())
+        ):
+            await asyncio.sleep_ms(poll_interval_ms)
+
+    @property
+    def broker(self) -> Optional[BrokerEndpoint]:
+        """The broker of the current or last connection."""
+        return self._brokers.current
+
+    async def connect(self, broker: Optional[BrokerEndpoint] = None):
+        if broker is None:
+            broker = self._brokers.current or self._brokers.brokers[0]
         logger.info(
-            "Connecting to broker %s:%s with keepalive %ss and timeout %ss",
-            self.broker_host,
-            self.broker_port,
+            "Connecting to broker %s with keepalive %ss and timeout %ss",
+            broker,
             self.keepalive,
             self.connect_timeout,
         )
-        # TODO: Handle connection errors
-        self._client.connect(
-            clean_session=self.clean_session, timeout=self.connect_timeout
-        )
-        logger.info("Connected to broker")
+        self._brokers.current = broker
+        self._client.server = broker.host
+        self._client.port = broker.port
+        start = time.ticks_ms()
+        try:
+            await self._client.connect(
+                clean_session=self.clean_session, timeout=self.connect_timeout
+            )
+        except (OSError, MQTTException):
+            self._brokers.record_failure(broker)
+            raise
+        self._brokers.record_success(broker, time.ticks_diff(time.ticks_ms(), start))
+        logger.info("Connected to broker %s", broker)
 
-    def disconnect(self):
+    async def disconnect(self):
         logger.info("Disconnecting from broker")
-        self._client.disconnect()
+        await self._client.disconnect()
 
     async def reconnect(self):
-        self.disconnect()
-        self.connect()
+        await self.disconnect()
+        await self.connect()
 
     def publish(
-        self, subtopic: str, payload: Any, qos: Literal[0, 1] = 1, retain: bool = False
+        self,
+        subtopic: str,
+        payload: Any,
+        qos: Literal[0, 1] = 1,
+        retain: bool = False,
+        priority: int = PRIORITY_NORMAL,
     ) -> None:
-        logger.debug("Queuing message for publishing")
-        self._publish_queue.put_nowait((subtopic, payload, qos, retain))
+        """
+        Queue a message for publishing.
+
+        The priority decides which messages survive when the queue overflows
+        and it uses the priority overflow policy.
+        """
+        if not self._publish_queue.put_nowait(
+            (subtopic, payload, qos, retain), priority
+        ):
+            logger.debug("Publish queue full, message dropped")
+
+    def set_memory_level(self, level: int) -> None:
+        """
+        Trade backlog and latency for RAM while memory runs low.
+
+        Each level halves the publish queue and doubles the batch size of
+        batched readings. Level 0 restores the configured sizes.
+        """
+        maxsize = max(1, self.queue_maxsize >> level)
+        if maxsize != self._publish_queue.maxsize:
+            logger.warning("Resizing publish queue to %d", maxsize)
+            self._publish_queue.resize(maxsize)
+        batch_size = self._batch_size << level
+        if self._encoder.name == ENCODING_STRUCT:
+            batch_size = min(batch_size, 0xFF)
+        self.batch_size = batch_size
+
+    def queue_stats(self):
+        return self._publish_queue.stats()
+
+    def metrics(self):
+        return {
+            "publish_ms": self._publish_ms,
+            "reconnects": max(0, self._connects - 1),
+            "broker": str(self._brokers.current),
+            "queue": self.queue_stats(),
+        }
 
     def publish_measurement(
         self,
@@ -103,14 +312,10 @@ class MQTTMessagingProvider:
         qos: Literal[0, 1] = 1,
         retain: bool = False,
     ):
-        payload = json.dumps(
-            {
-                "name": measurement.name,
-                "value": measurement.value,
-                "unit": measurement.unit,
-                "timestamp": timestamp,
-            }
+        payload = self._encoder.measurement(
+            measurement.name, measurement.unit, measurement.value, timestamp
         )
+        self._publish_schema_if_changed()
 
         self.publish(
             f"{MQTT_MEASUREMENTS_SUBTOPIC}/{measurement.name}",
@@ -120,19 +325,118 @@ class MQTTMessagingProvider:
         )
 
     def publish_measurements_from_reading(self, reading: Reading):
+        if self.publish_mode == PUBLISH_MODE_READING:
+            self.publish_reading(reading)
+            return
         for measurement in reading.measurements:
             self.publish_measurement(measurement, reading.timestamp)
 
     async def publish_measurements_from_reading_async(self, reading: Reading) -> None:
         self.publish_measurements_from_reading(reading)
 
-    def _publish(
-        self, subtopic: str, payload: Any, qos: Literal[0, 1] = 1, retain: bool = False
-    ):
-        topic = f"{self.base_topic}/{subtopic}"
-        logger.debug("Publishing message to topic %s", topic)
-        logger.debug("Payload: %s", payload)
-        self._client.publish(topic, payload, qos=qos, retain=retain)
+    def publish_reading(
+        self, reading: Reading, qos: Literal[0, 1] = 1, retain: bool = False
+    ) -> None:
+        """
+        Publish all measurements of a reading as one message on a per-sensor topic.
+
+        If a batch window is configured, readings from the same sensor are
+        collected and published together once the window elapses or the batch
+        is full.
+        """
+        sensor = reading.sensor or "unknown"
+        measurements = reading.measurements
+        # Copy the values since sensor wrappers reuse their reading
+        row = [reading.timestamp]
+        for m in measurements:
+            row.append(m.value)
+
+        batch = self._batches.get(sensor)
+        if batch is not None and not same_layout(batch[0], measurements):
+            # Metric layout changed, the pending rows no longer fit the header
+            self._flush_batch(sensor, qos, retain)
+            batch = None
+
+        if batch is None:
+            names = [m.name for m in measurements]
+            units = [m.unit for m in measurements]
+            batch = (names, units, [])
+            self._batches[sensor] = batch
+            if self.batch_window > 0:
+                asyncio.create_task(self._flush_batch_later(sensor, qos, retain))
+        batch[2].append(row)
+
+        if self.batch_window <= 0 or len(batch[2]) >= self.batch_size:
+            self._flush_batch(sensor, qos, retain)
+
+    def _flush_batch(self, sensor: str, qos: Literal[0, 1], retain: bool) -> None:
+        batch = self._batches.pop(sensor, None)
+        if not batch or not batch[2]:
+            return
+        names, units, rows = batch
+        payload = self._encoder.batch(names, units, rows)
+        self._publish_schema_if_changed()
+        self.publish(f"{MQTT_READINGS_SUBTOPIC}/{sensor}", payload, qos, retain)
+
+    def _publish_schema_if_changed(self) -> None:
+        # The schema is only needed to decode struct encoded payloads. It is
+        # queued before the payload that introduced a new metric ID.
+        if self._encoder.name != ENCODING_STRUCT or not self._schema.changed:
+            return
+        self._schema.changed = False
+        self.publish(
+            MQTT_SCHEMA_SUBTOPIC,
+            self._schema.to_json(),
+            qos=1,
+            retain=True,
+            priority=PRIORITY_HIGH,
+        )
+
+    async def _flush_batch_later(
+        self, sensor: str, qos: Literal[0, 1], retain: bool
+    ) -> None:
+        batch = self._batches.get(sensor)
+        await asyncio.sleep(self.batch_window)
+        # Only flush the batch this task was started for; it may already have
+        # been flushed because it filled up or its layout changed.
+        if self._batches.get(sensor) is batch:
+            self._flush_batch(sensor, qos, retain)
+
+    async def _publish_items(self, items: List[tuple]):
+        """
+        Write queued items back to back and wait for their acknowledgements.
+
+        If the connection is lost while waiting, the provider reconnects and
+        the client retransmits the unacknowledged messages with the DUP flag.
+
+        Raises:
+            OSError: If not connected, in which case nothing was sent.
+        """
+        messages = []
+        for subtopic, payload, qos, retain in items:
+            topic = f"{self.base_topic}/{subtopic}"
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Publishing message to topic %s: %s", topic, payload)
+            messages.append((topic, payload, retain, qos))
+        start = time.ticks_ms()
+        pids = await self._client.publish_many(messages)
+        for pid in pids:
+            if pid is None:
+                continue
+            for attempt in range(self.max_retries):
+                try:
+                    await self._client.wait_ack(pid, self.publish_timeout)
+                    self._publish_ms.observe(time.ticks_diff(time.ticks_ms(), start))
+                    break
+                except OSError as e:
+                    logger.warning("Failed to publish message: %s", e)
+                    await self._reconnect_loop()
+            else:
+                self._client.forget(pid)
+                logger.critical(
+                    "Message not acknowledged after %s attempts. Dropping message.",
+                    self.max_retries,
+                )
 
     async def _set_status(self, status: str):
         self.publish(
@@ -140,21 +444,34 @@ class MQTTMessagingProvider:
             json.dumps({"status": status}),
             retain=True,
             qos=1,
+            priority=PRIORITY_HIGH,
         )
 
     async def _publisher_loop(self):
+        await self._reconnect_loop()
         while True:
-            subtopic, payload, qos, retain = await self._publish_queue.get()
+            await self._drain_outbox()
+            items = await self._publish_queue.get_many(self.publish_batch)
+            self._publishing = True
+            await self._resumed.wait()
+            if not self._client.is_connected:
+                await self._reconnect_loop()
             for attempt in range(self.max_retries):
                 try:
-                    self._publish(subtopic, payload, qos, retain)
+                    await self._publish_items(items)
                     break
                 except OSError as e:
-                    logger.warning("Failed to publish message: %s", e)
+                    logger.warning("Failed to publish messages: %s", e)
+                    if self._outbox is not None:
+                        # Delivered from the outbox once reconnected
+                        for item in items:
+                            self._outbox.append(item)
+                        await self._reconnect_loop()
+                        break
                     await self._reconnect_loop()
                 except Exception as e:
                     logger.warning(
-                        "Failed to publish message (attempt %d): %s",
+                        "Failed to publish messages (attempt %d): %s",
                         attempt + 1,
                         e,
                     )
@@ -163,37 +480,154 @@ class MQTTMessagingProvider:
                     else:
                         # Changed log level from error to critical.
                         logger.critical(
-                            "Failed to publish message after %s attempts. Dropping message.",
+                            "Failed to publish %d messages after %s attempts. "
+                            "Dropping messages.",
+                            len(items),
                             self.max_retries,
                         )
+            self._publishing = False
 
-    async def _ping(self):
-        wait_time = (self.keepalive / 2) - 1
-        await asyncio.sleep(wait_time)
-        while True:
+    async def _drain_outbox(self):
+        """Publish messages stored in the outbox in batches, oldest first."""
+        outbox = self._outbox
+        if outbox is None:
+            return
+        while outbox.pending():
+            items = outbox.read(self.outbox_batch)
+            if not items:
+                return
+            logger.info("Publishing %d messages from outbox", len(items))
+            sent = 0
+            pids = []
             try:
-                logger.info("Pinging broker")
-                self._client.ping()
-                logger.info("Ping successful")
-            except Exception as e:
-                logger.error("Failed to ping broker: %s", e)
-            await asyncio.sleep(wait_time)
+                while sent < len(items):
+                    chunk = items[sent : sent + self.publish_batch]
+                    pids = await self._client.publish_many(
+                        [
+                            (f"{self.base_topic}/{subtopic}", payload, retain, qos)
+                            for subtopic, payload, qos, retain in chunk
+                        ]
+                    )
+                    for pid in pids:
+                        if pid is not None:
+                            await self._client.wait_ack(pid, self.publish_timeout)
+                    sent += len(chunk)
+            except OSError as e:
+                logger.warning("Failed to publish message from outbox: %s", e)
+                # The outbox delivers them again, the client must not
+                for pid in pids:
+                    if pid is not None:
+                        self._client.forget(pid)
+                outbox.ack(sent)
+                await self._reconnect_loop()
+                continue
+            outbox.ack()
 
-    async def _reconnect_loop(self):
-        logger.warning("Reconnecting to broker")
-        attempt = 0
-        while True:
+    def _spool(self):
+        """Move queued messages to the outbox while the broker is unreachable."""
+        if self._outbox is None or not self._publish_queue.qsize():
+            return
+        logger.info("Moving %d messages to outbox", self._publish_queue.qsize())
+        while self._publish_queue.qsize():
+            self._outbox.append(self._publish_queue.get_nowait())
+        self._outbox.flush()
+
+    async def _sleep_spooling(self, duration: float):
+        """Sleep between connect attempts, returning early on resume()."""
+        self._wake.clear()
+        while duration > 0:
+            step = min(duration, self.spool_interval)
             try:
-                self.disconnect()
-            except Exception:
+                await asyncio.wait_for(self._wake.wait(), step)
+                return
+            except asyncio.TimeoutError:
                 pass
-            try:
-                self.connect()
-                logger.info("Successfully reconnected to broker")
+            duration -= step
+            self._spool()
+
+    async def _watchdog(self):
+        """
+        Keep the connection alive and detect half-open sockets from traffic.
+
+        A PINGREQ is only sent when nothing was written for half the
+        keepalive, or nothing was received for a whole keepalive. When a ping
+        or a QoS 1 publish is not answered within response_timeout, or the
+        connection dropped, the connection is re-established right away
+        instead of waiting for the next publish to fail.
+        """
+        idle_ms = self.keepalive * 500
+        silent_ms = self.keepalive * 1000
+        timeout_ms = int(self.response_timeout * 1000)
+        client = self._client
+        while True:
+            await asyncio.sleep_ms(self.watchdog_interval_ms)
+            if self._reconnect_lock.locked() or self.paused:
+                continue
+            if not client.is_connected:
+                await self._reconnect_loop()
+                continue
+            unanswered = client.unanswered_ms()
+            if unanswered > timeout_ms:
+                logger.warning(
+                    "Broker did not answer for %dms, reconnecting", unanswered
+                )
+                await self._reconnect_loop()
+                continue
+            now = time.ticks_ms()
+            if client.ping_outstanding:
+                continue
+            if (
+                time.ticks_diff(now, client.last_tx) >= idle_ms
+                or time.ticks_diff(now, client.last_rx) >= silent_ms
+            ):
+                try:
+                    await client.ping()
+                except OSError as e:
+                    logger.warning("Failed to ping broker: %s", e)
+
+    async def _reconnect_loop(self):
+        # Nothing to reconnect for while paused
+        await self._resumed.wait()
+        if self._reconnect_lock.locked():
+            # Another task is already reconnecting, wait until it is done
+            async with self._reconnect_lock:
                 return
-            except OSError as e:
-                backoff = 1 * (2**attempt)
-                logger.error("Reconnect attempt %d failed: %s", attempt + 1, e)
-                logger.warning("Broker connect backoff. Next attempt in %ds", backoff)
-                attempt += 1
-                await asyncio.sleep(backoff)
+        async with self._reconnect_lock:
+            await self._reconnect()
+
+    async def _reconnect(self):
+        if self._client.is_connected:
+            logger.warning("Reconnecting to broker")
+        while True:
+            # No attempts while paused, e.g. with the radio powered down
+            await self._resumed.wait()
+            # One attempt per broker, healthiest and most preferred first
+            for broker in self._brokers.candidates():
+                try:
+                    await self.disconnect()
+                except Exception:
+                    pass
+                try:
+                    await self.connect(broker)
+                    self._connects += 1
+                    self._backoff.reset()
+                    logger.info("Successfully reconnected to broker")
+                    return
+                except (OSError, MQTTException) as e:
+                    logger.error("Connecting to broker %s failed: %s", broker, e)
+            backoff = self._backoff.next()
+            logger.warning("Broker connect backoff. Next attempt in %.1fs", backoff)
+            self._spool()
+            await self._sleep_spooling(backoff)
+
+    async def _failback_loop(self):
+        """Move back to a more preferred broker once it is reachable again."""
+        while True:
+            await asyncio.sleep(self.failback_interval)
+            if self.paused or not self._client.is_connected:
+                continue
+            for broker in self._brokers.preferred():
+                if await self._brokers.probe(broker, self.connect_timeout):
+                    logger.info("Broker %s is reachable again, failing back", broker)
+                    await self._reconnect_loop()
+                    break
@@ -0,0 +1,252 @@
+import os
+import struct
+from typing import Any, List, Tuple
+
+from picosense.system.log import get_logger
+
+logger = get_logger(__name__)
+
+SEGMENT_SUFFIX = ".seg"
+ACK_CURSOR_FILE = "ack"
+
+# Record header: flags (qos | retain << 1), topic length, payload length
+_HEADER = "<BHH"
+_HEADER_SIZE = struct.calcsize(_HEADER)
+
+
+def _to_bytes(value: Any) -> bytes:
+    if isinstance(value, str):
+        return value.encode()
+    return bytes(value)
+
+
+class Outbox:
+    """
+    Persistent store-and-forward outbox for messages that could not be published.
+
+    Messages are appended to numbered, append-only segment files in a
+    directory. A write cursor (the end of the newest segment) and an ack cursor
+    (segment number and offset of the oldest unacknowledged message) track what
+    still has to be delivered. Appends are buffered in RAM and written in
+    chunks to bound the number of flash writes, and the oldest segments are
+    discarded once the total size exceeds the configured cap.
+
+    Attributes:
+        path (str): Directory holding the segment files and the ack cursor.
+        segment_size (int): Size in bytes after which a new segment is started.
+        max_size (int): Maximum total size in bytes of all segments.
+        flush_size (int): Number of buffered bytes that triggers a write.
+        dropped (int): Number of messages discarded because of the size cap.
+    """
+
+    def __init__(
+        self,
+        path: str = "outbox",
+        segment_size: int = 16384,
+        max_size: int = 262144,
+        flush_size: int = 1024,
+    ):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_size = max(max_size, segment_size)
+        self.flush_size = flush_size
+        self.dropped = 0
+
+        self._buffer = bytearray()
+        self._buffered = 0
+        # Segment number -> size in bytes, for all segments on flash
+        self._segments = {}
+        # Start a new segment before appending after a reboot, in case the
+        # last write to the newest one was cut short by a power loss.
+        self._fresh_segment = False
+        self._ack = (0, 0)
+        # Cursor positions after each message returned by the last read()
+        self._read_ends: List[Tuple[int, int]] = []
+
+        try:
+            os.mkdir(path)
+        except OSError:
+            pass
+        self._load()
+
+    def __len__(self) -> int:
+        """Return the number of bytes not yet acknowledged, including the buffer."""
+        seq, offset = self._ack
+        size = sum(s for n, s in self._segments.items() if n >= seq) - offset
+        return size + len(self._buffer)
+
+    def pending(self) -> bool:
+        """Return True if there are messages waiting to be delivered."""
+        return len(self) > 0
+
+    def append(self, item: tuple) -> None:
+        """Buffer a (subtopic, payload, qos, retain) message for writing."""
+        subtopic, payload, qos, retain = item
+        topic = _to_bytes(subtopic)
+        payload = _to_bytes(payload)
+        self._buffer += struct.pack(
+            _HEADER, (qos & 1) | (2 if retain else 0), len(topic), len(payload)
+        )
+        self._buffer += topic
+        self._buffer += payload
+        self._buffered += 1
+        if len(self._buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write buffered messages to the newest segment."""
+        if not self._buffer:
+            return
+        seq = self._write_segment()
+        with open(self._segment_path(seq), "ab") as f:
+            f.write(self._buffer)
+        self._segments[seq] += len(self._buffer)
+        logger.debug("Wrote %d messages to outbox segment %d", self._buffered, seq)
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._enforce_max_size()
+
+    def read(self, count: int) -> List[tuple]:
+        """
+        Return up to count of the oldest unacknowledged messages.
+
+        The messages stay in the outbox until they are acknowledged with ack().
+        """
+        self.flush()
+        items = []
+        self._read_ends = []
+        seq, offset = self._ack
+        for n in sorted(self._segments):
+            if n < seq:
+                continue
+            if n > seq:
+                offset = 0
+            if offset >= self._segments[n]:
+                continue
+            with open(self._segment_path(n), "rb") as f:
+                f.seek(offset)
+                while len(items) < count:
+                    header = f.read(_HEADER_SIZE)
+                    if len(header) < _HEADER_SIZE:
+                        break
+                    flags, topic_len, payload_len = struct.unpack(_HEADER, header)
+                    topic = f.read(topic_len)
+                    payload = f.read(payload_len)
+                    if len(topic) < topic_len or len(payload) < payload_len:
+                        # Truncated by a power loss during a write
+                        break
+                    offset += _HEADER_SIZE + topic_len + payload_len
+                    items.append(
+                        (topic.decode(), payload, flags & 1, bool(flags & 2))
+                    )
+                    self._read_ends.append((n, offset))
+            if len(items) >= count:
+                break
+        return items
+
+    def ack(self, count: int = -1) -> None:
+        """
+        Acknowledge messages returned by the last read().
+
+        Parameters:
+            count (int): Number of messages to acknowledge, all of them if negative.
+        """
+        if count < 0:
+            count = len(self._read_ends)
+        if count == 0:
+            return
+        seq, offset = self._read_ends[count - 1]
+        self._read_ends = self._read_ends[count:]
+        # Remove segments that have been delivered completely, but keep the
+        # newest one since it is still being appended to.
+        for n in sorted(self._segments):
+            if n < seq:
+                self._remove_segment(n)
+            elif n == seq and offset >= self._segments[n] and n != self._newest():
+                self._remove_segment(n)
+                seq, offset = min(self._segments), 0
+        self._ack = (seq, offset)
+        self._save_ack()
+
+    def _load(self) -> None:
+        for name in os.listdir(self.path):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    seq = int(name[: -len(SEGMENT_SUFFIX)])
+                except ValueError:
+                    continue
+                self._segments[seq] = os.stat(self._segment_path(seq))[6]
+        try:
+            with open(f"{self.path}/{ACK_CURSOR_FILE}", "r") as f:
+                seq, offset = f.read().split()
+                self._ack = (int(seq), int(offset))
+        except (OSError, ValueError):
+            self._ack = (0, 0)
+        if self._segments and self._ack[0] not in self._segments:
+            self._ack = (min(self._segments), 0)
+        if self._segments:
+            self._fresh_segment = True
+            logger.info(
+                "Outbox has %d unacknowledged bytes in %d segments",
+                len(self),
+                len(self._segments),
+            )
+
+    def _save_ack(self) -> None:
+        tmp = f"{self.path}/{ACK_CURSOR_FILE}.tmp"
+        with open(tmp, "w") as f:
+            f.write("%d %d" % self._ack)
+        os.rename(tmp, f"{self.path}/{ACK_CURSOR_FILE}")
+
+    def _segment_path(self, seq: int) -> str:
+        return "%s/%08d%s" % (self.path, seq, SEGMENT_SUFFIX)
+
+    def _newest(self) -> int:
+        return max(self._segments) if self._segments else 0
+
+    def _write_segment(self) -> int:
+        seq = self._newest()
+        if (
+            not self._segments
+            or self._fresh_segment
+            or self._segments[seq] >= self.segment_size
+        ):
+            self._fresh_segment = False
+            seq += 1
+            self._segments[seq] = 0
+            if len(self._segments) == 1:
+                self._ack = (seq, 0)
+        return seq
+
+    def _remove_segment(self, seq: int) -> None:
+        try:
+            os.remove(self._segment_path(seq))
+        except OSError:
+            pass
+        self._segments.pop(seq, None)
+
+    def _enforce_max_size(self) -> None:
+        while len(self._segments) > 1 and sum(self._segments.values()) > self.max_size:
+            oldest = min(self._segments)
+            dropped = self._count_records(oldest)
+            self.dropped += dropped
+            logger.warning(
+                "Outbox exceeds %d bytes. Dropping %d messages.", self.max_size, dropped
+            )
+            self._remove_segment(oldest)
+            if self._ack[0] <= oldest:
+                self._ack = (min(self._segments), 0)
+                self._save_ack()
+
+    def _count_records(self, seq: int) -> int:
+        count = 0
+        offset = self._ack[1] if self._ack[0] == seq else 0
+        with open(self._segment_path(seq), "rb") as f:
+            while True:
+                f.seek(offset)
+                header = f.read(_HEADER_SIZE)
+                if len(header) < _HEADER_SIZE:
+                    return count
+                _, topic_len, payload_len = struct.unpack(_HEADER, header)
+                offset += _HEADER_SIZE + topic_len + payload_len
+                count += 1
@@ -1,34 +1,64 @@
 import asyncio
-import logging
 
 import machine
 
-from picosense.messaging.mqtt import MQTT_LOG_SUBTOPIC, MQTTMessagingProvider
-from picosense.sensors.bh1750 import BH1750Wrapper
+from picosense.messaging.encoding import ENCODING_JSON
+from picosense.messaging.mqtt import (
+    MQTT_LOG_SUBTOPIC,
+    MQTT_METRICS_SUBTOPIC,
+    PUBLISH_MODE_MEASUREMENT,
+    MQTTMessagingProvider,
+)
+from picosense.outbox import Outbox
+from picosense.queue import OVERFLOW_PRIORITY
+from picosense.sensors.aggregate import STAT_MAX, STAT_MEAN, STAT_MIN, Aggregator
+from picosense.sensors.deadband import DeadbandFilter, Threshold
 from picosense.sensors.reader import SensorReader, SensorReaderManager
-from picosense.sensors.scd4x import SCD4XWrapper
+from picosense.sensors.registry import create_sensor
+from picosense.sensors.select import MetricSelector
+from picosense.system.boot import BootSequence
 from picosense.system.config import Config
+from picosense.system.i2c import I2CBus
+from picosense.system.led import (
+    LED,
+    STATE_BOOTING,
+    STATE_CONNECTING,
+    STATE_ERROR,
+    STATE_OFFLINE,
+    STATE_OK,
+)
+from picosense.system.log import get_logger, get_logging_level
 from picosense.system.logging import setup_logging
+from picosense.system.memory import MemoryGovernor
+from picosense.system.metrics import Metrics
+from picosense.system.ntp import keep_time, settime_async
+from picosense.system.power import PowerManager
+from picosense.system.wifi import WiFiConnection
 
-
-def get_logging_level(level_str: str) -> int:
-    level_str = level_str.lower()
-    levels = {
-        "debug": logging.DEBUG,
-        "info": logging.INFO,
-        "warning": logging.WARNING,
-        "error": logging.ERROR,
-        "critical": logging.CRITICAL,
-    }
-    return levels.get(level_str, logging.INFO)
+# Used when the config has no i2c or sensors section
+DEFAULT_I2C = {"i2c0": {"id": 0, "sda": 16, "scl": 17}}
+DEFAULT_SENSORS = [
+    {"type": "scd4x", "name": "scd41", "interval": 15},
+    # Offset by half an interval so both sensors don't use the bus at once
+    {"type": "bh1750", "name": "bh1750", "interval": 15, "phase": 7.5},
+]
 
 
 def start():
     config = Config()
 
+    # Status LED, lit until the boot phases are done
+    led_config = config.data.get("led", {})
+    led = LED(
+        led_config.get("pin", "LED"), pwm_freq=led_config.get("pwm_freq", 1000)
+    )
+    led.set_state(STATE_BOOTING)
+
     # Get logging level from config file
     logging_level_str = config["logging"]["level"]
     level = get_logging_level(logging_level_str)
+    # Levels per module prefix, e.g. {"picosense.sensors": "debug"}
+    logging_modules = config["logging"].get("modules", {})
 
     device_id = config["device_id"]
     device_location = config["location"]
@@ -36,12 +66,30 @@ def start():
     mqtt_broker_host = config["mqtt"]["broker"]["host"]
     mqtt_broker_port = config["mqtt"]["broker"]["port"]
     mqtt_keepalive = config["mqtt"]["broker"]["keepalive"]
+    # Brokers to fail over to, in order of preference
+    mqtt_fallback_brokers = [
+        (broker["host"], broker.get("port", 1883))
+        for broker in config["mqtt"].get("fallback_brokers", [])
+    ]
+    mqtt_reconnect = config["mqtt"].get("reconnect", {})
+    mqtt_publish = config["mqtt"].get("publish", {})
+    mqtt_outbox = config["mqtt"].get("outbox")
+    mqtt_queue = config["mqtt"].get("queue", {})
 
     # Setup initial logging to capture logs during MQTT initialization
-    setup_logging(level=level)
-    logger = logging.getLogger(__name__)
+    setup_logging(level=level, modules=logging_modules)
+    logger = get_logger(__name__)
     logger.info("Starting PicoSense")
 
+    # Initialize persistent outbox for messages published while offline
+    outbox = None
+    if mqtt_outbox:
+        outbox = Outbox(
+            path=mqtt_outbox.get("path", "outbox"),
+            segment_size=mqtt_outbox.get("segment_size", 16384),
+            max_size=mqtt_outbox.get("max_size", 262144),
+        )
+
     # Initialize MQTT messaging provider
     mqtt = MQTTMessagingProvider(
         device_id,
@@ -49,41 +97,238 @@ def start():
         mqtt_broker_host,
         mqtt_broker_port,
         keepalive=mqtt_keepalive,
-        queue_maxsize=500,
+        queue_maxsize=mqtt_queue.get("maxsize", 500),
+        queue_overflow=mqtt_queue.get("overflow", OVERFLOW_PRIORITY),
+        publish_mode=mqtt_publish.get("mode", PUBLISH_MODE_MEASUREMENT),
+        batch_window=mqtt_publish.get("batch_window", 0),
+        batch_size=mqtt_publish.get("batch_size", 10),
+        encoding=mqtt_publish.get("encoding", ENCODING_JSON),
+        outbox=outbox,
+        fallback_brokers=mqtt_fallback_brokers,
+        backoff_cap=mqtt_reconnect.get("backoff_cap", 60),
+        failback_interval=mqtt_reconnect.get("failback_interval", 300),
+        response_timeout=mqtt_reconnect.get("response_timeout", 10),
     )
-    mqtt.start()
 
     # Update logging to include MQTT handler
-    setup_logging(level=level, mqtt_provider=mqtt, mqtt_topic=MQTT_LOG_SUBTOPIC)
+    mqtt_logging = config["logging"].get("mqtt", {})
+    mqtt_logging_options = {
+        "flush_interval": mqtt_logging.get("flush_interval", 10),
+        "max_bytes": mqtt_logging.get("max_bytes", 4096),
+    }
+    if "rate_limits" in mqtt_logging:
+        mqtt_logging_options["rate_limits"] = {
+            get_logging_level(name): (limit[0], limit[1])
+            for name, limit in mqtt_logging["rate_limits"].items()
+        }
+    setup_logging(
+        level=level,
+        mqtt_provider=mqtt,
+        mqtt_topic=MQTT_LOG_SUBTOPIC,
+        mqtt_options=mqtt_logging_options,
+    )
 
     # Initialize sensor reader manager
     manager = SensorReaderManager()
 
-    # Initialize I2C bus
-    # TODO: Make I2C pins configurable
-    i2c_bus = machine.I2C(0, sda=machine.Pin(16), scl=machine.Pin(17))
+    # Initialize I2C buses
+    buses = {}
+    for name, bus in config.data.get("i2c", DEFAULT_I2C).items():
+        i2c = machine.I2C(
+            bus.get("id", 0),
+            sda=machine.Pin(bus["sda"]),
+            scl=machine.Pin(bus["scl"]),
+            freq=bus.get("freq", 400000),
+        )
+        buses[name] = I2CBus(i2c, coalesce_ms=bus.get("coalesce_ms", 0))
+        manager.add_bus(name, buses[name])
+
+    # Callback that receives every reading
+    on_reading = mqtt.publish_measurements_from_reading_async
+
+    # Optionally only publish measurements that changed significantly
+    deadband = config.data.get("deadband")
+    if deadband:
+        deadband_filter = DeadbandFilter(
+            thresholds={
+                name: Threshold(t.get("absolute", 0), t.get("relative", 0))
+                for name, t in deadband.get("metrics", {}).items()
+            },
+            heartbeat=deadband.get("heartbeat", 900),
+            # Batched reading payloads need a stable metric layout
+            partial=deadband.get(
+                "partial", mqtt.publish_mode == PUBLISH_MODE_MEASUREMENT
+            ),
+        )
+        deadband_filter.add_callback(on_reading)
+        on_reading = deadband_filter.process
+
+    # Optionally publish rolling aggregates instead of raw readings
+    aggregate = config.data.get("aggregate")
+    if aggregate:
+        aggregator = Aggregator(
+            window=aggregate.get("window", 60),
+            interval=aggregate.get("interval", 0),
+            capacity=aggregate.get("capacity", 32),
+            stats=tuple(aggregate.get("stats", (STAT_MEAN, STAT_MIN, STAT_MAX))),
+        )
+        aggregator.add_callback(on_reading)
+        on_reading = aggregator.process
+
+    async def start_sensors():
+        # Create the configured sensors, their drivers are imported on demand.
+        # Sensors like the SCD4x start measuring here, so this overlaps their
+        # warm-up with the network phases.
+        for sensor in config.data.get("sensors", DEFAULT_SENSORS):
+            if not sensor.get("enabled", True):
+                continue
+            name = sensor.get("name", sensor["type"])
+            try:
+                wrapper = create_sensor(
+                    sensor["type"],
+                    buses[sensor.get("bus", "i2c0")],
+                    address=sensor.get("address"),
+                    options=sensor.get("options"),
+                )
+            except Exception as e:
+                logger.error("Failed to initialize sensor %s: %s", name, e)
+                continue
+            reader = SensorReader(
+                name,
+                read_func=wrapper.read,
+                interval=sensor.get("interval", 15),
+                phase=sensor.get("phase", 0),
+            )
+            callback = on_reading
+            if "metrics" in sensor:
+                selector = MetricSelector(sensor["metrics"])
+                selector.add_callback(on_reading)
+                callback = selector.process
+            reader.add_callback(callback)
+            manager.add_reader(reader)
+            # Let the other phases run between sensors
+            await asyncio.sleep_ms(0)
+
+    async def start_wifi():
+        # Association keeps being retried in the background after boot
+        wifi.start()
+        await wifi.wait_connected()
+
+    async def start_mqtt():
+        mqtt.start()
+        await mqtt.wait_connected()
+
+    async def set_time():
+        await settime_async(ntp.get("host", "pool.ntp.org"))
+
+    # Boot phases run concurrently, the network ones once WiFi is up
+    wifi_config = config["network"]["wifi"]
+    wifi = WiFiConnection(
+        wifi_config["ssid"],
+        wifi_config["password"],
+        wifi_config["country"],
+        connect_timeout=wifi_config.get("timeout", 15),
+    )
+    ntp = config.data.get("ntp", {})
+    boot = BootSequence()
+    boot.add("wifi", start_wifi, timeout=wifi.connect_timeout)
+    boot.add("sensors", start_sensors, timeout=10)
+    boot.add("ntp", set_time, timeout=ntp.get("timeout", 5), after=("wifi",))
+    boot.add("mqtt", start_mqtt, timeout=10, after=("wifi",))
+
+    async def show_status(interval=2):
+        # Reflect the device health on the LED
+        connected = False
+        errors = 0
+        while True:
+            total = sum(stats["errors"] for stats in manager.stats().values())
+            if total > errors:
+                led.set_state(STATE_ERROR)
+            elif mqtt.is_connected:
+                connected = True
+                led.set_state(STATE_OK)
+            elif connected:
+                # Readings are buffered until the broker is back
+                led.set_state(STATE_OFFLINE)
+            else:
+                led.set_state(STATE_CONNECTING)
+            errors = total
+            await asyncio.sleep(interval)
+
+    async def run():
+        await boot.run()
+        # The publisher keeps connecting in the background if its phase was
+        # skipped or timed out
+        mqtt.start()
+        # Re-sync the clock periodically, and soon if the ntp phase failed
+        asyncio.create_task(
+            keep_time(
+                ntp.get("host", "pool.ntp.org"),
+                interval=ntp.get("interval", 86400),
+                retry_interval=ntp.get("retry_interval", 60),
+                timeout=ntp.get("timeout", 5),
+                synced=boot.succeeded("ntp"),
+                wait_connected=wifi.wait_connected,
+            )
+        )
 
-    # Sensor reading interval in seconds
-    interval = 15
+        # Optionally duty cycle the radio and CPU between readings
+        power = None
+        power_config = config.data.get("power", {})
+        if power_config.get("enabled", False):
+            power = PowerManager(
+                manager,
+                mqtt,
+                upload_interval=power_config.get("upload_interval", 300),
+                connect_network=wifi.connect,
+                disconnect_network=(
+                    wifi.disconnect if power_config.get("radio_off", True) else None
+                ),
+                lightsleep=power_config.get("lightsleep", True),
+                min_sleep_ms=power_config.get("min_sleep_ms", 100),
+            )
+            power.start()
+            # The status LED would cost more than the sensors
+            led.off()
+        else:
+            asyncio.create_task(show_status())
 
-    # Initialize SCD41
-    scd41 = SCD4XWrapper(i2c_bus)
-    scd41_reader = SensorReader("scd41", read_func=scd41.read, interval=interval)
-    # Register callbacks for SCD41
-    scd41_reader.add_callback(mqtt.publish_measurements_from_reading_async)
+        # Collect garbage between readings and degrade while memory is low
+        governor = None
+        memory_config = config.data.get("memory")
+        if memory_config:
+            governor = MemoryGovernor(
+                manager,
+                mqtt,
+                low_free=memory_config.get("low_free", 32768),
+                critical_free=memory_config.get("critical_free", 16384),
+                min_block=memory_config.get("min_block", 4096),
+                interval=memory_config.get("interval", 5),
+            )
+            governor.start()
 
-    # Initialize BH1750
-    bh1750 = BH1750Wrapper(i2c_bus)
-    bh1750_reader = SensorReader("bh1750", read_func=bh1750.read, interval=interval)
-    # Register callbacks for BH1750
-    bh1750_reader.add_callback(mqtt.publish_measurements_from_reading_async)
+        # Periodically publish runtime metrics
+        metrics_config = config.data.get("metrics")
+        if metrics_config:
+            metrics = Metrics(
+                mqtt,
+                MQTT_METRICS_SUBTOPIC,
+                interval=metrics_config.get("interval", 60),
+                slept_ms=power.slept_ms if power is not None else None,
+            )
+            metrics.add_source("boot", lambda: boot.results)
+            metrics.add_source("mqtt", mqtt.metrics)
+            metrics.add_source("sensors", manager.metrics)
+            if power is not None:
+                metrics.add_source("power", power.metrics)
+            if governor is not None:
+                metrics.add_source("memory", governor.metrics)
+            metrics.start()
 
-    # Register readers with the manager
-    manager.add_reader(scd41_reader)
-    manager.add_reader(bh1750_reader)
+        await manager.start()
 
     try:
-        asyncio.run(manager.start())
+        asyncio.run(run())
     except KeyboardInterrupt:
         logger.warning("Received KeyboardInterrupt. Exiting...")
     finally:
@@ -1,47 +1,156 @@
 import asyncio
-import collections
+from typing import Any, List
+
+# What to do when an item is put into a full queue
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_PRIORITY = "priority"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_PRIORITY)
+
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
 
 
 class Queue:
-    def __init__(self, maxsize: int = 0):
-        self._maxsize = maxsize
-        self._deque = collections.deque((), maxsize)
+    """
+    Fixed capacity FIFO queue backed by a preallocated ring buffer.
+
+    put_nowait(), get() and get_nowait() are O(1). When the queue is full the
+    overflow policy decides which item is lost:
+
+        drop_oldest  The oldest item is evicted (the default).
+        drop_newest  The new item is discarded.
+        priority     The oldest item with the lowest priority is evicted if
+                     its priority is below the new item's, otherwise the new
+                     item is discarded. Eviction from the middle is O(n).
+
+    Attributes:
+        maxsize (int): Capacity of the queue.
+        overflow (str): One of OVERFLOW_POLICIES.
+        dropped (int): Number of items lost to overflow.
+        high_water (int): Highest number of items held at once.
+    """
+
+    def __init__(self, maxsize: int = 64, overflow: str = OVERFLOW_DROP_OLDEST):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy %s" % overflow)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.high_water = 0
+        self._items: List[Any] = [None] * maxsize
+        self._priorities = bytearray(maxsize)
+        self._head = 0
+        self._size = 0
         self._event = asyncio.Event()
 
-    def put_nowait(self, item):
-        # Add the item to the right side of the deque
-        # If the deque is full, the oldest item will be removed
-        self._deque.append(item)
+    def put_nowait(self, item: Any, priority: int = PRIORITY_NORMAL) -> bool:
+        """
+        Add an item, applying the overflow policy if the queue is full.
+
+        Returns:
+            bool: False if the new item was discarded.
+        """
+        if self._size == self.maxsize:
+            self.dropped += 1
+            if self.overflow == OVERFLOW_DROP_NEWEST:
+                return False
+            if self.overflow == OVERFLOW_DROP_OLDEST:
+                self._pop()
+            elif not self._evict_lower(priority):
+                return False
+
+        tail = (self._head + self._size) % self.maxsize
+        self._items[tail] = item
+        self._priorities[tail] = priority
+        self._size += 1
+        if self._size > self.high_water:
+            self.high_water = self._size
         # Notify any waiting tasks that an item has been added
         self._event.set()
+        return True
 
-    async def get(self):
-        # Wait until an item is available in the deque
-        while not self._deque:
+    async def get(self) -> Any:
+        """Remove and return the oldest item, waiting until one is available."""
+        while not self._size:
             self._event.clear()
             await self._event.wait()
+        return self._pop()
 
-        # Remove and return the leftmost item from the deque
-        return self._deque.popleft()
+    def get_nowait(self) -> Any:
+        """Remove and return the oldest item, raises IndexError if empty."""
+        if not self._size:
+            raise IndexError("get from empty queue")
+        return self._pop()
+
+    async def get_many(self, count: int) -> List[Any]:
+        """Wait until the queue is not empty and return up to count items."""
+        while not self._size:
+            self._event.clear()
+            await self._event.wait()
+        return [self._pop() for _ in range(min(count, self._size))]
 
     def qsize(self) -> int:
-        return len(self._deque)
+        return self._size
 
+    def resize(self, maxsize: int) -> None:
+        """
+        Change the capacity, e.g. to free memory while it runs low.
 
-class SimpleQueue:
-    def __init__(self, size=0):
-        self._items = []
-        self._event = asyncio.Event()
-        self.size = size
+        Items that no longer fit are dropped by the overflow policy as if
+        they had been put in order into the smaller queue.
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if maxsize == self.maxsize:
+            return
+        items = []
+        while self._size:
+            index = self._head
+            items.append((self._pop(), self._priorities[index]))
+        self.maxsize = maxsize
+        self._items = [None] * maxsize
+        self._priorities = bytearray(maxsize)
+        self._head = 0
+        for item, priority in items:
+            self.put_nowait(item, priority)
 
-    async def get(self):
-        while not self._items:
-            self._event.clear()
-            await self._event.wait()
-        return self._items.pop(0)
+    def stats(self):
+        return {
+            "size": self._size,
+            "maxsize": self.maxsize,
+            "high_water": self.high_water,
+            "dropped": self.dropped,
+        }
 
-    async def put(self, item):
-        if self.size and len(self._items) >= self.size:
-            self._items.pop(0)
-        self._items.append(item)
-        self._event.set()
+    def _pop(self) -> Any:
+        head = self._head
+        item = self._items[head]
+        # Release the reference so the item can be garbage collected
+        self._items[head] = None
+        self._head = (head + 1) % self.maxsize
+        self._size -= 1
+        return item
+
+    def _evict_lower(self, priority: int) -> bool:
+        # Find the oldest item with the lowest priority
+        victim = -1
+        lowest = priority
+        for i in range(self._size):
+            index = (self._head + i) % self.maxsize
+            if self._priorities[index] < lowest:
+                lowest = self._priorities[index]
+                victim = i
+        if victim < 0:
+            return False
+        # Close the gap by moving the items before the victim one slot forward
+        for i in range(victim, 0, -1):
+            dst = (self._head + i) % self.maxsize
+            src = (self._head + i - 1) % self.maxsize
+            self._items[dst] = self._items[src]
+            self._priorities[dst] = self._priorities[src]
+        self._pop()
+        return True
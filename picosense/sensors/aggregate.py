@@ -0,0 +1,244 @@
+import array
+from typing import Dict, List, Optional, Tuple, Union
+
+from picosense.sensors.reader import CallbackStage, Measurement, Reading
+from picosense.system.log import get_logger
+
+logger = get_logger(__name__)
+
+STAT_MEAN = "mean"
+STAT_MIN = "min"
+STAT_MAX = "max"
+STAT_LAST = "last"
+STATS = (STAT_MEAN, STAT_MIN, STAT_MAX, STAT_LAST)
+
+
+def window_suffix(window: int) -> str:
+    """Return the name suffix of a window length, e.g. 5m for 300 seconds."""
+    if window % 3600 == 0:
+        return "%dh" % (window // 3600)
+    if window % 60 == 0:
+        return "%dm" % (window // 60)
+    return "%ds" % window
+
+
+def base_metric(name: str) -> Optional[str]:
+    """
+    Return the metric an aggregate is named after, None for other names.
+
+    Handles both co2_concentration_mean and co2_concentration_mean_5m.
+    """
+    base, _, stat = name.rpartition("_")
+    if stat not in STATS and stat[-1:] in ("s", "m", "h") and stat[:-1].isdigit():
+        base, _, stat = base.rpartition("_")
+    if base and stat in STATS:
+        return base
+    return None
+
+
+class RollingWindow:
+    """
+    Fixed memory time window of samples backed by array.array.
+
+    Samples are summarised in capacity time buckets of equal width instead of
+    being stored one by one, so a long window does not need more memory and
+    never loses samples that are still inside it. The mean, minimum and
+    maximum are exact over the buckets. A bucket expires as a whole once the
+    first second it covers leaves the window, so the oldest width - 1
+    seconds of the window may be missing.
+
+    Attributes:
+        capacity (int): Number of buckets.
+        window (int): Age in seconds after which samples expire.
+        width (int): Seconds covered by a bucket.
+    """
+
+    def __init__(self, capacity: int, window: int):
+        self.capacity = max(2, capacity)
+        self.window = window
+        # The buckets overlapping the window must fit into the ring
+        self.width = max(1, -(-window // (self.capacity - 1)))
+        self._sums = array.array("f", (0 for _ in range(self.capacity)))
+        self._counts = array.array("H", (0 for _ in range(self.capacity)))
+        self._mins = array.array("f", (0 for _ in range(self.capacity)))
+        self._maxs = array.array("f", (0 for _ in range(self.capacity)))
+        # Numbers (timestamp // width) of the newest and oldest live bucket
+        self._newest = -1
+        self._oldest = 0
+        self._last = 0.0
+
+    def __len__(self) -> int:
+        count = 0
+        for i in self._live():
+            count += self._counts[i]
+        return count
+
+    def append(self, timestamp: int, value: float) -> None:
+        bucket = timestamp // self.width
+        if bucket > self._newest:
+            # Clear the buckets that are reused for newer times
+            first = max(self._newest + 1, bucket - self.capacity + 1)
+            for number in range(first, bucket + 1):
+                self._counts[number % self.capacity] = 0
+            self._newest = bucket
+        elif bucket <= self._newest - self.capacity:
+            # Older than anything the ring holds
+            return
+        i = bucket % self.capacity
+        count = self._counts[i]
+        if not count:
+            self._sums[i] = value
+            self._mins[i] = self._maxs[i] = value
+        else:
+            self._sums[i] += value
+            if value < self._mins[i]:
+                self._mins[i] = value
+            if value > self._maxs[i]:
+                self._maxs[i] = value
+        if count < 0xFFFF:
+            self._counts[i] = count + 1
+        self._last = value
+
+    def expire(self, now: int) -> None:
+        """Drop the buckets that started window seconds before now or earlier."""
+        self._oldest = (now - self.window) // self.width + 1
+
+    def mean(self) -> float:
+        total = 0.0
+        count = 0
+        for i in self._live():
+            total += self._sums[i]
+            count += self._counts[i]
+        return total / count if count else 0.0
+
+    def min(self) -> float:
+        result = None
+        for i in self._live():
+            if result is None or self._mins[i] < result:
+                result = self._mins[i]
+        return 0.0 if result is None else result
+
+    def max(self) -> float:
+        result = None
+        for i in self._live():
+            if result is None or self._maxs[i] > result:
+                result = self._maxs[i]
+        return 0.0 if result is None else result
+
+    def last(self) -> float:
+        return self._last if len(self) else 0.0
+
+    def stat(self, name: str) -> float:
+        if name == STAT_MEAN:
+            return self.mean()
+        if name == STAT_MIN:
+            return self.min()
+        if name == STAT_MAX:
+            return self.max()
+        return self.last()
+
+    def _live(self) -> List[int]:
+        """Return the ring indices of the live buckets holding samples."""
+        first = max(self._oldest, self._newest - self.capacity + 1, 0)
+        return [
+            number % self.capacity
+            for number in range(first, self._newest + 1)
+            if self._counts[number % self.capacity]
+        ]
+
+
+class Aggregator(CallbackStage):
+    """
+    Callback stage that forwards rolling aggregates instead of raw readings.
+
+    Readings are added to one RollingWindow per sensor, metric and window
+    length. Every interval seconds an aggregate reading with one measurement
+    per metric, window and statistic is passed to the registered callbacks.
+    With a single window the measurements are named like
+    co2_concentration_mean, with several windows the window length is
+    appended, e.g. co2_concentration_mean_5m. Metrics without samples in a
+    window, e.g. a gas resistance that was left out of the readings, are
+    left out of the aggregate as well.
+
+    Attributes:
+        windows (tuple): Lengths in seconds of the aggregation windows.
+        interval (int): Seconds between aggregate readings.
+        capacity (int): Buckets per metric and window, a window is
+            aggregated at a resolution of window / (capacity - 1) seconds.
+        stats (tuple): Statistics to forward, see STATS.
+    """
+
+    def __init__(
+        self,
+        window: Union[int, Tuple[int, ...]] = 60,
+        interval: int = 0,
+        capacity: int = 32,
+        stats: Tuple[str, ...] = (STAT_MEAN, STAT_MIN, STAT_MAX),
+    ):
+        super().__init__()
+        self.windows = tuple(window) if isinstance(window, (tuple, list)) else (window,)
+        if not self.windows:
+            raise ValueError("No aggregation window")
+        self.interval = interval or min(self.windows)
+        self.capacity = capacity
+        for stat in stats:
+            if stat not in STATS:
+                raise ValueError("Unknown statistic %s" % stat)
+        self.stats = tuple(stats)
+        # Sensor name -> [{metric name: (windows, measurements)}, aggregate
+        # reading, next emit]
+        self._sensors: Dict[Optional[str], list] = {}
+
+    async def process(self, reading: Reading) -> None:
+        """Add a reading and forward an aggregate once the interval has passed."""
+        state = self._sensors.get(reading.sensor)
+        if state is None:
+            logger.debug("Creating aggregation windows for %s", reading.sensor)
+            state = [
+                {},
+                Reading([], 0, reading.sensor),
+                reading.timestamp + self.interval,
+            ]
+            self._sensors[reading.sensor] = state
+        metrics, aggregate, next_emit = state
+
+        timestamp = reading.timestamp
+        for m in reading.measurements:
+            metric = metrics.get(m.name)
+            if metric is None:
+                metric = self._new_metric(m)
+                metrics[m.name] = metric
+            for window in metric[0]:
+                window.append(timestamp, m.value)
+
+        if timestamp < next_emit:
+            return
+        state[2] = timestamp + self.interval
+
+        stat_count = len(self.stats)
+        out = aggregate.measurements
+        out.clear()
+        for windows, measurements in metrics.values():
+            for i in range(len(windows)):
+                window = windows[i]
+                window.expire(timestamp)
+                if not len(window):
+                    continue
+                for j in range(stat_count):
+                    measurement = measurements[i * stat_count + j]
+                    measurement.value = window.stat(self.stats[j])
+                    out.append(measurement)
+        if not out:
+            return
+        aggregate.timestamp = timestamp
+        await self.forward(aggregate)
+
+    def _new_metric(self, m: Measurement) -> tuple:
+        windows = []
+        measurements = []
+        for length in self.windows:
+            windows.append(RollingWindow(self.capacity, length))
+            suffix = "_" + window_suffix(length) if len(self.windows) > 1 else ""
+            for stat in self.stats:
+                measurements.append(Measurement(f"{m.name}_{stat}{suffix}", m.unit, 0))
+        return windows, measurements
@@ -2,21 +2,26 @@ import time
 
 from bh1750 import BH1750 as Sensor
 
-from picosense.sensors.reader import Measurement, Reading
+from picosense.sensors.reader import Reading
+from picosense.system.i2c import I2CBus
 
 
 class BH1750Wrapper:
+    NAME = "bh1750"
     I2C_ADDRESS = 0x23
+    LAYOUT = (("illuminance", "lux"),)
 
-    def __init__(self, i2c_bus):
-        self.i2c_bus = i2c_bus
-        self.sensor = Sensor(self.I2C_ADDRESS, i2c_bus)
+    def __init__(self, bus: I2CBus, address: int = I2C_ADDRESS):
+        self.bus = bus
+        self.i2c_bus = bus.i2c
+        self.address = address
+        self.sensor = Sensor(address, self.i2c_bus)
+        # Reused for every read to avoid allocations
+        self._reading = Reading.from_layout(self.LAYOUT)
+        (self._illuminance,) = self._reading.measurements
 
     async def read(self) -> Reading:
-        timestamp = time.time()
-
-        illuminance = Measurement(
-            name="illuminance", unit="lux", value=self.sensor.measurement
-        )
-
-        return Reading(measurements=[illuminance], timestamp=timestamp)
+        async with self.bus.transaction(self.NAME):
+            self._reading.timestamp = time.time()
+            self._illuminance.value = self.sensor.measurement
+        return self._reading
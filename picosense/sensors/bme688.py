@@ -0,0 +1,312 @@
+import struct
+import time
+
+import uasyncio as asyncio
+
+from picosense.sensors.reader import Reading
+from picosense.system.i2c import I2CBus
+
+UNIT_TEMPERATURE = "C"
+UNIT_RELATIVE_HUMIDITY = "%"
+UNIT_PRESSURE = "hPa"
+UNIT_GAS_RESISTANCE = "Ohm"
+
+CHIP_ID = 0x61
+
+# Oversampling settings
+OVERSAMPLING_NONE = 0
+OVERSAMPLING_1X = 1
+OVERSAMPLING_2X = 2
+OVERSAMPLING_4X = 3
+OVERSAMPLING_8X = 4
+OVERSAMPLING_16X = 5
+
+# IIR filter settings
+FILTER_OFF = 0
+FILTER_1 = 1
+FILTER_3 = 2
+FILTER_7 = 3
+FILTER_15 = 4
+
+_REG_COEFF1 = 0x8A
+_REG_COEFF2 = 0xE1
+_REG_COEFF3 = 0x00
+_REG_FIELD0 = 0x1D
+_REG_RES_HEAT0 = 0x5A
+_REG_GAS_WAIT0 = 0x64
+_REG_CTRL_GAS_1 = 0x71
+_REG_CTRL_HUM = 0x72
+_REG_CTRL_MEAS = 0x74
+_REG_CONFIG = 0x75
+_REG_CHIP_ID = 0xD0
+_REG_RESET = 0xE0
+
+_LEN_COEFF1 = 23
+_LEN_COEFF2 = 14
+_LEN_COEFF3 = 5
+_LEN_FIELD = 17
+
+_SOFT_RESET = 0xB6
+_RESET_DELAY_MS = 10
+_MODE_FORCED = 0x01
+_RUN_GAS = 0x20
+_NEW_DATA = 0x80
+_GAS_VALID = 0x20
+_HEAT_STAB = 0x10
+
+# Measurement cycles per oversampling setting
+_OVERSAMPLING_CYCLES = (0, 1, 2, 4, 8, 16)
+
+
+def _heater_duration(duration_ms: int) -> int:
+    """Encode a heater duration for the gas_wait register."""
+    if duration_ms >= 0xFC0:
+        return 0xFF
+    factor = 0
+    while duration_ms > 0x3F:
+        duration_ms //= 4
+        factor += 1
+    return duration_ms + factor * 64
+
+
+class BME688Wrapper:
+    """
+    Wrapper for the Bosch BME688 environmental sensor.
+
+    Talks to the sensor registers directly instead of using the driver,
+    which blocks while the gas heater runs. Each read triggers a forced mode
+    measurement with one heater step and awaits the measurement and heater
+    time, so the event loop and the bus stay free in the meantime. The
+    compensation follows the floating point formulas of the Bosch BME68x API.
+    While the heater has not reached its temperature the reading leaves out
+    the gas resistance.
+
+    Attributes:
+        heater_temperature (int): Heater target temperature in C.
+        heater_duration_ms (int): Time the heater is held at temperature.
+        poll_interval_ms (int): Time between new data polls.
+        max_polls (int): Number of polls before a read fails.
+        address (int): I2C address of the sensor.
+    """
+
+    NAME = "bme688"
+    I2C_ADDRESS = 0x77
+    LAYOUT = (
+        ("temperature", UNIT_TEMPERATURE),
+        ("relative_humidity", UNIT_RELATIVE_HUMIDITY),
+        ("pressure", UNIT_PRESSURE),
+        ("gas_resistance", UNIT_GAS_RESISTANCE),
+    )
+
+    def __init__(
+        self,
+        bus: I2CBus,
+        address: int = I2C_ADDRESS,
+        heater_temperature: int = 320,
+        heater_duration_ms: int = 150,
+        temperature_oversampling: int = OVERSAMPLING_8X,
+        pressure_oversampling: int = OVERSAMPLING_4X,
+        humidity_oversampling: int = OVERSAMPLING_2X,
+        filter: int = FILTER_3,
+        poll_interval_ms: int = 10,
+        max_polls: int = 20,
+    ):
+        self.bus = bus
+        self.i2c_bus = bus.i2c
+        self.address = address
+        self.heater_temperature = min(heater_temperature, 400)
+        self.heater_duration_ms = heater_duration_ms
+        self.poll_interval_ms = poll_interval_ms
+        self.max_polls = max_polls
+        self._osrs_t = temperature_oversampling
+        self._osrs_p = pressure_oversampling
+        self._osrs_h = humidity_oversampling
+        self._filter = filter
+        # Assume room temperature until the first measurement
+        self._ambient_temperature = 25.0
+        self._field = bytearray(_LEN_FIELD)
+
+        chip_id = self._read(_REG_CHIP_ID, 1)[0]
+        if chip_id != CHIP_ID:
+            raise OSError("Unexpected BME688 chip id 0x%02x" % chip_id)
+        self._write(_REG_RESET, _SOFT_RESET)
+        # The sensor needs a moment after the reset. The constructor runs in
+        # the sensors boot phase, so this stalls the event loop, but only
+        # once at start-up and only for the few milliseconds of the reset.
+        time.sleep_ms(_RESET_DELAY_MS)
+        self._read_calibration()
+        self._write(_REG_CTRL_HUM, self._osrs_h)
+        self._write(_REG_CONFIG, self._filter << 2)
+
+        # Reused for every read to avoid allocations
+        self._reading = Reading.from_layout(self.LAYOUT)
+        (
+            self._temperature,
+            self._relative_humidity,
+            self._pressure,
+            self._gas_resistance,
+        ) = self._reading.measurements
+        # Returned while the heater is not stable, as its gas resistance is
+        # meaningless. Shares the other measurements with _reading.
+        self._reading_without_gas = Reading(self._reading.measurements[:3], 0)
+
+    def measurement_duration_ms(self) -> int:
+        """Return the time a forced measurement takes, including the heater."""
+        cycles = (
+            _OVERSAMPLING_CYCLES[self._osrs_t]
+            + _OVERSAMPLING_CYCLES[self._osrs_p]
+            + _OVERSAMPLING_CYCLES[self._osrs_h]
+        )
+        # Conversion time plus TPH switching and gas measurement in us
+        duration_us = cycles * 1963 + 477 * 4 + 477 * 5
+        # Rounded to ms, plus 1 ms to wake up
+        return (duration_us + 500) // 1000 + 1 + self.heater_duration_ms
+
+    async def read(self) -> Reading:
+        async with self.bus.transaction(self.NAME):
+            self._write(_REG_RES_HEAT0, self._heater_resistance())
+            self._write(_REG_GAS_WAIT0, _heater_duration(self.heater_duration_ms))
+            self._write(_REG_CTRL_GAS_1, _RUN_GAS)
+            self._write(
+                _REG_CTRL_MEAS,
+                self._osrs_t << 5 | self._osrs_p << 2 | _MODE_FORCED,
+            )
+        await asyncio.sleep_ms(self.measurement_duration_ms())
+
+        field = self._field
+        for _ in range(self.max_polls):
+            async with self.bus.transaction(self.NAME):
+                self.i2c_bus.readfrom_mem_into(self.address, _REG_FIELD0, field)
+            if field[0] & _NEW_DATA:
+                return self._compensate(field)
+            await asyncio.sleep_ms(self.poll_interval_ms)
+
+        raise OSError("BME688 measurement not ready")
+
+    def _compensate(self, field: bytearray) -> Reading:
+        adc_pressure = field[2] << 12 | field[3] << 4 | field[4] >> 4
+        adc_temperature = field[5] << 12 | field[6] << 4 | field[7] >> 4
+        adc_humidity = field[8] << 8 | field[9]
+        adc_gas = field[15] << 2 | field[16] >> 6
+        gas_range = field[16] & 0x0F
+
+        t_fine = self._t_fine(adc_temperature)
+        temperature = t_fine / 5120.0
+        self._ambient_temperature = temperature
+
+        timestamp = time.time()
+        self._temperature.value = temperature
+        self._relative_humidity.value = self._compensate_humidity(
+            adc_humidity, temperature
+        )
+        self._pressure.value = self._compensate_pressure(adc_pressure, t_fine) / 100
+        if field[16] & _GAS_VALID and field[16] & _HEAT_STAB:
+            self._gas_resistance.value = self._compensate_gas(adc_gas, gas_range)
+            reading = self._reading
+        else:
+            # The heater did not reach its target temperature in time
+            reading = self._reading_without_gas
+        reading.timestamp = timestamp
+        return reading
+
+    def _t_fine(self, adc: int) -> float:
+        t1, t2, t3 = self._par_t
+        var1 = (adc / 16384.0 - t1 / 1024.0) * t2
+        var2 = adc / 131072.0 - t1 / 8192.0
+        return var1 + var2 * var2 * t3 * 16.0
+
+    def _compensate_pressure(self, adc: int, t_fine: float) -> float:
+        p1, p2, p3, p4, p5, p6, p7, p8, p9, p10 = self._par_p
+        var1 = t_fine / 2.0 - 64000.0
+        var2 = var1 * var1 * (p6 / 131072.0)
+        var2 = var2 + var1 * p5 * 2.0
+        var2 = var2 / 4.0 + p4 * 65536.0
+        var1 = (p3 * var1 * var1 / 16384.0 + p2 * var1) / 524288.0
+        var1 = (1.0 + var1 / 32768.0) * p1
+        if var1 == 0:
+            return 0.0
+        pressure = 1048576.0 - adc
+        pressure = (pressure - var2 / 4096.0) * 6250.0 / var1
+        var1 = p9 * pressure * pressure / 2147483648.0
+        var2 = pressure * (p8 / 32768.0)
+        var3 = (pressure / 256.0) ** 3 * (p10 / 131072.0)
+        return pressure + (var1 + var2 + var3 + p7 * 128.0) / 16.0
+
+    def _compensate_humidity(self, adc: int, temperature: float) -> float:
+        h1, h2, h3, h4, h5, h6, h7 = self._par_h
+        var1 = adc - (h1 * 16.0 + h3 / 2.0 * temperature)
+        var2 = var1 * (
+            h2
+            / 262144.0
+            * (1.0 + h4 / 16384.0 * temperature + h5 / 1048576.0 * temperature**2)
+        )
+        var3 = h6 / 16384.0
+        var4 = h7 / 2097152.0
+        humidity = var2 + (var3 + var4 * temperature) * var2 * var2
+        return min(100.0, max(0.0, humidity))
+
+    def _compensate_gas(self, adc: int, gas_range: int) -> float:
+        var1 = 262144 >> gas_range
+        var2 = (adc - 512) * 3 + 4096
+        return 1000000.0 * var1 / var2
+
+    def _heater_resistance(self) -> int:
+        gh1, gh2, gh3 = self._par_gh
+        var1 = gh1 / 16.0 + 49.0
+        var2 = gh2 / 32768.0 * 0.0005 + 0.00235
+        var3 = gh3 / 1024.0
+        var4 = var1 * (1.0 + var2 * self.heater_temperature)
+        var5 = var4 + var3 * self._ambient_temperature
+        res_heat = 3.4 * (
+            var5
+            * (4.0 / (4.0 + self._res_heat_range))
+            * (1.0 / (1.0 + self._res_heat_val * 0.002))
+            - 25
+        )
+        return min(255, max(0, int(res_heat)))
+
+    def _read_calibration(self) -> None:
+        c = (
+            self._read(_REG_COEFF1, _LEN_COEFF1)
+            + self._read(_REG_COEFF2, _LEN_COEFF2)
+            + self._read(_REG_COEFF3, _LEN_COEFF3)
+        )
+        self._par_t = (
+            struct.unpack_from("<H", c, 31)[0],
+            struct.unpack_from("<h", c, 0)[0],
+            struct.unpack_from("<b", c, 2)[0],
+        )
+        self._par_p = (
+            struct.unpack_from("<H", c, 4)[0],
+            struct.unpack_from("<h", c, 6)[0],
+            struct.unpack_from("<b", c, 8)[0],
+            struct.unpack_from("<h", c, 10)[0],
+            struct.unpack_from("<h", c, 12)[0],
+            struct.unpack_from("<b", c, 15)[0],
+            struct.unpack_from("<b", c, 14)[0],
+            struct.unpack_from("<h", c, 18)[0],
+            struct.unpack_from("<h", c, 20)[0],
+            c[22],
+        )
+        self._par_h = (
+            c[25] << 4 | c[24] & 0x0F,
+            c[23] << 4 | c[24] >> 4,
+            struct.unpack_from("<b", c, 26)[0],
+            struct.unpack_from("<b", c, 27)[0],
+            struct.unpack_from("<b", c, 28)[0],
+            c[29],
+            struct.unpack_from("<b", c, 30)[0],
+        )
+        self._par_gh = (
+            struct.unpack_from("<b", c, 35)[0],
+            struct.unpack_from("<h", c, 33)[0],
+            struct.unpack_from("<b", c, 36)[0],
+        )
+        self._res_heat_val = struct.unpack_from("<b", c, 37)[0]
+        self._res_heat_range = (c[39] & 0x30) >> 4
+
+    def _read(self, reg: int, nbytes: int) -> bytes:
+        return self.i2c_bus.readfrom_mem(self.address, reg, nbytes)
+
+    def _write(self, reg: int, value: int) -> None:
+        self.i2c_bus.writeto_mem(self.address, reg, bytes((value,)))
@@ -0,0 +1,125 @@
+from typing import Dict, Optional
+
+from picosense.sensors.aggregate import base_metric
+from picosense.sensors.reader import CallbackStage, Reading
+
+
+class Threshold:
+    """
+    Minimum change of a metric that is worth reporting.
+
+    Attributes:
+        absolute (float): Change in the metric's unit, ignored if 0.
+        relative (float): Change as a fraction of the last reported value,
+            ignored if 0.
+    """
+
+    __slots__ = ("absolute", "relative")
+
+    def __init__(self, absolute: float = 0, relative: float = 0):
+        self.absolute = absolute
+        self.relative = relative
+
+    def exceeded(self, last: float, value: float) -> bool:
+        if not self.absolute and not self.relative:
+            return True
+        change = abs(value - last)
+        if self.absolute and change >= self.absolute:
+            return True
+        if self.relative and change >= self.relative * abs(last):
+            return True
+        return False
+
+
+class DeadbandFilter(CallbackStage):
+    """
+    Callback stage that only forwards measurements that changed significantly.
+
+    A measurement is forwarded when it differs from the last forwarded value
+    of the same metric by at least its threshold, or when nothing was
+    forwarded for that metric for heartbeat seconds. Metrics without a
+    threshold are always forwarded. Aggregates like co2_concentration_mean
+    use the threshold of their metric unless they have one of their own.
+
+    Attributes:
+        thresholds (dict): Metric name -> Threshold.
+        heartbeat (int): Maximum seconds between two reports of a metric.
+        partial (bool): Forward only the changed measurements of a reading.
+            If False the whole reading is forwarded when any metric changed,
+            which keeps the metric layout stable for batched publishing.
+    """
+
+    def __init__(
+        self,
+        thresholds: Optional[Dict[str, Threshold]] = None,
+        heartbeat: int = 900,
+        partial: bool = True,
+    ):
+        super().__init__()
+        self.thresholds = thresholds or {}
+        self.heartbeat = heartbeat
+        self.partial = partial
+        # Sensor name -> ({metric name: [threshold, last value, last time]},
+        # forwarded reading). Metrics are tracked by name, so that readings
+        # that leave a metric out, e.g. an invalid gas resistance, keep the
+        # state of the others.
+        self._sensors: Dict[Optional[str], list] = {}
+        self._stats = {"forwarded": 0, "suppressed": 0}
+
+    def stats(self):
+        return self._stats
+
+    async def process(self, reading: Reading) -> None:
+        """Forward the measurements of a reading that exceed their deadband."""
+        state = self._sensors.get(reading.sensor)
+        if state is None:
+            state = ({}, Reading([], 0, reading.sensor))
+            self._sensors[reading.sensor] = state
+        metrics, out = state
+
+        timestamp = reading.timestamp
+        measurements = reading.measurements
+        forwarded = out.measurements
+        forwarded.clear()
+        changed = False
+        for m in measurements:
+            metric = metrics.get(m.name)
+            if metric is None:
+                metric = [self._threshold(m.name), 0.0, 0]
+                metrics[m.name] = metric
+            threshold = metric[0]
+            if (
+                metric[2] == 0
+                or timestamp - metric[2] >= self.heartbeat
+                or threshold is None
+                or threshold.exceeded(metric[1], m.value)
+            ):
+                changed = True
+                if self.partial:
+                    forwarded.append(m)
+                    metric[1] = m.value
+                    metric[2] = timestamp
+
+        if not changed:
+            self._stats["suppressed"] += len(measurements)
+            return
+        if not self.partial:
+            for m in measurements:
+                forwarded.append(m)
+                metric = metrics[m.name]
+                metric[1] = m.value
+                metric[2] = timestamp
+        self._stats["forwarded"] += len(forwarded)
+        self._stats["suppressed"] += len(measurements) - len(forwarded)
+
+        out.timestamp = timestamp
+        await self.forward(out)
+
+    def _threshold(self, name: str) -> Optional[Threshold]:
+        threshold = self.thresholds.get(name)
+        if threshold is None:
+            # Aggregated metric, e.g. co2_concentration_mean_5m
+            base = base_metric(name)
+            if base is not None:
+                threshold = self.thresholds.get(base)
+        return threshold
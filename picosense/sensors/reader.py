@@ -1,57 +1,147 @@
 import asyncio
-import json
 import logging
-from typing import Awaitable, Callable, List
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
 
-logger = logging.getLogger(__name__)
+from picosense.system.log import get_logger
+from picosense.system.metrics import Histogram
+
+logger = get_logger(__name__)
 
 
 class Measurement:
+    __slots__ = ("name", "unit", "value")
+
     def __init__(self, name: str, unit: str, value: float):
         self.name = name
         self.unit = unit
         self.value = value
 
     def __repr__(self) -> str:
-        return json.dumps(self.__dict__)
+        return "%s=%s%s" % (self.name, self.value, self.unit)
 
     def __str__(self) -> str:
-        return json.dumps(self.__dict__)
+        return self.__repr__()
+
+
+# Fixed (name, unit) metric layout of a sensor
+MetricLayout = Tuple[Tuple[str, str], ...]
 
 
 class Reading:
-    def __init__(self, measurements: List[Measurement], timestamp: int):
+    """
+    A set of measurements taken by a sensor at the same time.
+
+    Sensor wrappers create one Reading from their metric layout and update its
+    values in place on every read, so callbacks that keep a reading after they
+    return must store a copy() instead of the reading itself.
+    """
+
+    __slots__ = ("measurements", "timestamp", "sensor")
+
+    def __init__(
+        self,
+        measurements: List[Measurement],
+        timestamp: int,
+        sensor: Optional[str] = None,
+    ):
         self.measurements = measurements
         self.timestamp = timestamp
+        # Name of the SensorReader that produced this reading
+        self.sensor = sensor
+
+    @classmethod
+    def from_layout(cls, layout: MetricLayout, sensor: Optional[str] = None):
+        """Create a reading with one zero valued measurement per metric."""
+        return cls([Measurement(name, unit, 0) for name, unit in layout], 0, sensor)
+
+    def copy(self) -> "Reading":
+        return Reading(
+            [Measurement(m.name, m.unit, m.value) for m in self.measurements],
+            self.timestamp,
+            self.sensor,
+        )
 
     def __repr__(self) -> str:
-        return json.dumps(self.__dict__)
+        return "%s@%s%s" % (self.sensor, self.timestamp, self.measurements)
 
     def __str__(self) -> str:
-        return json.dumps(self.__dict__)
+        return self.__repr__()
 
 
 SensorReadFunc = Callable[..., Awaitable[Reading]]
 SensorReadCallback = Callable[[Reading], Awaitable[None]]
 
 
+def same_layout(names: List[str], measurements: List[Measurement]) -> bool:
+    """Return True if the measurements are the named metrics in that order."""
+    if len(names) != len(measurements):
+        return False
+    for i in range(len(names)):
+        if names[i] != measurements[i].name:
+            return False
+    return True
+
+
+class CallbackStage:
+    """
+    Base of the stages that sit between a SensorReader and its callbacks.
+
+    Subclasses implement process(reading), which is registered as a callback
+    of the previous stage, and pass their output on with forward().
+    """
+
+    def __init__(self):
+        self._callbacks: List[SensorReadCallback] = []
+
+    def add_callback(self, callback: SensorReadCallback):
+        logger.debug("Registering callback %s", callback)
+        self._callbacks.append(callback)
+
+    async def forward(self, reading: Reading) -> None:
+        if self._callbacks:
+            await asyncio.gather(*[callback(reading) for callback in self._callbacks])
+
+
 class SensorReader:
     name: str
     _read_func: SensorReadFunc
     _interval: float
     _callbacks: List[SensorReadCallback]
 
-    def __init__(self, name: str, read_func: SensorReadFunc, interval: float):
+    def __init__(
+        self,
+        name: str,
+        read_func: SensorReadFunc,
+        interval: float,
+        phase: float = 0,
+    ):
         self.name = name
         self._read_func = read_func
         self._interval = interval
+        # Offset of the first reading so that readers sharing a bus don't wake
+        # at the same time
+        self._phase = phase
         self._callbacks = []
-        self._logger = logging.getLogger(f"{__name__}.{self.name}")
+        self._logger = get_logger(f"{__name__}.{self.name}")
         self._running = True
+        # Deadline of the next reading in ticks_ms, in the past while reading
+        self.deadline = time.ticks_ms()
+        self._jitter_sum_ms = 0
         self._stats = {
             "readings": 0,
             "errors": 0,
+            # Readings that did not finish before the next one was due
+            "overruns": 0,
+            # Readings skipped to get back on schedule after an overrun
+            "skipped": 0,
+            # Delay between the deadline and the start of a reading
+            "jitter_max_ms": 0,
+            "jitter_avg_ms": 0,
         }
+        self._read_ms = Histogram()
+        self._callback_ms = Histogram()
+        self._jitter_ms = Histogram()
 
     def stop(self):
         self._logger.info("Stopping")
@@ -62,27 +152,64 @@ class SensorReader:
         self._callbacks.append(callback)
 
     def stats(self):
+        if self._stats["readings"]:
+            self._stats["jitter_avg_ms"] = (
+                self._jitter_sum_ms // self._stats["readings"]
+            )
         return self._stats
 
+    def metrics(self):
+        """Return the stats together with the timing histograms."""
+        metrics = dict(self.stats())
+        metrics["read_ms"] = self._read_ms
+        metrics["callback_ms"] = self._callback_ms
+        metrics["jitter_ms"] = self._jitter_ms
+        return metrics
+
     async def run(self):
         self._logger.info(
-            "Started collecting sensor readings with interval %ss", self._interval
+            "Started collecting sensor readings with interval %ss and phase %ss",
+            self._interval,
+            self._phase,
         )
+        interval_ms = int(self._interval * 1000)
+        # Readings are scheduled on absolute deadlines so that the time spent
+        # reading and in callbacks does not add up to drift.
+        deadline = time.ticks_add(time.ticks_ms(), int(self._phase * 1000))
         while self._running:
-            self._logger.debug("Performing sensor reading")
+            self.deadline = deadline
+            delay = time.ticks_diff(deadline, time.ticks_ms())
+            if delay > 0:
+                await asyncio.sleep_ms(delay)
+            jitter = time.ticks_diff(time.ticks_ms(), deadline)
+            self._jitter_sum_ms += jitter
+            if jitter > self._stats["jitter_max_ms"]:
+                self._stats["jitter_max_ms"] = jitter
+            self._jitter_ms.observe(jitter)
+
+            # Checked once per cycle so that the debug calls below cost nothing
+            # unless debug logging is enabled for this reader
+            debug = self._logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                self._logger.debug("Performing sensor reading")
+            reading = None
+            start = time.ticks_ms()
             try:
-                self._logger.debug("Executing read function")
                 reading = await self._read_func()
-                self._logger.debug("Obtained reading: %s", reading)
+                self._read_ms.observe(time.ticks_diff(time.ticks_ms(), start))
+                if debug:
+                    self._logger.debug("Obtained reading: %s", reading)
             except Exception as e:
                 self._stats["errors"] += 1
                 self._logger.error("Error while executing read function: %s", e)
 
             if reading is not None:
+                if reading.sensor is None:
+                    reading.sensor = self.name
+                start = time.ticks_ms()
                 try:
-                    self._logger.debug("Executing callbacks")
                     await self._execute_callbacks(reading)
-                    self._logger.debug("Callbacks executed")
+                    self._callback_ms.observe(time.ticks_diff(time.ticks_ms(), start))
                 except Exception as e:
                     self._stats["errors"] += 1
                     self._logger.error("Error while executing read callback: %s", e)
@@ -90,8 +217,23 @@ class SensorReader:
                 self._logger.warning("Not executing callbacks because reading is None")
 
             self._stats["readings"] += 1
-            self._logger.debug("Sensor reading complete")
-            await asyncio.sleep(self._interval)
+            if debug:
+                self._logger.debug("Sensor reading complete")
+
+            deadline = time.ticks_add(deadline, interval_ms)
+            late = time.ticks_diff(time.ticks_ms(), deadline)
+            if late > 0:
+                # Skip the slots that were missed instead of reading in a burst,
+                # a reading that finishes right on a deadline still makes it
+                missed = (late - 1) // interval_ms + 1
+                self._stats["overruns"] += 1
+                self._stats["skipped"] += missed
+                self._logger.warning(
+                    "Reading overran its interval by %dms, skipping %d",
+                    late,
+                    missed,
+                )
+                deadline = time.ticks_add(deadline, missed * interval_ms)
         self._logger.info("Stopped collecting sensor readings")
 
     async def _execute_callbacks(self, reading: Reading):
@@ -105,11 +247,17 @@ class SensorReaderManager:
     def __init__(self, stats_interval: int = 60):
         self.stats_interval = stats_interval
         self.readers: List[SensorReader] = []
+        # Bus name -> object with a stats() method, e.g. I2CBus
+        self.buses = {}
 
     def add_reader(self, reader: SensorReader):
         logger.debug("Adding reader %s", reader.name)
         self.readers.append(reader)
 
+    def add_bus(self, name: str, bus):
+        logger.debug("Adding bus %s", name)
+        self.buses[name] = bus
+
     def stop(self):
         logger.info("Stopping sensor readers")
         for reader in self.readers:
@@ -118,6 +266,24 @@ class SensorReaderManager:
     def stats(self):
         return {reader.name: reader.stats() for reader in self.readers}
 
+    def next_deadline_ms(self) -> Optional[int]:
+        """
+        Return the time until the next reading is due.
+
+        0 or less means a reader is due or still reading. None if there are
+        no readers.
+        """
+        if not self.readers:
+            return None
+        now = time.ticks_ms()
+        return min(time.ticks_diff(reader.deadline, now) for reader in self.readers)
+
+    def metrics(self):
+        return {
+            "readers": {reader.name: reader.metrics() for reader in self.readers},
+            "buses": {name: bus.stats() for name, bus in self.buses.items()},
+        }
+
     async def start(self):
         logger.info("Starting %s sensor readers", len(self.readers))
         tasks = [reader.run() for reader in self.readers]
@@ -128,4 +294,6 @@ class SensorReaderManager:
         await asyncio.sleep(self.stats_interval)
         while True:
             logger.info("Sensor reader stats: %s", self.stats())
+            for name, bus in self.buses.items():
+                logger.info("Bus %s stats: %s", name, bus.stats())
             await asyncio.sleep(self.stats_interval)
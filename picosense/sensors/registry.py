@@ -0,0 +1,62 @@
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+from picosense.system.log import get_logger
+
+logger = get_logger(__name__)
+
+# Sensor type -> (module, wrapper class). Modules are only imported when a
+# sensor of that type is created, so unused drivers cost no RAM.
+_SENSOR_TYPES: Dict[str, Tuple[str, str]] = {
+    "bh1750": ("picosense.sensors.bh1750", "BH1750Wrapper"),
+    "bme688": ("picosense.sensors.bme688", "BME688Wrapper"),
+    "scd4x": ("picosense.sensors.scd4x", "SCD4XWrapper"),
+}
+
+
+def register_sensor(type_name: str, module: str, class_name: str) -> None:
+    """
+    Register a sensor wrapper under a type name.
+
+    The wrapper is constructed as class_name(bus, address=..., **options) and
+    must provide an async read() that returns a Reading.
+    """
+    _SENSOR_TYPES[type_name] = (module, class_name)
+
+
+def sensor_types():
+    return sorted(_SENSOR_TYPES)
+
+
+def get_sensor_class(type_name: str) -> Any:
+    """Import and return the wrapper class registered for type_name."""
+    try:
+        module, class_name = _SENSOR_TYPES[type_name]
+    except KeyError:
+        raise ValueError("Unknown sensor type %s" % type_name)
+    if module not in sys.modules:
+        logger.debug("Importing %s for sensor type %s", module, type_name)
+        __import__(module)
+    return getattr(sys.modules[module], class_name)
+
+
+def create_sensor(
+    type_name: str,
+    bus: Any,
+    address: Optional[Any] = None,
+    options: Optional[Dict[str, Any]] = None,
+) -> Any:
+    """
+    Create the wrapper for a configured sensor.
+
+    Parameters:
+        type_name (str): Registered sensor type, e.g. "scd4x".
+        bus: Bus the sensor is attached to, e.g. an I2CBus.
+        address (int or str): Bus address, "0x" strings are accepted since
+            JSON has no hex literals. The wrapper default is used if None.
+        options (dict): Extra keyword arguments for the wrapper.
+    """
+    kwargs = dict(options or {})
+    if address is not None:
+        kwargs["address"] = int(address, 0) if isinstance(address, str) else address
+    return get_sensor_class(type_name)(bus, **kwargs)
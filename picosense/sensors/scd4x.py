@@ -3,42 +3,130 @@ import time
 import uasyncio as asyncio
 from scd4x import SCD4X as Sensor
 
-from picosense.sensors.reader import Measurement, Reading
+from picosense.sensors.reader import Reading
+from picosense.system.i2c import I2CBus
 
 UNIT_TEMPERATURE = "C"
 UNIT_RELATIVE_HUMIDITY = "%"
 UNIT_CO2_CONCENTRATION = "ppm"
 
+MODE_PERIODIC = "periodic"
+MODE_LOW_POWER = "low_power"
+MODE_SINGLE_SHOT = "single_shot"
+
+# Time in ms between measurements, or until the measurement is ready in
+# single shot mode
+MEASUREMENT_PERIODS = {
+    MODE_PERIODIC: 5000,
+    MODE_LOW_POWER: 30000,
+    MODE_SINGLE_SHOT: 5000,
+}
+
+_CMD_START_PERIODIC = 0x21B1
+_CMD_START_LOW_POWER_PERIODIC = 0x21AC
+_CMD_STOP_PERIODIC = 0x3F86
+_CMD_MEASURE_SINGLE_SHOT = 0x219D
+# Time the sensor needs after stopping periodic measurement
+_STOP_DELAY_MS = 500
+
 
 class SCD4XWrapper:
-    def __init__(self, i2c_bus):
-        self.i2c_bus = i2c_bus
-        self.sensor = Sensor(i2c_bus)
-        self.sensor.start_periodic_measurement()
+    """
+    Wrapper for the Sensirion SCD40/SCD41 CO2 sensor.
 
-    async def _wait_for_data_ready(self) -> bool:
-        """Asynchronously wait until the sensor data is ready."""
-        while not self.sensor.data_ready:
-            await asyncio.sleep(1)
-        return True
+    Instead of polling the sensor every second, the wrapper predicts when the
+    next measurement becomes available from the measurement period of the
+    current mode and sleeps until then. The data ready flag is only polled,
+    every poll_interval_ms and at most max_polls times, if the measurement is
+    not there yet at the predicted time.
 
-    async def read(self) -> Reading:
-        await self._wait_for_data_ready()
+    Attributes:
+        mode (str): One of MODE_PERIODIC, MODE_LOW_POWER or MODE_SINGLE_SHOT.
+        poll_interval_ms (int): Time between data ready polls.
+        max_polls (int): Number of polls before a read fails.
+        address (int): I2C address of the sensor.
+    """
 
-        timestamp = time.time()
+    NAME = "scd4x"
+    I2C_ADDRESS = 0x62
+    LAYOUT = (
+        ("temperature", UNIT_TEMPERATURE),
+        ("relative_humidity", UNIT_RELATIVE_HUMIDITY),
+        ("co2_concentration", UNIT_CO2_CONCENTRATION),
+    )
 
-        temperature = Measurement(
-            name="temperature", unit=UNIT_TEMPERATURE, value=self.sensor.temperature
-        )
-        relative_humidity = Measurement(
-            name="relative_humidity",
-            unit=UNIT_RELATIVE_HUMIDITY,
-            value=self.sensor.relative_humidity,
-        )
-        co2 = Measurement(
-            name="co2_concentration", unit=UNIT_CO2_CONCENTRATION, value=self.sensor.CO2
-        )
+    def __init__(
+        self,
+        bus: I2CBus,
+        mode: str = MODE_PERIODIC,
+        poll_interval_ms: int = 100,
+        max_polls: int = 50,
+        address: int = I2C_ADDRESS,
+    ):
+        if mode not in MEASUREMENT_PERIODS:
+            raise ValueError("Unknown SCD4x mode %s" % mode)
+        self.bus = bus
+        self.i2c_bus = bus.i2c
+        self.poll_interval_ms = poll_interval_ms
+        self.max_polls = max_polls
+        self.address = address
+        self.sensor = Sensor(self.i2c_bus, address)
+        self.mode = mode
+        self._start_mode()
+        # Reused for every read to avoid allocations
+        self._reading = Reading.from_layout(self.LAYOUT)
+        (
+            self._temperature,
+            self._relative_humidity,
+            self._co2,
+        ) = self._reading.measurements
 
-        return Reading(
-            measurements=[temperature, relative_humidity, co2], timestamp=timestamp
+    async def set_mode(self, mode: str) -> None:
+        """Switch between periodic, low power periodic and single shot mode."""
+        if mode not in MEASUREMENT_PERIODS:
+            raise ValueError("Unknown SCD4x mode %s" % mode)
+        if mode == self.mode:
+            return
+        if self.mode != MODE_SINGLE_SHOT:
+            async with self.bus.transaction(self.NAME):
+                self._command(_CMD_STOP_PERIODIC)
+            await asyncio.sleep_ms(_STOP_DELAY_MS)
+        async with self.bus.transaction(self.NAME):
+            self.mode = mode
+            self._start_mode()
+
+    def _start_mode(self) -> None:
+        if self.mode == MODE_PERIODIC:
+            self._command(_CMD_START_PERIODIC)
+        elif self.mode == MODE_LOW_POWER:
+            self._command(_CMD_START_LOW_POWER_PERIODIC)
+        self._next_ready = time.ticks_add(
+            time.ticks_ms(), MEASUREMENT_PERIODS[self.mode]
         )
+
+    def _command(self, cmd: int) -> None:
+        self.i2c_bus.writeto(self.address, bytes((cmd >> 8, cmd & 0xFF)))
+
+    async def read(self) -> Reading:
+        period = MEASUREMENT_PERIODS[self.mode]
+        if self.mode == MODE_SINGLE_SHOT:
+            async with self.bus.transaction(self.NAME):
+                self._command(_CMD_MEASURE_SINGLE_SHOT)
+            self._next_ready = time.ticks_add(time.ticks_ms(), period)
+
+        delay = time.ticks_diff(self._next_ready, time.ticks_ms())
+        if delay > 0:
+            await asyncio.sleep_ms(delay)
+
+        for _ in range(self.max_polls):
+            async with self.bus.transaction(self.NAME):
+                if self.sensor.data_ready:
+                    self._reading.timestamp = time.time()
+                    self._temperature.value = self.sensor.temperature
+                    self._relative_humidity.value = self.sensor.relative_humidity
+                    self._co2.value = self.sensor.CO2
+                    self._next_ready = time.ticks_add(time.ticks_ms(), period)
+                    return self._reading
+            await asyncio.sleep_ms(self.poll_interval_ms)
+
+        raise OSError("SCD4x measurement not ready")
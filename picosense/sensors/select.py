@@ -0,0 +1,35 @@
+from typing import Optional, Sequence
+
+from picosense.sensors.reader import CallbackStage, Reading
+
+
+class MetricSelector(CallbackStage):
+    """
+    Callback stage that only forwards the enabled metrics of a reading.
+
+    The wrappers reuse their reading and its measurements, so the selected
+    measurements are looked up once and only rebuilt if the wrapper hands
+    over a different measurement list.
+
+    Attributes:
+        metrics (tuple): Names of the metrics to forward.
+    """
+
+    def __init__(self, metrics: Sequence[str]):
+        super().__init__()
+        self.metrics = tuple(metrics)
+        self._source: Optional[list] = None
+        self._out = Reading([], 0)
+
+    async def process(self, reading: Reading) -> None:
+        out = self._out
+        if reading.measurements is not self._source:
+            self._source = reading.measurements
+            out.measurements = [
+                m for m in reading.measurements if m.name in self.metrics
+            ]
+        if not out.measurements:
+            return
+        out.timestamp = reading.timestamp
+        out.sensor = reading.sensor
+        await self.forward(out)
@@ -0,0 +1,111 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Sequence
+
+from picosense.system.log import get_logger
+
+logger = get_logger(__name__)
+
+PHASE_OK = "ok"
+PHASE_TIMEOUT = "timeout"
+PHASE_ERROR = "error"
+PHASE_SKIPPED = "skipped"
+
+
+class _Phase:
+    __slots__ = ("name", "func", "timeout", "after", "done", "status")
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+        timeout: float,
+        after: Sequence[str],
+    ):
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.after = tuple(after)
+        self.done = asyncio.Event()
+        self.status = None
+
+
+class BootSequence:
+    """
+    Runs boot phases concurrently, each with its own timeout.
+
+    A phase starts as soon as the phases it comes after have finished, and
+    is skipped if one of them did not succeed. This overlaps e.g. WiFi
+    association with the sensor warm-up instead of running them in turn.
+
+    Usage:
+        boot = BootSequence()
+        boot.add("wifi", connect, timeout=15)
+        boot.add("ntp", settime, timeout=5, after=("wifi",))
+        results = await boot.run()
+
+    Attributes:
+        results (dict): Phase name -> {"status", "start_ms", "duration_ms"}
+            where start_ms is relative to the start of the boot sequence.
+    """
+
+    def __init__(self):
+        self._phases: List[_Phase] = []
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self._start = 0
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[Any]],
+        timeout: float,
+        after: Sequence[str] = (),
+    ) -> None:
+        self._phases.append(_Phase(name, func, timeout, after))
+
+    async def run(self) -> Dict[str, Dict[str, Any]]:
+        self._start = time.ticks_ms()
+        await asyncio.gather(*[self._run_phase(phase) for phase in self._phases])
+        logger.info(
+            "Boot finished in %dms: %s",
+            time.ticks_diff(time.ticks_ms(), self._start),
+            self.results,
+        )
+        return self.results
+
+    def succeeded(self, name: str) -> bool:
+        result = self.results.get(name)
+        return result is not None and result["status"] == PHASE_OK
+
+    async def _run_phase(self, phase: _Phase):
+        started = self._start
+        try:
+            for name in phase.after:
+                dependency = self._get(name)
+                await dependency.done.wait()
+                if dependency.status != PHASE_OK:
+                    phase.status = PHASE_SKIPPED
+                    return
+            started = time.ticks_ms()
+            try:
+                await asyncio.wait_for(phase.func(), phase.timeout)
+                phase.status = PHASE_OK
+            except asyncio.TimeoutError:
+                logger.warning("Boot phase %s timed out", phase.name)
+                phase.status = PHASE_TIMEOUT
+            except Exception as e:
+                logger.error("Boot phase %s failed: %s", phase.name, e)
+                phase.status = PHASE_ERROR
+        finally:
+            self.results[phase.name] = {
+                "status": phase.status,
+                "start_ms": time.ticks_diff(started, self._start),
+                "duration_ms": time.ticks_diff(time.ticks_ms(), started),
+            }
+            phase.done.set()
+
+    def _get(self, name: str) -> _Phase:
+        for phase in self._phases:
+            if phase.name == name:
+                return phase
+        raise ValueError("Unknown boot phase %s" % name)
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from typing import Any, Dict
+
+from picosense.system.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Transaction:
+    """Async context manager holding the bus for one device."""
+
+    __slots__ = ("_bus", "_device", "_start")
+
+    def __init__(self, bus: "I2CBus", device: str):
+        self._bus = bus
+        self._device = device
+        self._start = 0
+
+    async def __aenter__(self):
+        await self._bus._acquire()
+        self._start = time.ticks_us()
+        return self._bus.i2c
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._bus._release(
+            self._device, time.ticks_diff(time.ticks_us(), self._start), exc_type
+        )
+        return False
+
+
+class I2CBus:
+    """
+    Arbiter for an I2C bus shared by several sensor wrappers.
+
+    Drivers talk to the bus synchronously, so every access has to happen
+    inside a transaction which serializes the wrappers through an asyncio
+    lock. If coalesce_ms is set, the first transaction on an idle bus waits
+    that long so that readers due shortly after join the same bus-active
+    window and run back to back. Bus time and errors are accounted per device.
+
+    Attributes:
+        i2c: The underlying machine.I2C (or compatible) object.
+        coalesce_ms (int): Time to hold an idle bus open for other transactions.
+    """
+
+    def __init__(self, i2c: Any, coalesce_ms: int = 0):
+        self.i2c = i2c
+        self.coalesce_ms = coalesce_ms
+        self._lock = asyncio.Lock()
+        self._waiting = 0
+        self._in_window = False
+        self._stats: Dict[str, Any] = {"windows": 0, "devices": {}}
+
+    def transaction(self, device: str) -> _Transaction:
+        """
+        Return a context manager that holds the bus for a device.
+
+        Usage:
+            async with bus.transaction("scd41") as i2c:
+                value = sensor.measurement
+        """
+        return _Transaction(self, device)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._stats
+
+    async def _acquire(self):
+        self._waiting += 1
+        try:
+            await self._lock.acquire()
+        finally:
+            self._waiting -= 1
+        if not self._in_window:
+            self._in_window = True
+            self._stats["windows"] += 1
+            if self.coalesce_ms:
+                await asyncio.sleep_ms(self.coalesce_ms)
+
+    def _release(self, device: str, bus_time_us: int, exc_type: Any):
+        stats = self._stats["devices"].get(device)
+        if stats is None:
+            stats = {"transactions": 0, "bus_time_us": 0, "errors": 0}
+            self._stats["devices"][device] = stats
+        stats["transactions"] += 1
+        stats["bus_time_us"] += bus_time_us
+        if exc_type is not None:
+            stats["errors"] += 1
+        # The window stays open while other transactions are queued
+        if not self._waiting:
+            self._in_window = False
+        self._lock.release()
@@ -1,57 +1,153 @@
 import machine
-import time
 import typing
 
+import uasyncio as asyncio
+
+# A pattern is a sequence of (brightness in percent, duration in ms) steps
+# that is played in a loop
+Pattern = typing.Tuple[typing.Tuple[int, int], ...]
+
+PATTERN_SOLID: Pattern = ((100, 0),)
+PATTERN_FAST_BLINK: Pattern = ((100, 100), (0, 400))
+PATTERN_HEARTBEAT: Pattern = ((20, 50), (0, 4950))
+PATTERN_DOUBLE_BLINK: Pattern = ((100, 100), (0, 150), (100, 100), (0, 1650))
+PATTERN_FLASH: Pattern = ((100, 100), (0, 100))
+
+# Device states
+STATE_BOOTING = "booting"
+STATE_CONNECTING = "connecting"
+STATE_OK = "ok"
+STATE_OFFLINE = "offline"
+STATE_ERROR = "error"
+
+STATE_PATTERNS: typing.Dict[str, Pattern] = {
+    STATE_BOOTING: PATTERN_SOLID,
+    STATE_CONNECTING: PATTERN_FAST_BLINK,
+    # A short dim blip so that a healthy device is visibly alive
+    STATE_OK: PATTERN_HEARTBEAT,
+    # Disconnected from the broker, readings are buffered
+    STATE_OFFLINE: PATTERN_DOUBLE_BLINK,
+    STATE_ERROR: PATTERN_FLASH,
+}
+
 
 class LED:
     """
     A class to represent an LED connected to a specific pin on a microcontroller.
 
+    Patterns are played by a background task that only wakes up for the next
+    step, so status indication never blocks the event loop. Brightness uses
+    PWM where the pin supports it, e.g. not for the Pico W on-board LED which
+    is driven by the wireless chip; there any brightness above 0 is on.
+
     Attributes:
         pin_id (int): The pin number to which the LED is connected.
         state (bool): The current state of the LED (True for on, False for off).
+        device_state (str): The last state passed to set_state().
 
     Methods:
         on(): Turns the LED on.
         off(): Turns the LED off.
         toggle(): Toggles the LED state.
-        blink(interval=1, iterations=0): Blinks the LED at a specified interval and number of iterations.
+        blink(interval=1, iterations=0): Blinks the LED in the background.
+        play(pattern, repeat=0): Plays a pattern in the background.
+        set_state(state): Plays the pattern of a device state.
     """
 
-    def __init__(self, pin_id, state=False):
+    def __init__(self, pin_id, state=False, pwm_freq=1000):
         self.__pin__ = machine.Pin(pin_id, machine.Pin.OUT, value=1 if state else 0)
         self.state = state
+        self.device_state: typing.Optional[str] = None
+        self._task = None
+        self._pwm = None
+        if pwm_freq:
+            try:
+                self._pwm = machine.PWM(self.__pin__)
+                self._pwm.freq(pwm_freq)
+            except (AttributeError, TypeError, ValueError):
+                self._pwm = None
+            else:
+                self._set(100 if state else 0)
+
+    @property
+    def has_pwm(self) -> bool:
+        return self._pwm is not None
 
     def on(self):
-        self.__pin__.on()
-        self.state = True
+        self._cancel()
+        self._set(100)
 
     def off(self):
-        self.__pin__.off()
-        self.state = False
+        self._cancel()
+        self._set(0)
 
     def toggle(self):
         self.off() if self.state else self.on()
 
+    def brightness(self, percent: int):
+        self._cancel()
+        self._set(percent)
+
     def blink(
         self, interval: typing.Union[int, float] = 1, iterations: int = 0
     ) -> None:
         """
         Blinks the LED at a specified interval and number of iterations.
 
+        Returns immediately, the blinking runs as a background task until it
+        is done or another pattern or on()/off() replaces it.
+
         Parameters:
             interval (int or float): The time interval between blinks in seconds.
             iterations (int): The number of times to blink the LED. If 0, it blinks indefinitely.
         """
+        half_ms = int(interval * 500)
+        self.play(((100, half_ms), (0, half_ms)), iterations)
+
+    def play(self, pattern: Pattern, repeat: int = 0) -> None:
+        """
+        Plays a pattern in the background, replacing the current one.
+
+        Parameters:
+            pattern (tuple): (brightness in percent, duration in ms) steps.
+            repeat (int): Number of times to play the pattern. If 0, it
+                loops until replaced. The LED is off afterwards.
+        """
+        self._cancel()
+        if len(pattern) == 1 and not repeat:
+            # Constant brightness needs no task
+            self._set(pattern[0][0])
+            return
+        self._task = asyncio.create_task(self._play(pattern, repeat))
+
+    def set_state(self, state: str) -> None:
+        """Shows a device state, e.g. STATE_CONNECTING, as its pattern."""
+        if state == self.device_state:
+            return
+        self.play(STATE_PATTERNS[state])
+        self.device_state = state
+
+    async def _play(self, pattern: Pattern, repeat: int):
         count = 0
-        self.off()
-        while True:
-            if iterations > 0:
-                if count == iterations:
-                    self.off()
-                    return
-            time.sleep(interval / 2)
-            self.on()
-            time.sleep(interval / 2)
-            self.off()
+        while not repeat or count < repeat:
+            for percent, duration_ms in pattern:
+                self._set(percent)
+                await asyncio.sleep_ms(duration_ms)
             count += 1
+        self._set(0)
+        self._task = None
+
+    def _cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.device_state = None
+
+    def _set(self, percent: int):
+        if self._pwm is not None:
+            self._pwm.duty_u16(percent * 65535 // 100)
+        elif percent:
+            self.__pin__.on()
+        else:
+            self.__pin__.off()
+        self.state = percent > 0
@@ -0,0 +1,83 @@
+import logging
+from typing import Dict, List, Tuple
+
+LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "critical": logging.CRITICAL,
+}
+
+# Loggers handed out by get_logger() so that levels configured later apply
+_loggers: Dict[str, logging.Logger] = {}
+# (prefix, level) pairs, longest prefix first
+_module_levels: List[Tuple[str, int]] = []
+# Lowest level any logger may use, 0 for no limit
+_level_floor = 0
+
+
+def get_logging_level(level_str: str) -> int:
+    return LEVELS.get(level_str.lower(), logging.INFO)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Return the logger for name with its per-module level applied.
+
+    MicroPython loggers are not hierarchical, so levels configured for a
+    module prefix with set_module_levels() are applied to each logger
+    directly. Callers on hot paths should check isEnabledFor() before
+    building log arguments.
+    """
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = logging.getLogger(name)
+        _loggers[name] = logger
+        _apply_level(name, logger)
+    return logger
+
+
+def set_module_levels(levels: Dict[str, str]) -> None:
+    """
+    Set log levels per module prefix, e.g. {"picosense.sensors": "debug"}.
+
+    The longest matching prefix wins, loggers without a match use the root
+    level.
+    """
+    _module_levels.clear()
+    for prefix, level in levels.items():
+        _module_levels.append((prefix, get_logging_level(level)))
+    _module_levels.sort(key=lambda item: len(item[0]), reverse=True)
+    for name, logger in _loggers.items():
+        _apply_level(name, logger)
+
+
+def set_level_floor(level: int) -> None:
+    """
+    Raise every logger to at least level, e.g. to drop debug logging while
+    memory runs low. 0 restores the configured levels.
+    """
+    global _level_floor
+    _level_floor = level
+    for name, logger in _loggers.items():
+        _apply_level(name, logger)
+
+
+def lowest_level(level: int) -> int:
+    """Return the lowest of level and the configured module levels."""
+    for _, module_level in _module_levels:
+        if module_level < level:
+            level = module_level
+    return level
+
+
+def _apply_level(name: str, logger: logging.Logger) -> None:
+    for prefix, level in _module_levels:
+        if name == prefix or name.startswith(prefix + "."):
+            logger.setLevel(max(level, _level_floor))
+            return
+    if _level_floor:
+        logger.setLevel(max(logging.getLogger().level, _level_floor))
+    else:
+        logger.setLevel(logging.NOTSET)
@@ -1,13 +1,25 @@
+import asyncio
 import json
 import logging
+import time
+from typing import Dict, List, Optional, Tuple
 
 from picosense.messaging.mqtt import MQTTMessagingProvider
+from picosense.queue import PRIORITY_HIGH, PRIORITY_LOW
+from picosense.system.log import get_logger, lowest_level, set_module_levels
 
-logger = logging.getLogger(__name__)
+logger = get_logger(__name__)
+
+MQTT_LOGGER_PREFIX = "picosense.messaging"
 
 
 def setup_logging(
-    level=logging.INFO, filename="picosense.log", mqtt_provider=None, mqtt_topic="logs"
+    level=logging.INFO,
+    filename="picosense.log",
+    mqtt_provider=None,
+    mqtt_topic="logs",
+    mqtt_options=None,
+    modules=None,
 ):
     format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     json_format = JSONFormatter()
@@ -17,16 +29,24 @@ def setup_logging(
     root_logger.handlers.clear()
     root_logger.setLevel(level)
 
+    # Per-module levels are applied to the loggers, the handlers only need to
+    # let the most verbose of them through
+    if modules is not None:
+        set_module_levels(modules)
+    handler_level = lowest_level(level)
+
     # Setup logging to console
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(level)
+    console_handler.setLevel(handler_level)
     console_handler.setFormatter(logging.Formatter(format))
     root_logger.addHandler(console_handler)
 
     # Setup logging to MQTT
     if mqtt_provider:
-        mqtt_handler = MQTTHandler(provider=mqtt_provider, topic=mqtt_topic)
-        mqtt_handler.setLevel(level)
+        mqtt_handler = MQTTHandler(
+            provider=mqtt_provider, topic=mqtt_topic, **(mqtt_options or {})
+        )
+        mqtt_handler.setLevel(handler_level)
         mqtt_handler.setFormatter(json_format)
         root_logger.addHandler(mqtt_handler)
 
@@ -34,6 +54,25 @@ def setup_logging(
 
 
 class JSONFormatter(logging.Formatter):
+    """
+    Formats records as JSON objects.
+
+    Timestamps have a resolution of one second, so the formatted timestamp
+    is cached and only rebuilt when the second changes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._ct = None
+        self._timestamp = None
+
+    def formatTime(self, datefmt, record):
+        ct = int(record.ct)
+        if ct != self._ct:
+            self._ct = ct
+            self._timestamp = super().formatTime(datefmt, record)
+        return self._timestamp
+
     def format(self, record: logging.LogRecord) -> str:
         log_record = {
             "timestamp": self.formatTime(self.datefmt, record),
@@ -44,29 +83,199 @@ class JSONFormatter(logging.Formatter):
         return json.dumps(log_record)
 
 
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        burst (int): Maximum number of tokens held.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.ticks_ms()
+
+    def take(self) -> bool:
+        """Take a token, returns False if none is available."""
+        now = time.ticks_ms()
+        elapsed = time.ticks_diff(now, self._updated)
+        self._updated = now
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate / 1000)
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+# Records per second and burst size allowed per level. CRITICAL is unlimited.
+DEFAULT_RATE_LIMITS: Dict[int, Tuple[float, int]] = {
+    logging.DEBUG: (0.5, 10),
+    logging.INFO: (1, 20),
+    logging.WARNING: (1, 20),
+    logging.ERROR: (1, 20),
+}
+
+
 class MQTTHandler(logging.Handler):
+    """
+    Ships log records to MQTT in periodic batches.
+
+    Formatted records are buffered and published every flush_interval seconds
+    as one JSON array, so a burst of records costs a single slot in the
+    publish queue. The buffer has its own memory budget of max_bytes, when it
+    is exceeded the oldest records are dropped. Records are rate limited per
+    level with a token bucket and consecutive repeats of the same message are
+    collapsed into a "Last message repeated N times" record.
+
+    Attributes:
+        provider (MQTTMessagingProvider): Provider used to publish batches.
+        topic (str): Subtopic to publish batches to.
+        flush_interval (int): Seconds between batches.
+        max_bytes (int): Memory budget of the buffered records.
+        dropped (int): Records lost to the rate limits or the memory budget.
+    """
+
     def __init__(
         self,
         provider: MQTTMessagingProvider,
         topic: str,
+        flush_interval: int = 10,
+        max_bytes: int = 4096,
+        rate_limits: Optional[Dict[int, Tuple[float, int]]] = None,
     ):
         super().__init__()
         self.provider = provider
         self.topic = topic
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._buckets = {
+            level: TokenBucket(rate, burst)
+            for level, (rate, burst) in (rate_limits or DEFAULT_RATE_LIMITS).items()
+        }
+        self._buffer: List[str] = []
+        self._buffer_bytes = 0
+        self._max_levelno = 0
+        self._rate_limited = 0
+        # Last message seen and how often it was repeated since
+        self._last: Optional[Tuple[str, str, str]] = None
+        self._last_levelno = 0
+        self._repeated = 0
+        self._repeated_at = ""
+        self._rate_limited_at = ""
+        self._flush_task = None
 
     def emit(self, record: logging.LogRecord):
         if record.levelno >= self.level:
-            # Avoid recursive logging from MQTTMessagingProvider messages
-            if record.name == MQTTMessagingProvider.__module__:
+            # Avoid recursive logging from the MQTT provider and client
+            if record.name.startswith(MQTT_LOGGER_PREFIX):
                 return
 
             try:
-                msg = self.format(record)
-                qos = 0
-                if record.levelno >= logging.WARNING:
-                    qos = 1
-                self.provider.publish(self.topic, msg, qos=qos, retain=False)
+                key = (record.name, record.levelname, record.message)
+                if key == self._last:
+                    if not self._repeated:
+                        self._repeated_at = self._timestamp(record)
+                    self._repeated += 1
+                    return
+                self._close_repeats()
+                self._last = key
+                self._last_levelno = record.levelno
+
+                bucket = self._buckets.get(record.levelno)
+                if bucket is not None and not bucket.take():
+                    if not self._rate_limited:
+                        self._rate_limited_at = self._timestamp(record)
+                    self._rate_limited += 1
+                    self.dropped += 1
+                    return
+
+                self._append(self.format(record), record.levelno)
             except Exception as e:
                 import sys
 
                 sys.print_exception(e)
+
+    def flush(self):
+        """Publish the buffered records as one message."""
+        self._close_repeats()
+        if self._rate_limited:
+            self._append(
+                self._summary(
+                    self._rate_limited_at,
+                    "WARNING",
+                    __name__,
+                    "%d log records dropped by rate limit" % self._rate_limited,
+                ),
+                logging.WARNING,
+            )
+            self._rate_limited = 0
+        if not self._buffer:
+            return
+
+        qos = 0
+        priority = PRIORITY_LOW
+        if self._max_levelno >= logging.WARNING:
+            qos = 1
+            priority = PRIORITY_HIGH
+        payload = "[" + ",".join(self._buffer) + "]"
+        self._buffer.clear()
+        self._buffer_bytes = 0
+        self._max_levelno = 0
+        self.provider.publish(
+            self.topic, payload, qos=qos, retain=False, priority=priority
+        )
+
+    def _append(self, msg: str, levelno: int):
+        self._buffer.append(msg)
+        self._buffer_bytes += len(msg) + 1
+        if levelno > self._max_levelno:
+            self._max_levelno = levelno
+        # Stay within the memory budget by dropping the oldest records
+        while self._buffer_bytes > self.max_bytes and len(self._buffer) > 1:
+            self._buffer_bytes -= len(self._buffer.pop(0)) + 1
+            self.dropped += 1
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def _close_repeats(self):
+        if self._repeated:
+            name, levelname, _ = self._last
+            self._append(
+                self._summary(
+                    self._repeated_at,
+                    levelname,
+                    name,
+                    "Last message repeated %d times" % self._repeated,
+                ),
+                self._last_levelno,
+            )
+            self._repeated = 0
+        self._last = None
+
+    def _timestamp(self, record: logging.LogRecord) -> str:
+        return self.formatter.formatTime(self.formatter.datefmt, record)
+
+    def _summary(self, timestamp: str, levelname: str, name: str, message: str) -> str:
+        return json.dumps(
+            {
+                "timestamp": timestamp,
+                "level": levelname,
+                "name": name,
+                "message": message,
+            }
+        )
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+        except Exception as e:
+            import sys
+
+            sys.print_exception(e)
+        finally:
+            self._flush_task = None
@@ -0,0 +1,187 @@
+import asyncio
+import gc
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from picosense.system.log import get_logger, set_level_floor
+from picosense.system.metrics import Histogram
+
+logger = get_logger(__name__)
+
+# Memory levels, each one degrades further to save RAM
+MEMORY_OK = 0
+MEMORY_LOW = 1
+MEMORY_CRITICAL = 2
+
+# Lowest log level per memory level, debug logging is dropped first
+_LEVEL_FLOORS = (0, logging.INFO, logging.WARNING)
+
+MemoryLevelCallback = Callable[[int], Any]
+
+
+def largest_free_block(limit: int, resolution: int = 256) -> int:
+    """
+    Estimate the largest block that can be allocated, up to limit bytes.
+
+    MicroPython does not report heap fragmentation, so this bisects with
+    trial allocations. Run it right after a collection, while nothing else
+    is allocating, and collect again afterwards to free the trial blocks.
+    """
+    low = 0
+    high = limit
+    while high - low > resolution:
+        size = (low + high) // 2
+        try:
+            bytearray(size)
+            low = size
+        except MemoryError:
+            high = size
+    return low
+
+
+class MemoryGovernor:
+    """
+    Schedules garbage collection and degrades behaviour while memory is low.
+
+    Collections are run in gaps of the reader schedule, so that they do not
+    land in the middle of an I2C read or a publish, at most every interval
+    seconds. After each collection the free heap decides the memory level,
+    and once it runs low also the largest free block. The level drops as
+    soon as either falls below its threshold and only recovers once free
+    memory exceeds the threshold by recover_margin, so it does not flap.
+
+    On a level change debug logging is dropped, the provider shrinks its
+    queue and batches harder, and the registered callbacks are called with
+    the new level.
+
+    Attributes:
+        low_free (int): Free bytes below which the level is MEMORY_LOW.
+        critical_free (int): Free bytes below which it is MEMORY_CRITICAL.
+        min_block (int): Largest free block below which the level is at
+            least MEMORY_LOW, as a fragmented heap fails large allocations.
+        min_gap_ms (int): Shortest gap before the next reading to collect in.
+        interval (float): Minimum seconds between collections.
+        recover_margin (float): Fraction above a threshold to recover.
+        level (int): Current memory level.
+    """
+
+    def __init__(
+        self,
+        manager: Any,
+        provider: Optional[Any] = None,
+        low_free: int = 32768,
+        critical_free: int = 16384,
+        min_block: int = 4096,
+        min_gap_ms: int = 50,
+        interval: float = 5,
+        recover_margin: float = 0.25,
+    ):
+        self.manager = manager
+        self.provider = provider
+        self.low_free = low_free
+        self.critical_free = critical_free
+        self.min_block = min_block
+        self.min_gap_ms = min_gap_ms
+        self.interval = interval
+        self.recover_margin = recover_margin
+        self.level = MEMORY_OK
+        self._callbacks: List[MemoryLevelCallback] = []
+        self._task = None
+        self._gc_ms = Histogram()
+        self._stats = {
+            "mem_free": 0,
+            "largest_free": 0,
+            "level": MEMORY_OK,
+            "collections": 0,
+            "level_changes": 0,
+        }
+
+    def add_callback(self, callback: MemoryLevelCallback):
+        logger.debug("Registering callback %s", callback)
+        self._callbacks.append(callback)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def metrics(self) -> Dict[str, Any]:
+        metrics: Dict[str, Any] = dict(self._stats)
+        metrics["gc_ms"] = self._gc_ms
+        return metrics
+
+    def collect(self) -> int:
+        """Collect garbage, measure the heap and return the memory level."""
+        start = time.ticks_ms()
+        gc.collect()
+        self._gc_ms.observe(time.ticks_diff(time.ticks_ms(), start))
+        free = gc.mem_free()
+        self._stats["collections"] += 1
+        self._stats["mem_free"] = free
+        largest = None
+        if free < self.low_free:
+            # Fragmentation only matters once memory runs low. The trial
+            # blocks are collected right away so that they do not bring the
+            # next collection forward into a read or publish.
+            largest = largest_free_block(min(free, self.min_block * 2))
+            gc.collect()
+            self._stats["largest_free"] = largest
+
+        level = self._level_for(free, largest)
+        if level != self.level:
+            self._set_level(level, free, largest)
+        return level
+
+    def _level_for(self, free: int, largest: Optional[int]) -> int:
+        # Leaving a level needs some headroom above its threshold
+        critical_free = self.critical_free
+        if self.level >= MEMORY_CRITICAL:
+            critical_free *= 1 + self.recover_margin
+        low_free = self.low_free
+        if self.level >= MEMORY_LOW:
+            low_free *= 1 + self.recover_margin
+        if free < critical_free:
+            return MEMORY_CRITICAL
+        if free < low_free or (largest is not None and largest < self.min_block):
+            return MEMORY_LOW
+        return MEMORY_OK
+
+    def _set_level(self, level: int, free: int, largest: Optional[int]):
+        if level > self.level:
+            logger.warning(
+                "Memory level %d: %d bytes free, largest block %s",
+                level,
+                free,
+                largest,
+            )
+        else:
+            logger.info("Memory level %d: %d bytes free", level, free)
+        self.level = level
+        self._stats["level"] = level
+        self._stats["level_changes"] += 1
+        set_level_floor(_LEVEL_FLOORS[level])
+        if self.provider is not None:
+            self.provider.set_memory_level(level)
+        for callback in self._callbacks:
+            try:
+                callback(level)
+            except Exception as e:
+                logger.error("Memory level callback failed: %s", e)
+
+    async def _run(self):
+        while True:
+            # Wait for a gap between readings that is long enough
+            while True:
+                delay = self.manager.next_deadline_ms()
+                if delay is None or delay >= self.min_gap_ms:
+                    break
+                await asyncio.sleep_ms(max(delay, 0) + self.min_gap_ms)
+            try:
+                self.collect()
+            except Exception as e:
+                logger.error("Memory check failed: %s", e)
+            await asyncio.sleep(self.interval)
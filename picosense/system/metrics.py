@@ -0,0 +1,167 @@
+import array
+import asyncio
+import gc
+import json
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from picosense.system.log import get_logger
+
+logger = get_logger(__name__)
+
+# Upper bounds in ms of the histogram buckets, values above the last bound
+# are counted in an overflow bucket
+DEFAULT_BOUNDS_MS: Tuple[int, ...] = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+MetricsSource = Callable[[], Dict[str, Any]]
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets.
+
+    Counts live in a preallocated array, so observe() does not allocate.
+
+    Attributes:
+        bounds (tuple): Inclusive upper bound of each bucket.
+        count (int): Number of observed values.
+        sum (int): Sum of observed values.
+        max (int): Largest observed value.
+    """
+
+    def __init__(self, bounds: Tuple[int, ...] = DEFAULT_BOUNDS_MS):
+        self.bounds = bounds
+        self._counts = array.array("L", [0] * (len(bounds) + 1))
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value: int) -> None:
+        bounds = self.bounds
+        i = 0
+        n = len(bounds)
+        while i < n and value > bounds[i]:
+            i += 1
+        self._counts[i] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def reset(self) -> None:
+        for i in range(len(self._counts)):
+            self._counts[i] = 0
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return the histogram as a dict.
+
+        counts has one more entry than le, the last one counts the values
+        above the last bound.
+        """
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "le": self.bounds,
+            "counts": list(self._counts),
+        }
+
+
+class Metrics:
+    """
+    Periodically publishes runtime metrics as one JSON message.
+
+    Each message contains free and allocated heap, a histogram of event loop
+    lag and the dict returned by every registered source, e.g. the reader
+    histograms of SensorReaderManager.metrics(). Histograms in the message are
+    reset after publishing, so they cover one interval.
+
+    Attributes:
+        provider (MQTTMessagingProvider): Provider used to publish metrics.
+        topic (str): Subtopic to publish metrics to.
+        interval (int): Seconds between messages.
+        lag_interval_ms (int): Period of the loop lag probe.
+        slept_ms (callable): Optional, returns the total ms the CPU spent in
+            lightsleep, which is not counted as loop lag.
+    """
+
+    def __init__(
+        self,
+        provider: Any,
+        topic: str,
+        interval: int = 60,
+        lag_interval_ms: int = 100,
+        slept_ms: Optional[Callable[[], int]] = None,
+    ):
+        self.provider = provider
+        self.topic = topic
+        self.interval = interval
+        self.lag_interval_ms = lag_interval_ms
+        self.slept_ms = slept_ms
+        self.loop_lag_ms = Histogram()
+        self._sources: Dict[str, MetricsSource] = {}
+        self._tasks = []
+
+    def add_source(self, name: str, source: MetricsSource) -> None:
+        """Include the dict returned by source under name in every message."""
+        self._sources[name] = source
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._publish_loop()),
+            asyncio.create_task(self._measure_loop_lag()),
+        ]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def collect(self) -> Dict[str, Any]:
+        """Return the current metrics and reset their histograms."""
+        metrics = {
+            "timestamp": time.time(),
+            "mem_free": gc.mem_free(),
+            "mem_alloc": gc.mem_alloc(),
+            "loop_lag_ms": self.loop_lag_ms.to_dict(),
+        }
+        self.loop_lag_ms.reset()
+        for name, source in self._sources.items():
+            metrics[name] = _snapshot(source())
+        return metrics
+
+    async def _publish_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.provider.publish(self.topic, json.dumps(self.collect()), qos=0)
+            except Exception as e:
+                logger.error("Failed to publish metrics: %s", e)
+
+    async def _measure_loop_lag(self):
+        # How much later than requested the loop resumes a sleeping task
+        slept_ms = self.slept_ms
+        while True:
+            start = time.ticks_ms()
+            slept = slept_ms() if slept_ms is not None else 0
+            await asyncio.sleep_ms(self.lag_interval_ms)
+            lag = time.ticks_diff(time.ticks_ms(), start) - self.lag_interval_ms
+            if slept_ms is not None:
+                # The whole loop stops during a lightsleep, that is no stall
+                lag -= slept_ms() - slept
+            self.loop_lag_ms.observe(max(0, lag))
+
+
+def _snapshot(value: Any) -> Any:
+    # Replace histograms by their dicts and reset them for the next interval
+    if isinstance(value, Histogram):
+        data = value.to_dict()
+        value.reset()
+        return data
+    if isinstance(value, dict):
+        return {key: _snapshot(item) for key, item in value.items()}
+    return value
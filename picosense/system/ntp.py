@@ -0,0 +1,114 @@
+import socket
+import struct
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+import machine
+import uasyncio as asyncio
+
+from picosense.system.log import get_logger
+
+logger = get_logger(__name__)
+
+# Seconds between the NTP epoch (1900) and the MicroPython epoch
+if time.gmtime(0)[0] == 2000:
+    NTP_DELTA = 3155673600
+else:
+    NTP_DELTA = 2208988800
+
+# Host -> resolved address, getaddrinfo() blocks the event loop
+_addresses = {}
+
+
+def _resolve(host: str):
+    # MicroPython has no asynchronous DNS lookup, so a host is only resolved
+    # once. Configure an IP address to avoid the lookup altogether.
+    addr = _addresses.get(host)
+    if addr is None:
+        addr = socket.getaddrinfo(host, 123)[0][-1]
+        _addresses[host] = addr
+    return addr
+
+
+async def _query(addr, timeout_ms: int, poll_interval_ms: int) -> bytes:
+    query = bytearray(48)
+    # Leap indicator 0, version 3, client mode
+    query[0] = 0x1B
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.setblocking(False)
+        s.sendto(query, addr)
+        start = time.ticks_ms()
+        while True:
+            try:
+                return s.recv(48)
+            except OSError:
+                if time.ticks_diff(time.ticks_ms(), start) >= timeout_ms:
+                    raise asyncio.TimeoutError()
+                await asyncio.sleep_ms(poll_interval_ms)
+    finally:
+        s.close()
+
+
+async def settime_async(
+    host: str = "pool.ntp.org",
+    attempts: int = 3,
+    attempt_timeout_ms: int = 1500,
+    poll_interval_ms: int = 20,
+):
+    """
+    Set the RTC from an NTP server without blocking the event loop.
+
+    Does the same as ntptime.settime() but waits for the answer with a
+    non-blocking socket, so it can run concurrently with other boot phases.
+    A lost query is repeated up to attempts times, the caller bounds the
+    total wait, e.g. with asyncio.wait_for().
+
+    Raises:
+        OSError: If the host cannot be resolved or reached.
+        asyncio.TimeoutError: If no attempt was answered.
+    """
+    addr = _resolve(host)
+    for attempt in range(1, attempts + 1):
+        try:
+            msg = await _query(addr, attempt_timeout_ms, poll_interval_ms)
+            break
+        except (asyncio.TimeoutError, OSError) as e:
+            if attempt == attempts:
+                raise
+            logger.debug("NTP attempt %d failed: %s", attempt, repr(e))
+    # Transmit timestamp, seconds part
+    t = struct.unpack("!I", msg[40:44])[0] - NTP_DELTA
+    tm = time.gmtime(t)
+    machine.RTC().datetime((tm[0], tm[1], tm[2], tm[6] + 1, tm[3], tm[4], tm[5], 0))
+
+
+async def keep_time(
+    host: str = "pool.ntp.org",
+    interval: float = 86400,
+    retry_interval: float = 60,
+    timeout: float = 5,
+    synced: bool = False,
+    wait_connected: Optional[Callable[[], Awaitable[Any]]] = None,
+):
+    """
+    Re-sync the RTC every interval seconds, run as a background task.
+
+    Until a sync succeeds, e.g. because the boot phase failed, it is retried
+    every retry_interval seconds instead. wait_connected, if given, is
+    awaited before each sync so that no attempt is made while the network
+    is down or powered off.
+    """
+    while True:
+        await asyncio.sleep(interval if synced else retry_interval)
+        if wait_connected is not None:
+            await wait_connected()
+        try:
+            await asyncio.wait_for(settime_async(host), timeout)
+            synced = True
+            logger.debug("Synchronised time with %s", host)
+        except (asyncio.TimeoutError, OSError) as e:
+            synced = False
+            logger.warning(
+                "Time sync failed, retrying in %ss: %s", retry_interval, repr(e)
+            )
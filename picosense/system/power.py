@@ -0,0 +1,150 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import machine
+
+from picosense.system.log import get_logger
+from picosense.system.metrics import Histogram
+
+logger = get_logger(__name__)
+
+
+class PowerManager:
+    """
+    Duty cycles the device between sensor readings.
+
+    The messaging provider is paused and the radio powered down between
+    uploads, readings are queued by the provider in the meantime and
+    uploaded in a burst every upload_interval seconds. When no reader is due
+    for at least min_sleep_ms, the CPU enters machine.lightsleep() until
+    shortly before the earliest reader deadline.
+
+    lightsleep() stops the whole event loop, so other periodic tasks, e.g.
+    metrics or the log flush, run late while the device sleeps.
+
+    Attributes:
+        upload_interval (float): Seconds between uploads.
+        lightsleep (bool): Sleep the CPU between readings, otherwise only
+            the radio is powered down.
+        min_sleep_ms (int): Shortest gap worth entering lightsleep for.
+        wake_margin_ms (int): Time to wake up before a reader is due.
+        connect_timeout (float): Time to bring up the network and broker.
+        upload_timeout (float): Time to deliver the buffered messages.
+    """
+
+    def __init__(
+        self,
+        manager: Any,
+        provider: Any,
+        upload_interval: float = 300,
+        connect_network: Optional[Callable[[], Awaitable[Any]]] = None,
+        disconnect_network: Optional[Callable[[], Any]] = None,
+        lightsleep: bool = True,
+        min_sleep_ms: int = 100,
+        wake_margin_ms: int = 20,
+        connect_timeout: float = 15,
+        upload_timeout: float = 30,
+    ):
+        self.manager = manager
+        self.provider = provider
+        self.upload_interval = upload_interval
+        self._connect_network = connect_network
+        self._disconnect_network = disconnect_network
+        self.lightsleep = lightsleep
+        self.min_sleep_ms = min_sleep_ms
+        self.wake_margin_ms = wake_margin_ms
+        self.connect_timeout = connect_timeout
+        self.upload_timeout = upload_timeout
+        self._task = None
+        self._upload_ms = Histogram()
+        self._stats = {
+            "sleeps": 0,
+            "slept_ms": 0,
+            "uploads": 0,
+            "upload_failures": 0,
+        }
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def slept_ms(self) -> int:
+        """Return the total time spent in lightsleep."""
+        return self._stats["slept_ms"]
+
+    def metrics(self) -> Dict[str, Any]:
+        metrics: Dict[str, Any] = dict(self._stats)
+        metrics["upload_ms"] = self._upload_ms
+        return metrics
+
+    async def upload(self) -> bool:
+        """Bring the radio up, deliver everything buffered and power down."""
+        start = time.ticks_ms()
+        ok = False
+        try:
+            if self._connect_network is not None:
+                await asyncio.wait_for(self._connect_network(), self.connect_timeout)
+            self.provider.resume()
+            await asyncio.wait_for(
+                self.provider.wait_connected(), self.connect_timeout
+            )
+            await asyncio.wait_for(self.provider.flush(), self.upload_timeout)
+            ok = True
+        except asyncio.TimeoutError:
+            logger.warning("Upload timed out, keeping messages buffered")
+        except Exception as e:
+            logger.warning("Upload failed, keeping messages buffered: %s", e)
+        await self._power_down()
+        duration = time.ticks_diff(time.ticks_ms(), start)
+        if ok:
+            self._stats["uploads"] += 1
+            self._upload_ms.observe(duration)
+            logger.debug("Upload finished in %dms", duration)
+        else:
+            self._stats["upload_failures"] += 1
+        return ok
+
+    async def _power_down(self):
+        await self.provider.pause()
+        if self._disconnect_network is not None:
+            try:
+                self._disconnect_network()
+            except OSError as e:
+                logger.warning("Failed to power down network: %s", e)
+
+    async def _run(self):
+        interval_ms = int(self.upload_interval * 1000)
+        logger.info("Power saving enabled, uploading every %ss", self.upload_interval)
+        await self._power_down()
+        next_upload = time.ticks_add(time.ticks_ms(), interval_ms)
+        while True:
+            until_upload = time.ticks_diff(next_upload, time.ticks_ms())
+            if until_upload <= 0:
+                await self.upload()
+                next_upload = time.ticks_add(next_upload, interval_ms)
+                if time.ticks_diff(next_upload, time.ticks_ms()) <= 0:
+                    # The upload took longer than the interval
+                    next_upload = time.ticks_add(time.ticks_ms(), interval_ms)
+                continue
+
+            delay = self.manager.next_deadline_ms()
+            if delay is None or delay > until_upload:
+                delay = until_upload
+            delay -= self.wake_margin_ms
+            if self.lightsleep and delay >= self.min_sleep_ms:
+                # Let tasks that are ready finish before the loop stops
+                await asyncio.sleep_ms(0)
+                start = time.ticks_ms()
+                machine.lightsleep(delay)
+                self._stats["sleeps"] += 1
+                self._stats["slept_ms"] += time.ticks_diff(time.ticks_ms(), start)
+                # Give the readers that are due now a chance to run
+                await asyncio.sleep_ms(0)
+            else:
+                # A reader is due or still busy, or the gap is too short
+                await asyncio.sleep_ms(max(delay, 10))
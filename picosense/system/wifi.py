@@ -2,6 +2,11 @@ import time
 import network
 import rp2
 
+import uasyncio as asyncio
+
+from picosense.system.log import get_logger
+
+logger = get_logger(__name__)
 
 wlan = network.WLAN(network.STA_IF)
 
@@ -12,3 +17,123 @@ def connect_wifi(ssid, password, country):
     wlan.connect(ssid, password)
     while not wlan.isconnected():
         time.sleep(1)
+
+
+async def connect_wifi_async(ssid, password, country, poll_interval_ms=100):
+    """
+    Connect to WiFi without blocking the event loop.
+
+    Raises:
+        OSError: If association fails, e.g. because of a wrong password.
+    """
+    rp2.country(country)
+    wlan.active(True)
+    if wlan.isconnected():
+        return
+    wlan.connect(ssid, password)
+    while not wlan.isconnected():
+        # Negative status values are failures, e.g. STAT_WRONG_PASSWORD
+        status = wlan.status()
+        if status < 0:
+            raise OSError("WiFi connection failed with status %d" % status)
+        await asyncio.sleep_ms(poll_interval_ms)
+
+
+def disconnect_wifi():
+    """Disconnect and power down the WiFi radio."""
+    wlan.disconnect()
+    wlan.active(False)
+
+
+class WiFiConnection:
+    """
+    Keeps the WLAN associated from a background task.
+
+    An association that fails or drops later is retried every
+    retry_interval seconds, so that the MQTT provider can reconnect once the
+    network is back. The power manager uses connect() and disconnect() to
+    power the radio up and down, no retries are made in between.
+
+    Attributes:
+        connect_timeout (float): Time one association attempt may take.
+        retry_interval (float): Seconds between failed attempts.
+        check_interval (float): Seconds between connection checks.
+    """
+
+    def __init__(
+        self,
+        ssid: str,
+        password: str,
+        country: str,
+        connect_timeout: float = 15,
+        retry_interval: float = 10,
+        check_interval: float = 5,
+    ):
+        self.ssid = ssid
+        self.password = password
+        self.country = country
+        self.connect_timeout = connect_timeout
+        self.retry_interval = retry_interval
+        self.check_interval = check_interval
+        # Cleared while the radio is powered down on purpose
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+        # Set to retry right away instead of at the next check
+        self._wake = asyncio.Event()
+        self._task = None
+
+    @property
+    def is_connected(self) -> bool:
+        return wlan.isconnected()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def wait_connected(self, poll_interval_ms: int = 100):
+        while not wlan.isconnected():
+            await asyncio.sleep_ms(poll_interval_ms)
+
+    async def connect(self):
+        """Power the radio up again and wait for the association."""
+        self._resumed.set()
+        self._wake.set()
+        self.start()
+        await self.wait_connected()
+
+    def disconnect(self):
+        """Power the radio down until connect() is called."""
+        self._resumed.clear()
+        disconnect_wifi()
+
+    async def _run(self):
+        while True:
+            await self._resumed.wait()
+            if not wlan.isconnected():
+                try:
+                    await asyncio.wait_for(
+                        connect_wifi_async(self.ssid, self.password, self.country),
+                        self.connect_timeout,
+                    )
+                    logger.info("Connected to WiFi %s", self.ssid)
+                except (asyncio.TimeoutError, OSError) as e:
+                    logger.warning(
+                        "WiFi association failed, retrying in %ss: %s",
+                        self.retry_interval,
+                        repr(e),
+                    )
+                    await self._sleep(self.retry_interval)
+                    continue
+            await self._sleep(self.check_interval)
+
+    async def _sleep(self, seconds: float):
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
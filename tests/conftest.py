@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Run against the MicroPython stand-ins used by the benchmark
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "bench", "stubs"))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+sys.path.insert(0, ROOT)
+
+import compat  # noqa: E402,F401
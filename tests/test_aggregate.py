@@ -0,0 +1,112 @@
+import asyncio
+import random
+
+from picosense.sensors.aggregate import (
+    Aggregator,
+    RollingWindow,
+    base_metric,
+    window_suffix,
+)
+from picosense.sensors.reader import Measurement, Reading
+
+
+def _reading(timestamp, **values):
+    return Reading(
+        [Measurement(name, "", value) for name, value in values.items()],
+        timestamp,
+        "sensor",
+    )
+
+
+def _aggregate(aggregator, readings):
+    forwarded = []
+
+    async def collect(reading):
+        forwarded.append({m.name: m.value for m in reading.measurements})
+
+    async def feed():
+        aggregator.add_callback(collect)
+        for reading in readings:
+            await aggregator.process(reading)
+
+    asyncio.run(feed())
+    return forwarded
+
+
+def test_window_matches_samples():
+    rng = random.Random(1)
+    window = RollingWindow(capacity=8, window=60)
+    samples = []
+    for t in range(0, 600, 3):
+        value = float(rng.randint(0, 1000))
+        window.append(t, value)
+        samples.append((t, value))
+        window.expire(t)
+        # Buckets expire as a whole, so up to width - 1 seconds are missing
+        inside = [v for ts, v in samples if ts > t - 60]
+        live = [v for ts, v in samples if ts > t - 60 + (window.width - 1)]
+        assert len(live) <= len(window) <= len(inside)
+        if len(window) == len(inside):
+            assert window.min() == min(inside)
+            assert window.max() == max(inside)
+            assert abs(window.mean() - sum(inside) / len(inside)) < 1e-3
+        assert window.last() == value
+
+
+def test_long_window_keeps_every_sample():
+    # An hour of readings every 5s does not fit 32 samples, but 32 buckets
+    window = RollingWindow(capacity=32, window=3600)
+    for t in range(0, 7200, 5):
+        window.append(t, float(t))
+    window.expire(7195)
+    assert 720 - window.width // 5 <= len(window) <= 720
+    assert window.max() == 7195.0
+    assert window.min() <= 3600.0 + window.width
+
+
+def test_window_gap_expires_everything():
+    window = RollingWindow(capacity=4, window=60)
+    window.append(0, 1.0)
+    window.append(1000, 2.0)
+    window.expire(1000)
+    assert len(window) == 1
+    assert window.min() == window.max() == 2.0
+
+
+def test_multiple_windows():
+    aggregator = Aggregator(window=(60, 300), interval=60, stats=("mean", "max"))
+    readings = [_reading(t, co2=float(t)) for t in range(0, 301, 10)]
+    forwarded = _aggregate(aggregator, readings)
+    assert len(forwarded) == 5
+    last = forwarded[-1]
+    assert sorted(last) == ["co2_max_1m", "co2_max_5m", "co2_mean_1m", "co2_mean_5m"]
+    assert last["co2_max_1m"] == last["co2_max_5m"] == 300.0
+    assert last["co2_mean_1m"] == sum(range(250, 301, 10)) / 6
+    assert last["co2_mean_5m"] == sum(range(10, 301, 10)) / 30
+
+
+def test_single_window_names():
+    forwarded = _aggregate(
+        Aggregator(window=60, stats=("mean",)),
+        [_reading(t, co2=400.0) for t in range(0, 61, 10)],
+    )
+    assert forwarded == [{"co2_mean": 400.0}]
+
+
+def test_missing_metric_left_out():
+    readings = [_reading(0, temperature=21.0), _reading(10, gas=1000.0)]
+    readings += [_reading(t, temperature=21.0) for t in range(20, 200, 10)]
+    forwarded = _aggregate(Aggregator(window=60, stats=("max",)), readings)
+    # The gas samples expire from the window, temperature keeps its state
+    assert forwarded[0] == {"temperature_max": 21.0, "gas_max": 1000.0}
+    assert forwarded[-1] == {"temperature_max": 21.0}
+
+
+def test_names():
+    assert window_suffix(30) == "30s"
+    assert window_suffix(300) == "5m"
+    assert window_suffix(3600) == "1h"
+    assert base_metric("co2_concentration_mean") == "co2_concentration"
+    assert base_metric("co2_concentration_max_5m") == "co2_concentration"
+    assert base_metric("co2_concentration") is None
+    assert base_metric("pm2_5m") is None
@@ -0,0 +1,144 @@
+import asyncio
+import struct
+
+import pytest
+from fake_i2c import FakeI2C, FakeI2CDevice
+
+from picosense.sensors.bme688 import BME688Wrapper
+from picosense.system.i2c import I2CBus
+
+# Calibration of a real sensor
+PAR_T = (26097, 26413, 3)
+PAR_P = (36340, -10394, 88, 7330, -151, 30, 41, -2360, -3059, 30)
+PAR_H = (764, 1013, 0, 45, 20, 120, -100)
+PAR_GH = (-38, -10540, 18)
+RES_HEAT_VAL = 47
+RES_HEAT_RANGE = 1
+
+ADC_TEMPERATURE = 500000
+ADC_PRESSURE = 350000
+ADC_HUMIDITY = 25000
+ADC_GAS = 700
+GAS_RANGE = 5
+
+
+def _device(heater_stable=True):
+    device = FakeI2CDevice({0xD0: 0x61})
+    t1, t2, t3 = PAR_T
+    p1, p2, p3, p4, p5, p6, p7, p8, p9, p10 = PAR_P
+    h1, h2, h3, h4, h5, h6, h7 = PAR_H
+    gh1, gh2, gh3 = PAR_GH
+    # Register addresses from the BME688 datasheet
+    device.set(0x8A, struct.pack("<hb", t2, t3))
+    device.set(0x8E, struct.pack("<Hhb", p1, p2, p3))
+    device.set(0x94, struct.pack("<hhbb", p4, p5, p7, p6))
+    device.set(0x9C, struct.pack("<hhB", p8, p9, p10))
+    device.set(0xE1, bytes((h2 >> 4, (h2 & 0x0F) << 4 | h1 & 0x0F, h1 >> 4)))
+    device.set(0xE4, struct.pack("<bbbBb", h3, h4, h5, h6, h7))
+    device.set(0xE9, struct.pack("<Hhbb", t1, gh2, gh1, gh3))
+    device.set(0x00, struct.pack("<b", RES_HEAT_VAL))
+    device.set(0x02, bytes((RES_HEAT_RANGE << 4,)))
+
+    status = 0x20 | (0x10 if heater_stable else 0)
+    field = bytearray(17)
+    field[0] = 0x80
+    field[2:5] = (
+        ADC_PRESSURE >> 12,
+        ADC_PRESSURE >> 4 & 0xFF,
+        ADC_PRESSURE << 4 & 0xF0,
+    )
+    field[5:8] = (
+        ADC_TEMPERATURE >> 12,
+        ADC_TEMPERATURE >> 4 & 0xFF,
+        ADC_TEMPERATURE << 4 & 0xF0,
+    )
+    field[8:10] = struct.pack(">H", ADC_HUMIDITY)
+    field[15:17] = (ADC_GAS >> 2, (ADC_GAS & 0x03) << 6 | status | GAS_RANGE)
+    device.set(0x1D, field)
+    return device
+
+
+def _expected():
+    """Compensate the raw values with the formulas of the BME68x API."""
+    t1, t2, t3 = PAR_T
+    var1 = (ADC_TEMPERATURE / 16384.0 - t1 / 1024.0) * t2
+    var2 = (ADC_TEMPERATURE / 131072.0 - t1 / 8192.0) ** 2 * (t3 * 16.0)
+    t_fine = var1 + var2
+    temperature = t_fine / 5120.0
+
+    p1, p2, p3, p4, p5, p6, p7, p8, p9, p10 = PAR_P
+    var1 = t_fine / 2.0 - 64000.0
+    var2 = var1 * var1 * (p6 / 131072.0)
+    var2 = var2 + var1 * p5 * 2.0
+    var2 = var2 / 4.0 + p4 * 65536.0
+    var1 = (p3 * var1 * var1 / 16384.0 + p2 * var1) / 524288.0
+    var1 = (1.0 + var1 / 32768.0) * p1
+    pressure = 1048576.0 - ADC_PRESSURE
+    pressure = (pressure - var2 / 4096.0) * 6250.0 / var1
+    var1 = p9 * pressure * pressure / 2147483648.0
+    var2 = pressure * (p8 / 32768.0)
+    var3 = (pressure / 256.0) ** 3 * (p10 / 131072.0)
+    pressure = pressure + (var1 + var2 + var3 + p7 * 128.0) / 16.0
+
+    h1, h2, h3, h4, h5, h6, h7 = PAR_H
+    var1 = ADC_HUMIDITY - (h1 * 16.0 + h3 / 2.0 * temperature)
+    var2 = var1 * (
+        h2
+        / 262144.0
+        * (1.0 + h4 / 16384.0 * temperature + h5 / 1048576.0 * temperature**2)
+    )
+    var3 = h6 / 16384.0
+    var4 = h7 / 2097152.0
+    humidity = var2 + (var3 + var4 * temperature) * var2 * var2
+
+    gas = 1000000.0 * (262144 >> GAS_RANGE) / ((ADC_GAS - 512) * 3 + 4096)
+    return temperature, humidity, pressure / 100, gas
+
+
+def _read(device):
+    i2c = FakeI2C()
+    i2c.add_device(0x77, device)
+    sensor = BME688Wrapper(I2CBus(i2c), heater_duration_ms=1)
+    return sensor, asyncio.run(sensor.read())
+
+
+def test_compensated_values():
+    sensor, reading = _read(_device())
+    values = {m.name: m.value for m in reading.measurements}
+    temperature, humidity, pressure, gas = _expected()
+    assert values["temperature"] == pytest.approx(temperature)
+    assert values["relative_humidity"] == pytest.approx(humidity)
+    assert values["pressure"] == pytest.approx(pressure)
+    assert values["gas_resistance"] == pytest.approx(gas)
+    # Plausible for the calibration of a real sensor
+    assert 15 < temperature < 35
+    assert 0 < humidity < 100
+    assert 900 < pressure < 1100
+
+
+def test_forced_measurement_started():
+    device = _device()
+    _read(device)
+    writes = dict(device.writes)
+    assert writes[0xE0] == b"\xb6"
+    # Gas enabled, then forced mode with the configured oversampling
+    assert writes[0x71] == b"\x20"
+    assert writes[0x74][0] & 0x03 == 0x01
+    assert 0 < writes[0x5A][0] < 255
+
+
+def test_unstable_heater_leaves_out_gas():
+    sensor, reading = _read(_device(heater_stable=False))
+    names = [m.name for m in reading.measurements]
+    assert names == ["temperature", "relative_humidity", "pressure"]
+    assert reading.measurements[0].value == pytest.approx(_expected()[0])
+
+
+def test_missing_new_data():
+    device = _device()
+    device.registers[0x1D] = 0
+    i2c = FakeI2C()
+    i2c.add_device(0x77, device)
+    sensor = BME688Wrapper(I2CBus(i2c), heater_duration_ms=1, max_polls=2)
+    with pytest.raises(OSError):
+        asyncio.run(sensor.read())
@@ -0,0 +1,82 @@
+import asyncio
+import random
+
+from broker import Broker
+
+from picosense.messaging.brokers import Backoff
+from picosense.messaging.mqtt import MQTTMessagingProvider
+
+
+def test_backoff_cap_and_jitter():
+    random.seed(1)
+    backoff = Backoff(base=1, cap=8)
+    steps = (1, 2, 4, 8, 8, 8, 8)
+    delays = [backoff.next() for _ in steps]
+    for delay, step in zip(delays, steps):
+        # Drawn from the upper half of the step, never above the cap
+        assert step / 2 <= delay <= step
+    # Delays of the same step differ between attempts
+    assert len(set(delays[3:])) == 4
+    backoff.reset()
+    assert backoff.next() <= 1
+
+
+async def _wait_for(condition, timeout_ms=5000):
+    for _ in range(timeout_ms // 20):
+        if condition():
+            return
+        await asyncio.sleep_ms(20)
+    raise AssertionError("Timed out")
+
+
+def test_failover_and_failback():
+    received = []
+
+    def on_message(topic, payload, arrival_us):
+        received.append(topic)
+
+    async def run():
+        primary = Broker(on_message=on_message)
+        fallback = Broker(on_message=on_message)
+        primary_port = await primary.start()
+        fallback_port = await fallback.start()
+        provider = MQTTMessagingProvider(
+            "test",
+            "lab",
+            "127.0.0.1",
+            primary_port,
+            connect_timeout=1,
+            watchdog_interval_ms=20,
+            fallback_brokers=[("127.0.0.1", fallback_port)],
+            backoff_cap=0.5,
+            failback_interval=1,
+        )
+        provider.start()
+        try:
+            await _wait_for(lambda: provider.is_connected)
+            assert provider._brokers.current.port == primary_port
+
+            # Fail over once the primary goes away
+            primary.close()
+            await _wait_for(lambda: fallback.connects == 1)
+            await _wait_for(lambda: provider.is_connected)
+            assert provider._brokers.current.port == fallback_port
+            assert provider._brokers.brokers[0].failures > 0
+            provider.publish("test", "during failover")
+            await _wait_for(lambda: fallback.messages)
+
+            # Fail back once the primary is reachable again
+            await primary.start(port=primary_port)
+            await _wait_for(lambda: primary.connects == 2)
+            await _wait_for(lambda: provider.is_connected)
+            assert provider._brokers.current.port == primary_port
+            assert provider._brokers.brokers[0].failures == 0
+            assert provider._backoff.attempt == 0
+        finally:
+            provider.stop()
+            await provider.disconnect()
+            primary.close()
+            fallback.close()
+
+    asyncio.run(run())
+    assert any(topic.endswith("/test") for topic in received)
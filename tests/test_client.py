@@ -0,0 +1,55 @@
+import asyncio
+
+from picosense.messaging.client import AsyncMQTTClient
+
+
+class BufferedWriter:
+    """Behaves like MicroPython's Stream, drain() empties the write buffer."""
+
+    def __init__(self):
+        self.out_buf = b""
+        self.sent = b""
+
+    def write(self, data):
+        self.out_buf += bytes(data)
+
+    async def drain(self):
+        # Like MicroPython, the buffer is sent in several steps and only
+        # cleared once all of it was sent
+        data = self.out_buf
+        for offset in range(0, len(data), 4):
+            await asyncio.sleep(0)
+            self.sent += data[offset : offset + 4]
+        self.out_buf = b""
+
+
+def _connected_client():
+    client = AsyncMQTTClient("test", "localhost")
+    client._writer = BufferedWriter()
+    client._connected = True
+    return client
+
+
+def test_concurrent_writes_are_not_lost():
+    client = _connected_client()
+    messages = [("sensors/%d" % i, b"x" * 20, False, 0) for i in range(5)]
+    expected = b"".join(client._publish_packet(*m, 0) for m in messages)
+
+    async def run():
+        await asyncio.gather(client.publish_many(messages), client.ping())
+
+    asyncio.run(run())
+    sent = client._writer.sent
+    assert len(sent) == len(expected) + 2
+    # The PINGREQ is written before or after the whole batch, never inside
+    assert sent in (expected + b"\xc0\x00", b"\xc0\x00" + expected)
+
+
+def test_publish_many_tracks_qos1_in_flight():
+    client = _connected_client()
+    messages = [("a", b"1", False, 1), ("b", b"2", False, 0)]
+
+    pids = asyncio.run(client.publish_many(messages))
+
+    assert pids[0] is not None and pids[1] is None
+    assert list(client._inflight) == [pids[0]]
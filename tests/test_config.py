@@ -0,0 +1,45 @@
+import json
+import os
+
+EXAMPLE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "examples",
+    "config.json",
+)
+
+
+def _load(path):
+    # Duplicate keys would silently hide a misplaced section
+    def no_duplicates(pairs):
+        keys = [key for key, _ in pairs]
+        assert len(keys) == len(set(keys)), keys
+        return dict(pairs)
+
+    with open(path) as f:
+        return json.load(f, object_pairs_hook=no_duplicates)
+
+
+def test_example_top_level_sections():
+    config = _load(EXAMPLE)
+    assert set(config) == {
+        "device_id",
+        "location",
+        "mqtt",
+        "network",
+        "led",
+        "ntp",
+        "i2c",
+        "sensors",
+        "aggregate",
+        "deadband",
+        "power",
+        "memory",
+        "metrics",
+        "logging",
+    }
+
+
+def test_example_deadband_section():
+    deadband = _load(EXAMPLE)["deadband"]
+    assert set(deadband) == {"heartbeat", "metrics"}
+    assert "co2_concentration" in deadband["metrics"]
@@ -0,0 +1,92 @@
+import asyncio
+
+from picosense.sensors.aggregate import Aggregator
+from picosense.sensors.deadband import DeadbandFilter, Threshold
+from picosense.sensors.reader import Reading
+
+
+def _run_chain(values, deadband, aggregator=None):
+    forwarded = []
+
+    async def collect(reading):
+        forwarded.append({m.name: m.value for m in reading.measurements})
+
+    deadband.add_callback(collect)
+    stage = deadband.process
+    if aggregator is not None:
+        aggregator.add_callback(deadband.process)
+        stage = aggregator.process
+
+    async def feed():
+        reading = Reading.from_layout((("co2_concentration", "ppm"),), "scd41")
+        for i, value in enumerate(values):
+            reading.measurements[0].value = value
+            reading.timestamp = 1000 + i * 60
+            await stage(reading)
+
+    asyncio.run(feed())
+    return forwarded
+
+
+def test_constant_value_suppressed():
+    deadband = DeadbandFilter({"co2_concentration": Threshold(absolute=20)})
+    assert len(_run_chain([400.0] * 9, deadband)) == 1
+
+
+def test_change_forwarded():
+    deadband = DeadbandFilter({"co2_concentration": Threshold(absolute=20)})
+    forwarded = _run_chain([400.0, 405.0, 430.0], deadband)
+    assert [f["co2_concentration"] for f in forwarded] == [400.0, 430.0]
+
+
+def test_heartbeat():
+    deadband = DeadbandFilter(
+        {"co2_concentration": Threshold(absolute=20)}, heartbeat=120
+    )
+    assert len(_run_chain([400.0] * 5, deadband)) == 3
+
+
+def test_aggregates_use_metric_threshold():
+    # Aggregates are named after their metric, e.g. co2_concentration_mean
+    deadband = DeadbandFilter(
+        {"co2_concentration": Threshold(absolute=20)}, partial=False
+    )
+    aggregator = Aggregator(window=60, interval=60)
+    forwarded = _run_chain([400.0] * 9, deadband, aggregator)
+    assert len(forwarded) == 1
+    assert forwarded[0]["co2_concentration_mean"] == 400.0
+
+
+def test_aggregate_threshold_overrides_metric():
+    deadband = DeadbandFilter(
+        {
+            "co2_concentration": Threshold(absolute=1000),
+            "co2_concentration_max": Threshold(absolute=1),
+        }
+    )
+    aggregator = Aggregator(window=60, interval=60)
+    forwarded = _run_chain([400.0, 400.0, 405.0], deadband, aggregator)
+    assert [list(f) for f in forwarded[1:]] == [["co2_concentration_max"]]
+
+
+def test_missing_metric_keeps_state():
+    # A BME688 reading leaves out the gas resistance while the heater is
+    # not stable, the other metrics must not be reported again because of it
+    deadband = DeadbandFilter({"temperature": Threshold(absolute=1)})
+    full = Reading.from_layout((("temperature", "C"), ("gas_resistance", "Ohm")))
+    partial = Reading.from_layout((("temperature", "C"),))
+    forwarded = []
+
+    async def collect(reading):
+        forwarded.append([m.name for m in reading.measurements])
+
+    async def feed():
+        deadband.add_callback(collect)
+        for i, reading in enumerate((full, partial, full, partial)):
+            reading.measurements[0].value = 20.0
+            reading.timestamp = 1000 + i
+            await deadband.process(reading)
+
+    asyncio.run(feed())
+    # gas_resistance has no threshold, so it is forwarded whenever present
+    assert forwarded == [["temperature", "gas_resistance"], ["gas_resistance"]]
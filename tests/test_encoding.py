@@ -0,0 +1,94 @@
+import math
+import struct
+
+import pytest
+
+from picosense.messaging.encoding import (
+    FIRST_DYNAMIC_ID,
+    WELL_KNOWN_METRICS,
+    Schema,
+    StructEncoder,
+    decode_batch,
+    decode_measurement,
+)
+
+
+def _roundtrip_schema(schema):
+    # Consumers decode against the retained schema message
+    return Schema.from_json(schema.to_json())
+
+
+def test_measurement_known_id():
+    schema = Schema()
+    payload = StructEncoder(schema).measurement("temperature", "C", 21.5, 1000)
+    assert payload[5] == WELL_KNOWN_METRICS["temperature"]
+    assert decode_measurement(payload, _roundtrip_schema(schema)) == {
+        "name": "temperature",
+        "value": 21.5,
+        "unit": "C",
+        "timestamp": 1000,
+    }
+
+
+def test_measurement_dynamic_ids():
+    schema = Schema()
+    encoder = StructEncoder(schema)
+    first = encoder.measurement("voc_index", "", 100.0, 1)
+    second = encoder.measurement("nox_index", "", 1.0, 2)
+    assert first[5] == FIRST_DYNAMIC_ID
+    assert second[5] == FIRST_DYNAMIC_ID + 1
+    decoded = _roundtrip_schema(schema)
+    assert decode_measurement(first, decoded)["name"] == "voc_index"
+    assert decode_measurement(second, decoded)["name"] == "nox_index"
+
+
+def test_measurement_nan():
+    schema = Schema()
+    payload = StructEncoder(schema).measurement("gas_resistance", "Ohm", math.nan, 5)
+    assert math.isnan(decode_measurement(payload, schema)["value"])
+
+
+def test_batch_framing():
+    schema = Schema()
+    names = ["co2_concentration", "temperature", "voc_index"]
+    units = ["ppm", "C", ""]
+    rows = [[10, 400.0, 20.5, 1.0], [25, 410.0, math.nan, 2.0]]
+    payload = StructEncoder(schema).batch(names, units, rows)
+
+    # Header, one ID per metric, then a timestamp and the values per row
+    assert len(payload) == 3 + len(names) + len(rows) * 4 * (1 + len(names))
+    assert struct.unpack_from("<BBB", payload) == (1, 3, 2)
+
+    decoded = decode_batch(payload, _roundtrip_schema(schema))
+    assert decoded["names"] == names
+    assert decoded["units"] == units
+    assert decoded["readings"][0] == rows[0]
+    assert decoded["readings"][1][:2] == rows[1][:2]
+    assert math.isnan(decoded["readings"][1][2])
+    assert decoded["readings"][1][3] == rows[1][3]
+
+
+def test_batch_too_large():
+    with pytest.raises(ValueError):
+        StructEncoder(Schema()).batch(["a"] * 256, [""] * 256, [])
+
+
+def test_unsupported_version():
+    schema = Schema()
+    payload = StructEncoder(schema).measurement("temperature", "C", 1.0, 1)
+    payload[0] = 99
+    with pytest.raises(ValueError):
+        decode_measurement(payload, schema)
+
+
+def test_persisted_dynamic_ids(tmp_path):
+    path = str(tmp_path / "schema.json")
+    schema = Schema(path)
+    payload = StructEncoder(schema).measurement("voc_index", "", 3.0, 1)
+
+    # After a reboot a different metric shows up first
+    rebooted = Schema(path)
+    assert StructEncoder(rebooted).measurement("nox_index", "", 1.0, 2)[5] == (
+        FIRST_DYNAMIC_ID + 1
+    )
+    assert decode_measurement(payload, rebooted)["name"] == "voc_index"
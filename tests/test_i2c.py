@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from fake_i2c import FakeI2C, FakeI2CDevice
+
+from picosense.system.i2c import I2CBus
+
+
+def _bus(coalesce_ms=0):
+    i2c = FakeI2C()
+    i2c.add_device(0x10, FakeI2CDevice({0x00: 0x2A}))
+    i2c.add_device(0x20, FakeI2CDevice())
+    return I2CBus(i2c, coalesce_ms=coalesce_ms)
+
+
+def test_transactions_are_serialised():
+    bus = _bus()
+    events = []
+
+    async def access(device, addr):
+        async with bus.transaction(device) as i2c:
+            events.append(("enter", device))
+            i2c.readfrom_mem(addr, 0x00, 1)
+            await asyncio.sleep_ms(5)
+            events.append(("exit", device))
+
+    async def run():
+        await asyncio.gather(access("a", 0x10), access("b", 0x20), access("a", 0x10))
+
+    asyncio.run(run())
+    assert len(events) == 6
+    # Every transaction exits before the next one enters
+    for i in range(0, 6, 2):
+        assert events[i][0] == "enter"
+        assert events[i + 1] == ("exit", events[i][1])
+
+
+def test_coalescing_window():
+    bus = _bus(coalesce_ms=30)
+    order = []
+
+    async def access(device, delay_ms):
+        await asyncio.sleep_ms(delay_ms)
+        async with bus.transaction(device):
+            order.append(device)
+
+    async def run():
+        # b becomes due while a holds the idle bus open, so both share it
+        await asyncio.gather(access("a", 0), access("b", 10))
+        await asyncio.sleep_ms(50)
+        await access("c", 0)
+
+    asyncio.run(run())
+    assert order == ["a", "b", "c"]
+    assert bus.stats()["windows"] == 2
+
+
+def test_device_stats():
+    bus = _bus()
+    bus.i2c.devices[0x20].fail = True
+
+    async def run():
+        async with bus.transaction("a") as i2c:
+            assert i2c.readfrom_mem(0x10, 0x00, 1) == b"\x2a"
+            await asyncio.sleep_ms(5)
+        with pytest.raises(OSError):
+            async with bus.transaction("b") as i2c:
+                i2c.readfrom_mem(0x20, 0x00, 1)
+        with pytest.raises(OSError):
+            # No device at that address
+            async with bus.transaction("c") as i2c:
+                i2c.readfrom_mem(0x30, 0x00, 1)
+
+    asyncio.run(run())
+    devices = bus.stats()["devices"]
+    assert devices["a"]["transactions"] == 1
+    assert devices["a"]["errors"] == 0
+    assert devices["a"]["bus_time_us"] >= 5000
+    assert devices["b"]["transactions"] == 1
+    assert devices["b"]["errors"] == 1
+    assert devices["c"]["errors"] == 1
+    # The bus is free again after the errors
+    assert not bus._lock.locked()
@@ -0,0 +1,90 @@
+import asyncio
+
+import machine
+
+from picosense.system import led as led_module
+from picosense.system.led import LED, STATE_OK
+
+
+class RecordingPin(machine.Pin):
+    """Stub Pin that records every value it is set to."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = [self._value]
+
+    def on(self):
+        super().on()
+        self.values.append(1)
+
+    def off(self):
+        super().off()
+        self.values.append(0)
+
+
+def _led(monkeypatch):
+    monkeypatch.setattr(led_module.machine, "Pin", RecordingPin)
+    led = LED(0)
+    # The stub has no PWM, like the Pico W on-board LED
+    assert not led.has_pwm
+    return led
+
+
+def test_pattern_transitions(monkeypatch):
+    led = _led(monkeypatch)
+
+    async def run():
+        led.play(((100, 10), (0, 10), (50, 10)), repeat=2)
+        await asyncio.sleep_ms(100)
+
+    asyncio.run(run())
+    # Any brightness above 0 is on, the LED is off after the last repeat
+    assert led.__pin__.values == [0, 1, 0, 1, 1, 0, 1, 0]
+    assert not led.state
+    assert led._task is None
+
+
+def test_blink_returns_immediately(monkeypatch):
+    led = _led(monkeypatch)
+
+    async def run():
+        led.blink(interval=0.02, iterations=0)
+        # Nothing ran yet, blinking happens in the background task
+        assert led.__pin__.values == [0]
+        await asyncio.sleep_ms(50)
+        task = led._task
+        assert task is not None and not task.done()
+        led.off()
+        return task
+
+    task = asyncio.run(run())
+    assert task.cancelled()
+    assert led.__pin__.values.count(1) >= 2
+
+
+def test_set_state_and_off_cancel(monkeypatch):
+    led = _led(monkeypatch)
+
+    async def run():
+        led.blink(interval=0.02)
+        first = led._task
+        led.set_state(STATE_OK)
+        second = led._task
+        await asyncio.sleep_ms(0)
+        assert first.cancelled()
+        assert led.device_state == STATE_OK
+        # The same state does not restart the pattern
+        led.set_state(STATE_OK)
+        assert led._task is second
+        led.off()
+        await asyncio.sleep_ms(0)
+        assert second.cancelled()
+        assert led._task is None
+        assert led.device_state is None
+        values = list(led.__pin__.values)
+        await asyncio.sleep_ms(50)
+        # Nothing plays after off()
+        assert led.__pin__.values == values
+        assert led.__pin__.values[-1] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+from picosense.system.metrics import Metrics
+
+
+def _lag(slept_ms):
+    total = [0]
+    metrics = Metrics(
+        None,
+        "metrics",
+        lag_interval_ms=20,
+        slept_ms=(lambda: total[0]) if slept_ms else None,
+    )
+
+    async def sleeper():
+        # Stands in for machine.lightsleep(), which stops the whole loop
+        for _ in range(3):
+            await asyncio.sleep_ms(30)
+            start = time.ticks_ms()
+            time.sleep(0.2)
+            total[0] += time.ticks_diff(time.ticks_ms(), start)
+
+    async def run():
+        metrics.start()
+        await sleeper()
+        await asyncio.sleep_ms(50)
+        metrics.stop()
+
+    asyncio.run(run())
+    return metrics.loop_lag_ms
+
+
+def test_lightsleep_is_not_loop_lag():
+    lag = _lag(slept_ms=True)
+    assert lag.count > 3
+    assert lag.max < 100
+
+
+def test_stalls_are_loop_lag():
+    lag = _lag(slept_ms=False)
+    assert lag.max >= 150
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from picosense.outbox import SEGMENT_SUFFIX, Outbox
+
+
+def _segment(path):
+    names = [n for n in os.listdir(path) if n.endswith(SEGMENT_SUFFIX)]
+    assert len(names) == 1
+    return os.path.join(path, names[0])
+
+
+def _write(path, messages):
+    outbox = Outbox(str(path))
+    for message in messages:
+        outbox.append(message)
+    outbox.flush()
+    return _segment(str(path))
+
+
+def test_round_trip(tmp_path):
+    _write(tmp_path, [("a/b", b"1", 1, False), ("c", "2", 0, True)])
+    outbox = Outbox(str(tmp_path))
+    assert outbox.read(10) == [("a/b", b"1", 1, False), ("c", b"2", 0, True)]
+    outbox.ack()
+    assert outbox.read(10) == []
+
+
+def _truncate(path, message, keep):
+    """Cut the last record, message, down to its first keep bytes."""
+    segment = _write(path, [("complete", b"payload", 1, False), message])
+    record = 5 + len(message[0]) + len(message[1])
+    with open(segment, "r+b") as f:
+        f.truncate(os.path.getsize(segment) - record + keep)
+    return Outbox(str(path)).read(10)
+
+
+@pytest.mark.parametrize("keep", [2, 5 + 3])
+def test_truncated_topic_is_not_returned(tmp_path, keep):
+    # A message without payload must not come back with a truncated topic
+    items = _truncate(tmp_path, ("measurements/co2", b"", 1, False), keep)
+    assert items == [("complete", b"payload", 1, False)]
+
+
+def test_truncated_payload_is_not_returned(tmp_path):
+    items = _truncate(tmp_path, ("co2", b"412.5", 1, False), 5 + 3 + 2)
+    assert items == [("complete", b"payload", 1, False)]
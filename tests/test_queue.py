@@ -0,0 +1,147 @@
+import asyncio
+
+import pytest
+
+from picosense.queue import (
+    OVERFLOW_DROP_NEWEST,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_PRIORITY,
+    PRIORITY_HIGH,
+    PRIORITY_LOW,
+    PRIORITY_NORMAL,
+    Queue,
+)
+
+
+def _drain(queue):
+    items = []
+    while queue.qsize():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_ring_wraps_around():
+    queue = Queue(maxsize=3)
+    for i in range(10):
+        queue.put_nowait(i)
+        queue.put_nowait(i + 100)
+        assert queue.get_nowait() == i
+        assert queue.get_nowait() == i + 100
+    assert queue.qsize() == 0
+    assert queue.dropped == 0
+    assert queue.high_water == 2
+    with pytest.raises(IndexError):
+        queue.get_nowait()
+
+
+def test_get_many():
+    queue = Queue(maxsize=4)
+
+    async def run():
+        # Waits for the first item, then returns what is there
+        waiter = asyncio.create_task(queue.get_many(3))
+        await asyncio.sleep_ms(0)
+        assert not waiter.done()
+        for i in range(2):
+            queue.put_nowait(i)
+        first = await waiter
+        for i in range(2, 7):
+            queue.put_nowait(i)
+        return first, await queue.get_many(3), await queue.get_many(3)
+
+    first, second, third = asyncio.run(run())
+    assert first == [0, 1]
+    # 2 was evicted when 6 was put into the full queue
+    assert second == [3, 4, 5]
+    assert third == [6]
+
+
+def test_drop_oldest():
+    queue = Queue(maxsize=3, overflow=OVERFLOW_DROP_OLDEST)
+    # Start off the beginning of the ring so eviction wraps around
+    queue.put_nowait("x")
+    queue.get_nowait()
+    results = [queue.put_nowait(i) for i in range(5)]
+    assert results == [True] * 5
+    assert _drain(queue) == [2, 3, 4]
+    assert queue.dropped == 2
+    assert queue.high_water == 3
+
+
+def test_drop_newest():
+    queue = Queue(maxsize=3, overflow=OVERFLOW_DROP_NEWEST)
+    results = [queue.put_nowait(i) for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert _drain(queue) == [0, 1, 2]
+    assert queue.dropped == 2
+
+
+def test_priority_evicts_oldest_lowest():
+    queue = Queue(maxsize=4, overflow=OVERFLOW_PRIORITY)
+    queue.put_nowait("x")
+    queue.put_nowait("y")
+    queue.get_nowait()
+    queue.get_nowait()
+    # The ring now starts at index 2, so the items wrap around
+    queue.put_nowait("n1", PRIORITY_NORMAL)
+    queue.put_nowait("l1", PRIORITY_LOW)
+    queue.put_nowait("n2", PRIORITY_NORMAL)
+    queue.put_nowait("l2", PRIORITY_LOW)
+
+    assert queue.put_nowait("h1", PRIORITY_HIGH)
+    assert queue.put_nowait("n3", PRIORITY_NORMAL)
+    # Only normal and high priority items are left, a low one is discarded
+    assert not queue.put_nowait("l3", PRIORITY_LOW)
+    assert queue.put_nowait("h2", PRIORITY_HIGH)
+    # Items of the same priority are not evicted for each other
+    assert not queue.put_nowait("n4", PRIORITY_NORMAL)
+
+    assert _drain(queue) == ["n2", "h1", "n3", "h2"]
+    assert queue.dropped == 5
+    assert queue.high_water == 4
+
+
+def test_resize_shrink_keeps_policy():
+    queue = Queue(maxsize=5, overflow=OVERFLOW_DROP_OLDEST)
+    queue.put_nowait("x")
+    queue.get_nowait()
+    for i in range(5):
+        queue.put_nowait(i)
+    queue.resize(3)
+    assert queue.maxsize == 3
+    assert queue.dropped == 2
+    assert queue.high_water == 5
+    queue.put_nowait(5)
+    assert _drain(queue) == [3, 4, 5]
+    assert queue.dropped == 3
+
+
+def test_resize_shrink_priority():
+    queue = Queue(maxsize=4, overflow=OVERFLOW_PRIORITY)
+    for item, priority in (("l", 0), ("h", 2), ("n", 1), ("h2", 2)):
+        queue.put_nowait(item, priority)
+    queue.resize(2)
+    # The items are put in order, so the lower priority ones make room
+    assert _drain(queue) == ["h", "h2"]
+    assert queue.dropped == 2
+
+
+def test_resize_grow():
+    queue = Queue(maxsize=2, overflow=OVERFLOW_DROP_NEWEST)
+    queue.put_nowait("x")
+    queue.get_nowait()
+    queue.put_nowait(0)
+    queue.put_nowait(1)
+    queue.resize(4)
+    queue.put_nowait(2)
+    queue.put_nowait(3)
+    assert not queue.put_nowait(4)
+    assert _drain(queue) == [0, 1, 2, 3]
+    assert queue.stats() == {
+        "size": 0,
+        "maxsize": 4,
+        "high_water": 4,
+        "dropped": 1,
+    }
+    with pytest.raises(ValueError):
+        queue.resize(0)
@@ -0,0 +1,308 @@
+"""
+Build precompiled .mpy files of picosense for deploying to the Pico.
+
+Runs on the host with CPython 3.9 or later:
+
+    python tools/build.py                  # strip typing and compile to .mpy
+    python tools/build.py --deploy         # and replace the package on the board
+    python tools/build.py --no-compile     # only write the stripped sources
+
+The sources are first rewritten without typing imports, annotations and type
+aliases. MicroPython ignores annotations, but importing typing and
+typing_extensions costs RAM and boot time on the device. The stripped
+sources are compiled with mpy-cross into build/mpy, boot.py and main.py are
+kept as source since MicroPython only runs those as .py files.
+
+build/manifest.py freezes the stripped package into a firmware image, which
+moves the bytecode from RAM to flash:
+
+    make -C ports/rp2 BOARD=RPI_PICO_W FROZEN_MANIFEST=/path/to/build/manifest.py
+
+tools/profile_imports.py reports the import time and RAM of each module on
+the device, e.g. to compare .py and .mpy builds.
+"""
+
+import argparse
+import ast
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "picosense"
+# Run as source on the device
+SCRIPTS = ("boot.py", "main.py")
+TYPING_MODULES = ("typing", "typing_extensions")
+
+MANIFEST = """\
+# Generated by tools/build.py
+include("{base_manifest}")
+require("logging")
+require("time")
+package("{package}", base_path="{base_path}")
+"""
+
+
+def _uses_typing(node, names, modules):
+    """Return True if node references a typing name or module attribute."""
+    for n in ast.walk(node):
+        if isinstance(n, ast.Name) and n.id in names:
+            return True
+        if (
+            isinstance(n, ast.Attribute)
+            and isinstance(n.value, ast.Name)
+            and n.value.id in modules
+        ):
+            return True
+    return False
+
+
+class TypingStripper(ast.NodeTransformer):
+    """
+    Remove typing imports, annotations and the type aliases built from them.
+
+    Attributes:
+        removed (dict): Module name -> type alias names removed from it, so
+            that imports of those aliases can be removed from other modules.
+    """
+
+    def __init__(self, removed):
+        self.removed = removed
+        self.names = set()
+        self.modules = set()
+        self.aliases = set()
+
+    def strip(self, tree, module):
+        self.names = set()
+        self.modules = set()
+        self.aliases = set()
+        tree = self.visit(tree)
+        self.removed[module] = self.aliases
+        # Anything typing that is still referenced is used at runtime
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Name, ast.Attribute)) and _uses_typing(
+                node, self.names, self.modules
+            ):
+                raise ValueError("%s:%d uses typing at runtime" % (module, node.lineno))
+        return ast.fix_missing_locations(tree)
+
+    def visit_Import(self, node):
+        kept = []
+        for alias in node.names:
+            if alias.name in TYPING_MODULES:
+                self.modules.add(alias.asname or alias.name)
+            else:
+                kept.append(alias)
+        if not kept:
+            return None
+        node.names = kept
+        return node
+
+    def visit_ImportFrom(self, node):
+        if node.module in TYPING_MODULES:
+            self.names.update(alias.asname or alias.name for alias in node.names)
+            return None
+        aliases = self.removed.get(node.module, ())
+        kept = []
+        for alias in node.names:
+            if alias.name in aliases:
+                self.names.add(alias.asname or alias.name)
+            else:
+                kept.append(alias)
+        if not kept:
+            return None
+        node.names = kept
+        return node
+
+    def visit_FunctionDef(self, node):
+        for arg in node.args.posonlyargs + node.args.args + node.args.kwonlyargs:
+            arg.annotation = None
+        if node.args.vararg:
+            node.args.vararg.annotation = None
+        if node.args.kwarg:
+            node.args.kwarg.annotation = None
+        node.returns = None
+        self.generic_visit(node)
+        return node
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_AnnAssign(self, node):
+        if node.value is None:
+            # A bare declaration, e.g. "name: str" in a class body
+            return None
+        return ast.copy_location(
+            ast.Assign(targets=[node.target], value=node.value), node
+        )
+
+    def visit_Assign(self, node):
+        # Type aliases, e.g. "Callback = Callable[[Reading], Awaitable[None]]"
+        if (
+            len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+            and _uses_typing(node.value, self.names, self.modules)
+        ):
+            self.aliases.add(node.targets[0].id)
+            self.names.add(node.targets[0].id)
+            return None
+        return node
+
+    def generic_visit(self, node):
+        super().generic_visit(node)
+        # Bodies that only held declarations need a statement
+        if isinstance(node, ast.ClassDef) and not node.body:
+            node.body = [ast.Pass()]
+        return node
+
+
+def _module_name(path):
+    name = os.path.splitext(os.path.relpath(path, ROOT))[0].replace(os.sep, ".")
+    return name[: -len(".__init__")] if name.endswith(".__init__") else name
+
+
+def find_sources():
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(os.path.join(ROOT, PACKAGE)):
+        dirnames[:] = sorted(d for d in dirnames if d != "__pycache__")
+        for filename in sorted(filenames):
+            if filename.endswith(".py"):
+                sources.append(os.path.join(dirpath, filename))
+    return sources
+
+
+def _import_order(trees):
+    """Order modules so that each comes after the modules it imports from."""
+    order = []
+    visiting = set()
+
+    def visit(module):
+        if module in order or module in visiting:
+            return
+        visiting.add(module)
+        for node in ast.walk(trees[module]):
+            if isinstance(node, ast.ImportFrom) and node.module in trees:
+                visit(node.module)
+        visiting.discard(module)
+        order.append(module)
+
+    for module in sorted(trees):
+        visit(module)
+    return order
+
+
+def strip_sources(paths, out_dir):
+    """Write typing-free copies of paths below out_dir and return them."""
+    trees = {}
+    files = {}
+    for path in paths:
+        module = _module_name(path)
+        with open(path) as f:
+            trees[module] = ast.parse(f.read(), path)
+        files[module] = path
+
+    stripper = TypingStripper({})
+    written = []
+    # Aliases are removed before the modules that import them are stripped
+    for module in _import_order(trees):
+        tree = stripper.strip(trees[module], module)
+        out = os.path.join(out_dir, os.path.relpath(files[module], ROOT))
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        with open(out, "w") as f:
+            f.write(ast.unparse(tree) + "\n")
+        written.append(out)
+    return written
+
+
+def find_mpy_cross(path=None):
+    if path:
+        return [path]
+    found = shutil.which("mpy-cross")
+    if found:
+        return [found]
+    try:
+        import mpy_cross  # noqa: F401
+
+        return [sys.executable, "-m", "mpy_cross"]
+    except ImportError:
+        raise SystemExit(
+            "mpy-cross not found, install it with 'pip install mpy-cross' or "
+            "pass --mpy-cross"
+        )
+
+
+def compile_sources(sources, src_dir, out_dir, mpy_cross, march):
+    for src in sources:
+        rel = os.path.relpath(src, src_dir)
+        out = os.path.join(out_dir, os.path.splitext(rel)[0] + ".mpy")
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        # -s sets the file name in tracebacks to the path on the device
+        cmd = mpy_cross + ["-march=" + march, "-s", rel, "-o", out, src]
+        subprocess.run(cmd, check=True)
+
+
+def write_manifest(path, src_dir, base_manifest):
+    with open(path, "w") as f:
+        f.write(
+            MANIFEST.format(
+                base_manifest=base_manifest, package=PACKAGE, base_path=src_dir
+            )
+        )
+
+
+def deploy(out_dir, device=None):
+    mpremote = ["mpremote"]
+    if device:
+        mpremote += ["connect", device]
+    # MicroPython imports a .py before a .mpy of the same name, so sources
+    # from an earlier install would shadow the build. Fails harmlessly if
+    # the package is not on the board yet.
+    subprocess.run(mpremote + ["rm", "-r", ":" + PACKAGE], cwd=out_dir)
+    cmd = mpremote + ["cp", "-r", PACKAGE, ":", "+", "cp"] + list(SCRIPTS) + [":"]
+    subprocess.run(cmd, check=True, cwd=out_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--out", default=os.path.join(ROOT, "build"))
+    parser.add_argument("--mpy-cross", help="Path of the mpy-cross binary")
+    parser.add_argument("--march", default="armv6m", help="armv6m for the RP2040")
+    parser.add_argument(
+        "--no-compile", action="store_true", help="Only write stripped sources"
+    )
+    parser.add_argument(
+        "--base-manifest",
+        default="$(PORT_DIR)/boards/manifest.py",
+        help="Port manifest included by the frozen manifest",
+    )
+    parser.add_argument(
+        "--deploy", action="store_true", help="Copy the build with mpremote"
+    )
+    parser.add_argument("--device", help="mpremote device, e.g. /dev/ttyACM0")
+    args = parser.parse_args(argv)
+
+    src_dir = os.path.join(args.out, "src")
+    mpy_dir = os.path.join(args.out, "mpy")
+    for path in (src_dir, mpy_dir):
+        shutil.rmtree(path, ignore_errors=True)
+
+    sources = strip_sources(find_sources(), src_dir)
+    scripts = strip_sources([os.path.join(ROOT, s) for s in SCRIPTS], src_dir)
+    print("Stripped %d modules into %s" % (len(sources) + len(scripts), src_dir))
+    write_manifest(os.path.join(args.out, "manifest.py"), src_dir, args.base_manifest)
+
+    if args.no_compile:
+        return
+    compile_sources(
+        sources, src_dir, mpy_dir, find_mpy_cross(args.mpy_cross), args.march
+    )
+    for script in scripts:
+        shutil.copy(script, mpy_dir)
+    print("Compiled %d modules into %s" % (len(sources), mpy_dir))
+
+    if args.deploy:
+        deploy(mpy_dir, args.device)
+
+
+if __name__ == "__main__":
+    main()
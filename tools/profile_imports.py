@@ -0,0 +1,75 @@
+"""
+Report the import time and RAM of each module on the device.
+
+Run it on a freshly reset board, against a .py or a .mpy build:
+
+    mpremote run tools/profile_imports.py
+
+Imports are timed through builtins.__import__, so each module is reported
+with its own cost, excluding the modules it imports itself:
+
+    us         Time spent importing the module
+    alloc      Bytes allocated while importing, including the compiler's
+               garbage for .py files
+    total_us   Same as us including nested imports
+"""
+
+import builtins
+import gc
+import sys
+import time
+
+# The startup path of main.py
+MODULES = ("picosense.picosense",)
+
+_import = builtins.__import__
+_results = []
+# [child us, child alloc] of each import in progress
+_stack = []
+
+
+def _profiled_import(name, *args):
+    if name in sys.modules:
+        return _import(name, *args)
+    _stack.append([0, 0])
+    start_alloc = gc.mem_alloc()
+    start = time.ticks_us()
+    try:
+        return _import(name, *args)
+    finally:
+        total_us = time.ticks_diff(time.ticks_us(), start)
+        total_alloc = gc.mem_alloc() - start_alloc
+        child_us, child_alloc = _stack.pop()
+        _results.append(
+            (name, total_us - child_us, total_alloc - child_alloc, total_us)
+        )
+        if _stack:
+            _stack[-1][0] += total_us
+            _stack[-1][1] += total_alloc
+
+
+def main():
+    gc.collect()
+    start_free = gc.mem_free()
+    # Collections during an import would make the allocations unmeasurable,
+    # the heap still collects if an allocation fails
+    gc.disable()
+    builtins.__import__ = _profiled_import
+    try:
+        for module in MODULES:
+            __import__(module)
+    finally:
+        builtins.__import__ = _import
+        gc.enable()
+    gc.collect()
+
+    print("%-40s %10s %10s %10s" % ("module", "us", "alloc", "total_us"))
+    for name, us, alloc, total_us in sorted(_results, key=lambda r: -r[1]):
+        print("%-40s %10d %10d %10d" % (name, us, alloc, total_us))
+    print(
+        "%d modules, %d bytes retained after collection"
+        % (len(_results), start_free - gc.mem_free())
+    )
+
+
+main()